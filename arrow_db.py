@@ -0,0 +1,126 @@
+"""
+arrow_db - Module for memory-mapped reads of Feather (Arrow IPC) databases.
+
+pd.read_feather reads the whole file into private memory and converts
+    every column to pandas. Here the file is memory-mapped instead: the
+    Arrow table points into the mapping, so reading it copies nothing and
+    processes reading the same history share the pages of the OS cache.
+    ArrowFrame converts a column to pandas the first time it is used.
+
+Functions:
+    open_table(fn, columns=None): Return the memory-mapped Arrow table of a file.
+    read(fn, columns=None): Read the columns into a DataFrame.
+    iter_chunks(fn, chunksize, columns=None): Read them in DataFrames of
+        at most `chunksize` rows.
+
+Classes:
+    ArrowFrame(table): A table whose columns are converted to pandas on use.
+
+Usage Example:
+    frame = ReadDb('wshazam.feather').read_arrow()
+    print(len(frame), frame.columns)
+    titles = frame['title']            # only this column is converted
+    df = frame[['title', 'artist']]
+
+Notes:
+    - Only uncompressed files are mapped without a copy; compressed record
+        batches are decompressed into memory. Write2Db writes Feather files
+        uncompressed (see util.WRITE_ARGS).
+    - Write2Db replaces the file by an atomic rename (see util.atomic_write),
+        so a mapping keeps the rows it was opened on until it is dropped.
+    - Numeric columns without nulls are converted without a copy, text
+        columns are copied into Python strings when converted.
+"""
+
+import pandas as pd
+import pyarrow as pa
+
+
+def _select(schema, columns):
+    # the stored columns among `columns`, in file order
+    return schema.names if columns is None else [c for c in schema.names
+                                                  if c in columns]
+
+
+def open_table(fn, columns=None):
+    """
+    Return the rows of the Feather file `fn` as an Arrow table backed by a
+    memory map of the file.
+
+    :param columns: The columns to keep, None for all of them
+    """
+    with pa.memory_map(fn) as source:
+        # the buffers of the table keep the mapping alive once it is closed
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(_select(table.schema, columns))
+
+
+def read(fn, columns=None):
+    """
+    Read the `columns` of the Feather file `fn` into a DataFrame, through
+    a memory map.
+    """
+    return open_table(fn, columns).to_pandas()
+
+
+def iter_chunks(fn, chunksize, columns=None):
+    """
+    Yield the rows of the Feather file `fn` in DataFrames of at most
+    `chunksize` rows, one record batch at a time.
+    """
+    with pa.memory_map(fn) as source:
+        reader = pa.ipc.open_file(source)
+        cols = _select(reader.schema, columns)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i).select(cols)
+            for start in range(0, batch.num_rows, chunksize):
+                yield batch.slice(start, chunksize).to_pandas()
+
+
+class ArrowFrame():
+    """
+    An Arrow table read like a DataFrame, one column at a time.
+    """
+
+    def __init__(self, table):
+        """
+        @param table: the pyarrow.Table, usually from open_table
+        """
+        self.table = table
+        self._series = {}
+
+    @property
+    def columns(self):
+        return list(self.table.column_names)
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __contains__(self, col):
+        return col in self.table.column_names
+
+    def __getitem__(self, key):
+        """
+        Return the column `key` as a Series, or the list of columns `key`
+        as a DataFrame, converting each column once.
+        """
+        if isinstance(key, str):
+            if key not in self._series:
+                if key not in self:
+                    raise KeyError(key)
+                self._series[key] = self.table.column(key).to_pandas().rename(key)
+            return self._series[key]
+        return pd.DataFrame({col: self[col] for col in key},
+                            index=pd.RangeIndex(len(self)))
+
+    def converted(self):
+        """
+        Return the names of the columns converted to pandas so far.
+        """
+        return list(self._series)
+
+    def to_pandas(self, columns=None):
+        """
+        Return the `columns`, all of them by default, as a DataFrame.
+        """
+        return self[self.columns if columns is None else list(columns)]
@@ -0,0 +1,166 @@
+"""
+db_lock - Module for locking a database file between processes.
+
+Several loggers (one per room) can write to the same database file. This
+    module serializes them with an advisory fcntl.flock lock taken on a
+    sidecar file `<db>.lock`: readers take it shared, so they never block
+    each other, and writers take it exclusive, so a writer waits for every
+    reader and writer and no reader sees a half written file. The sidecar
+    keeps the lock valid when the database itself is replaced by rename.
+
+Functions:
+    lock_stats(fn=None): Return the lock wait times, per file and mode.
+
+Classes:
+    DbLock(fn): The shared/exclusive lock of the database file `fn`.
+
+Usage Example:
+    lock = DbLock('wshazam.csv')
+    with lock.shared():
+        df = pd.read_csv('wshazam.csv')
+    with lock.exclusive():
+        df.to_csv('wshazam.csv', index=False)
+
+Notes:
+    - The locks are reentrant within a thread: a thread holding the
+        exclusive lock can take it again, or take the shared one, without
+        waiting (e.g. Write2Db reading the db back through ReadDb). A thread
+        holding only the shared lock cannot upgrade it and gets a
+        RuntimeError.
+    - flock locks belong to an open file, so threads of the same process
+        exclude each other just like processes do.
+    - Where fcntl is not available (Windows) a lock only serializes the
+        threads of the current process.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+LOCK_SUFFIX = '.lock'
+SHARED = 'shared'
+EXCLUSIVE = 'exclusive'
+
+
+class LockWaits():
+    """
+    Count and wait time of the acquisitions of a lock in one mode.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {'count': self.count, 'total': self.total, 'mean': mean,
+                'max': self.max}
+
+
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+# locks held by the current thread: lock file -> [mode, depth]
+_HELD = threading.local()
+# used instead of flock where fcntl is not available
+_LOCAL_LOCKS = {}
+
+
+def _record(path, mode, seconds):
+    with _STATS_LOCK:
+        waits = _STATS.setdefault(path, {SHARED: LockWaits(), EXCLUSIVE: LockWaits()})
+        waits[mode].add(seconds)
+
+
+def lock_stats(fn=None):
+    """
+    Return the time spent waiting for database locks.
+
+    :param fn: The database file, None for every file locked so far
+    :return: {mode: {'count', 'total', 'mean', 'max'}} for `fn`, or
+        {lock file: {mode: ...}} for every file
+    """
+    with _STATS_LOCK:
+        stats = {path: {mode: waits.as_dict() for mode, waits in modes.items()}
+                 for path, modes in _STATS.items()}
+    if fn is None:
+        return stats
+    empty = {mode: LockWaits().as_dict() for mode in (SHARED, EXCLUSIVE)}
+    return stats.get(os.path.abspath(fn) + LOCK_SUFFIX, empty)
+
+
+class DbLock():
+    """
+    A cross-process shared/exclusive lock of a database file.
+    """
+
+    def __init__(self, fn):
+        """
+        @param fn: the database file, locked through `<fn>.lock`
+        """
+        self.fn = fn
+        self.path = os.path.abspath(fn) + LOCK_SUFFIX
+
+    def _held(self):
+        if not hasattr(_HELD, 'locks'):
+            _HELD.locks = {}
+        return _HELD.locks
+
+    @contextmanager
+    def _lock(self, mode):
+        held = self._held()
+        if self.path in held:
+            if mode == EXCLUSIVE and held[self.path][0] == SHARED:
+                raise RuntimeError(f'{self.fn}: cannot upgrade a shared lock')
+            held[self.path][1] += 1
+            try:
+                yield self
+            finally:
+                held[self.path][1] -= 1
+            return
+        start = time.monotonic()
+        if fcntl is None:
+            lock = _LOCAL_LOCKS.setdefault(self.path, threading.Lock())
+            lock.acquire()
+            release = lock.release
+        else:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH if mode == SHARED else fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+
+            def release():
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        _record(self.path, mode, time.monotonic() - start)
+        held[self.path] = [mode, 1]
+        try:
+            yield self
+        finally:
+            del held[self.path]
+            release()
+
+    def shared(self):
+        """
+        Hold the lock shared, for reading; readers do not block each other.
+        """
+        return self._lock(SHARED)
+
+    def exclusive(self):
+        """
+        Hold the lock exclusive, for writing.
+        """
+        return self._lock(EXCLUSIVE)
@@ -0,0 +1,152 @@
+"""
+db_tools - Module for maintenance passes over a whole database.
+
+Every pass reads the database through ReadDb.iter_chunks and writes through
+    write_db_class.ChunkWriter, so it holds one chunk and, where needed,
+    the dedup keys in memory, whatever the size of the history.
+
+Functions:
+    rebuild_index(fn, chunksize=CHUNK_ROWS): Rebuild the dedup index of a database.
+    dedup(fn, out=None, chunksize=CHUNK_ROWS): Drop the rows whose dedup key repeats.
+    export(fn, out, chunksize=CHUNK_ROWS, columns=None, filters=None): Copy
+        the rows into another file, in the format of its extension.
+    stats(fn, chunksize=CHUNK_ROWS): Count the rows, tracks, artists and months.
+
+Usage Example:
+    db_tools.export('wshazam.csv', 'wshazam.parquet')
+    print(db_tools.stats('wshazam.parquet'))
+
+Command line:
+    python db_tools.py index|dedup|stats db_file
+    python db_tools.py dedup|export db_file out_file
+
+Notes:
+    - `dedup` without `out` replaces the database once the pass is over;
+        readers see the old file until then (see util.atomic_write). SQLite
+        databases are rewritten in place in one transaction instead, see
+        sqlite_db.rewrite.
+    - Exporting into a partitioned Parquet dataset (see parquet_dataset)
+        appends the rows as new part files.
+"""
+
+import os
+import sys
+from collections import Counter
+
+import parquet_dataset
+from db_lock import DbLock
+from dedup_index import frame_hashes, open_index
+from read_db import CHUNK_ROWS, ReadDb
+from util import KEY_COLUMNS, track_ids
+from write_db_class import ChunkWriter, iter_stored_keys
+
+STATS_COLUMNS = [*KEY_COLUMNS, parquet_dataset.TIMESTAMP]
+TOP_ARTISTS = 10
+
+
+def _frmt(fn):
+    return '.parquet' if parquet_dataset.is_dataset(fn) else os.path.splitext(fn)[1]
+
+
+def rebuild_index(fn, chunksize=CHUNK_ROWS):
+    """
+    Rebuild the dedup index (see dedup_index) of `fn` from its key columns.
+
+    :return: The number of keys in the index
+    """
+    with DbLock(fn).exclusive():
+        index = open_index(fn)
+        index.rebuild(h for chunk in iter_stored_keys(fn, _frmt(fn), chunksize)
+                      for h in frame_hashes(chunk))
+    return len(index)
+
+
+def dedup(fn, out=None, chunksize=CHUNK_ROWS):
+    """
+    Keep the first row of every dedup key of `fn`.
+
+    :param out: The file to write the rows to, `fn` itself by default
+    :return: {'read': rows read, 'kept': rows written}
+    """
+    if out is None and parquet_dataset.is_dataset(fn):
+        raise ValueError(f'{fn}: deduplicate a dataset into another file')
+    seen = set()
+    read = 0
+    with DbLock(fn).exclusive(), ChunkWriter(out or fn) as writer:
+        for chunk in ReadDb(fn).iter_chunks(chunksize):
+            read += len(chunk)
+            is_new = []
+            for h in frame_hashes(chunk):
+                is_new.append(h not in seen)
+                seen.add(h)
+            writer.write(chunk[is_new])
+    return {'read': read, 'kept': writer.rows}
+
+
+def export(fn, out, chunksize=CHUNK_ROWS, columns=None, filters=None):
+    """
+    Copy the rows of `fn` into `out`, converting the format.
+
+    :param columns: The columns to export, see ReadDb.read_db
+    :param filters: The rows to export, see ReadDb.read_db
+    :return: The number of rows written
+    """
+    chunks = ReadDb(fn).iter_chunks(chunksize, columns, filters)
+    if parquet_dataset.is_dataset(out):
+        rows = 0
+        with DbLock(out).exclusive():
+            for chunk in chunks:
+                parquet_dataset.append(out, chunk)
+                rows += len(chunk)
+        return rows
+    with ChunkWriter(out) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.rows
+
+
+def stats(fn, chunksize=CHUNK_ROWS):
+    """
+    Summarize the database `fn` in one pass over its key columns.
+
+    :return: {'rows', 'unique', 'with_trackid', 'top_artists', 'months'};
+        'months' maps 'YYYY-MM' to a row count, '0000-00' for rows without
+        a valid timestamp
+    """
+    rows = 0
+    with_id = 0
+    keys = set()
+    artists = Counter()
+    months = Counter()
+    for chunk in ReadDb(fn).iter_chunks(chunksize, columns=STATS_COLUMNS):
+        rows += len(chunk)
+        with_id += int(track_ids(chunk).notna().sum())
+        keys.update(frame_hashes(chunk))
+        if 'artist' in chunk.columns:
+            artists.update(chunk['artist'].dropna().astype(str))
+        periods = parquet_dataset.partition_keys(chunk)
+        months.update(f'{year:04d}-{month:02d}'
+                      for year, month in zip(periods['year'], periods['month']))
+    return {
+        'rows': rows,
+        'unique': len(keys),
+        'with_trackid': with_id,
+        'top_artists': artists.most_common(TOP_ARTISTS),
+        'months': dict(sorted(months.items())),
+    }
+
+
+COMMANDS = {
+    'index': rebuild_index,
+    'dedup': dedup,
+    'export': export,
+    'stats': stats,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) in (3, 4) and sys.argv[1] in COMMANDS:
+        print(COMMANDS[sys.argv[1]](*sys.argv[2:]))
+    else:
+        print('command line use is db_tools')
+        print(f'Usage: python {os.path.basename(sys.argv[0])} '
+              f'{"|".join(COMMANDS)} db_file [out_file]')
@@ -0,0 +1,239 @@
+"""
+dedup_index - Module for a persistent index of the dedup keys of a database.
+
+This module keeps, next to a database file, a sidecar file holding a 64-bit
+    dedup key of every stored row: the numeric Shazam track id (util.TRACK_ID)
+    when the row has one, otherwise a hash of its normalized text columns
+    (util.SUBSET). The top bit tells the two kinds apart, so an id can never
+    match a text hash.
+    The index is loaded once into a set, probed in O(1) per incoming row and
+    extended in place when new rows are committed, so finding duplicates
+    costs memory proportional to the number of keys rather than to the full
+    width of the rows.
+
+Functions:
+    key_hash(values): Hash a dedup key to a 64-bit integer.
+    frame_hashes(df, cols=SUBSET): Compute the dedup key of every row of a DataFrame.
+    drop_duplicate_keys(df): Drop the rows of a DataFrame whose dedup key repeats.
+    open_index(db_fn): Return the process-wide DedupIndex of a database file.
+    invalidate(db_fn): Drop the index of a database file that was rewritten.
+
+Classes:
+    DedupIndex(db_fn): The sidecar index of the database file `db_fn`.
+
+File format:
+    A 32 byte header (magic, then the size, st_mtime_ns and st_ino of the
+        database file when the index was last committed) followed by the
+        hashes as unsigned 64-bit integers in native byte order. A header
+        whose stamp does not match the database means the database was
+        changed behind the index, which is then rebuilt; a rewrite of the
+        same size is told by its mtime, a file renamed into place by its
+        inode. The writers that rewrite a database drop its index (see
+        invalidate), only appends keep it.
+
+Usage Example:
+    index = open_index('wshazam.csv')
+    if index.stale():
+        index.rebuild(frame_hashes(df_of_key_columns))
+    new = [h not in index for h in frame_hashes(new_rows)]
+    ...append the new rows to wshazam.csv...
+    index.add(hashes_of_new_rows)
+"""
+
+import hashlib
+import os
+import struct
+from array import array
+
+import pandas as pd
+
+import parquet_dataset
+from util import SUBSET, track_ids
+
+INDEX_SUFFIX = '.idx'
+# version 3 stamps the db with its size, mtime and inode; version 2 keys
+# rows on their track id; older indexes are rebuilt
+MAGIC = b'SHZIDX3\x00'
+# set in the keys derived from a track id, cleared in text hashes
+ID_FLAG = 1 << 63
+HEADER = struct.Struct('<8sQqQ')
+
+
+def key_hash(values):
+    """
+    Hash a dedup key to a 64-bit integer.
+
+    The values are normalized (whitespace collapsed, case folded) before
+    hashing, so keys differing only in case or spacing collide.
+
+    :param values: The values of the key columns, in order
+    :return: An unsigned 64-bit integer with the top bit (ID_FLAG) clear
+    """
+    key = '\x1f'.join(' '.join(str(v).split()).casefold() for v in values)
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') & ~ID_FLAG
+
+
+def frame_hashes(df, cols=SUBSET):
+    """
+    Compute the dedup key of every row of a DataFrame.
+
+    Rows with a track id (see util.track_ids) are keyed on the id itself,
+    with ID_FLAG set; only the remaining rows are hashed from `cols`.
+
+    :param df: The rows to key, missing key columns count as ''
+    :param cols: The text key columns (default is util.SUBSET)
+    :return: A list of keys, one per row
+    """
+    ids = track_ids(df)
+    keys = [None if tid is pd.NA else int(tid) | ID_FLAG for tid in ids]
+    missing = ids.isna().to_numpy()
+    if missing.any():
+        values = df[missing].reindex(columns=cols).astype(object)
+        values = values.where(values.notna(), '')
+        hashes = iter([key_hash(key) for key in values.itertuples(index=False)])
+        keys = [next(hashes) if key is None else key for key in keys]
+    return keys
+
+
+def drop_duplicate_keys(df):
+    """
+    Drop the rows of a DataFrame whose dedup key was already seen.
+    """
+    return df[~pd.Series(frame_hashes(df), index=df.index).duplicated()]
+
+
+class DedupIndex():
+    """
+    The sidecar dedup index of a database file.
+    """
+
+    def __init__(self, db_fn):
+        self.db_fn = db_fn
+        self.fn = db_fn + INDEX_SUFFIX
+        self.keys = set()
+        self.db_stamp = None
+
+    def __contains__(self, h):
+        return h in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def _db_stamp(db_fn):
+        """
+        Return (size, st_mtime_ns, st_ino) of the db, zeros if it is missing.
+
+        For a dataset, the size and newest mtime of its part files and the
+        inode of its directory (see parquet_dataset.signature).
+        """
+        try:
+            st = os.stat(db_fn)
+        except FileNotFoundError:
+            return (0, 0, 0)
+        if parquet_dataset.is_dataset(db_fn):
+            _, size, mtime = parquet_dataset.signature(db_fn)
+            return (size, mtime, st.st_ino)
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def load(self):
+        """
+        Read the index file into memory.
+
+        :return: True if the index file exists and is well formed
+        """
+        self.keys = set()
+        self.db_stamp = None
+        try:
+            with open(self.fn, 'rb') as f:
+                header = f.read(HEADER.size)
+                if len(header) != HEADER.size:
+                    return False
+                magic, *db_stamp = HEADER.unpack(header)
+                if magic != MAGIC:
+                    return False
+                hashes = array('Q')
+                hashes.frombytes(f.read())
+        except (OSError, ValueError):
+            return False
+        self.keys = set(hashes)
+        self.db_stamp = tuple(db_stamp)
+        return True
+
+    def stale(self):
+        """
+        Tell whether the index must be rebuilt.
+
+        The index in memory is reused while the db keeps the size, mtime
+        and inode it had at the last commit; otherwise the index file is
+        reloaded, in case another writer committed to both.
+
+        :return: True if the index is missing or out of date with the db
+        """
+        stamp = self._db_stamp(self.db_fn)
+        if self.db_stamp == stamp:
+            return False
+        return not self.load() or self.db_stamp != stamp
+
+    def _write_header(self, f):
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, *self.db_stamp))
+
+    def rebuild(self, hashes):
+        """
+        Replace the index with `hashes`, the keys currently in the db.
+        """
+        self.keys = set(hashes)
+        self.db_stamp = self._db_stamp(self.db_fn)
+        with open(self.fn, 'wb') as f:
+            self._write_header(f)
+            array('Q', self.keys).tofile(f)
+
+    def add(self, hashes):
+        """
+        Commit the keys of rows that were just added to the db.
+
+        The hashes are appended to the index file and the recorded db stamp
+        is updated, so later loads know the index covers these rows.
+        """
+        new = [h for h in hashes if h not in self.keys]
+        self.keys.update(new)
+        self.db_stamp = self._db_stamp(self.db_fn)
+        if not os.path.exists(self.fn):
+            self.rebuild(self.keys)
+            return
+        with open(self.fn, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            array('Q', new).tofile(f)
+            self._write_header(f)
+
+    def invalidate(self):
+        """
+        Forget the keys and remove the index file, after the db was
+        rewritten; the next lookup rebuilds it from the db.
+        """
+        self.keys = set()
+        self.db_stamp = None
+        if os.path.exists(self.fn):
+            os.remove(self.fn)
+
+
+_INDEXES = {}
+
+
+def open_index(db_fn):
+    """
+    Return the DedupIndex of `db_fn`, shared by every writer of the process.
+    """
+    key = os.path.abspath(db_fn)
+    if key not in _INDEXES:
+        _INDEXES[key] = DedupIndex(db_fn)
+    return _INDEXES[key]
+
+
+def invalidate(db_fn):
+    """
+    Drop the index of `db_fn`, which was rewritten rather than appended to.
+    """
+    open_index(db_fn).invalidate()
@@ -0,0 +1,314 @@
+"""
+executor - Module for the process-wide pools running blocking work.
+
+Database reads and writes, journal compaction and file parsing used to
+    create a `multiprocessing.pool.ThreadPool` per call, which was never
+    closed. This module owns one thread pool for I/O, shared by every
+    module, and an optional process pool for CPU-heavy work such as
+    parsing a spool of shortcut output files.
+
+Functions:
+    configure(io_workers=4, cpu_workers=None, queue_size=64): Size the pools.
+    submit_io(fn, *args, **kwargs): Run `fn` in the I/O thread pool.
+    submit_cpu(fn, *args, **kwargs): Run `fn` in the process pool.
+    cpu_workers(): Return the number of processes of the process pool.
+    map_cpu(fn, iterable, limit=None): Map `fn` over `iterable` in the
+        process pool.
+    task_stats(): Return the queue wait and run time of every task.
+    install_signal_handlers(): Cancel queued work on SIGINT and SIGTERM.
+    shutdown(wait=True, cancel_futures=False): Stop the pools.
+
+Usage Example:
+    future = executor.submit_io(Write2Db(rows, 'wshazam.csv').append_rows, '.csv')
+    status = future.result()
+    print(executor.task_stats())
+
+Notes:
+    - At most `queue_size` tasks can wait in a pool besides the running
+        ones; `submit_io` and `submit_cpu` block until a slot is free, so a
+        slow disk slows the producers down instead of piling up work.
+    - The functions submitted to the process pool and their arguments must
+        be picklable, e.g. module level functions.
+    - A task submitting to the I/O pool from an I/O worker runs inline, in
+        the calling worker, so tasks waiting on each other cannot starve the
+        pool.
+    - The pools are shut down, waiting for running tasks, at interpreter exit.
+"""
+
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+IO_WORKERS = 4
+QUEUE_SIZE = 64
+
+
+class TaskStats():
+    """
+    Count, queue wait and run time of the tasks of one kind.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.wait = 0.0
+        self.run = 0.0
+        self.max_run = 0.0
+
+    def add(self, wait, run):
+        self.count += 1
+        self.wait += wait
+        self.run += run
+        self.max_run = max(self.max_run, run)
+
+    def as_dict(self):
+        count = self.count or 1
+        return {'count': self.count, 'mean_wait': self.wait / count,
+                'mean_run': self.run / count, 'max_run': self.max_run}
+
+
+# set in the threads running a task
+_WORKER = threading.local()
+
+
+def _timed(fn, args, kwargs):
+    """
+    Run `fn` and return its result with its run time, in a worker.
+    """
+    start = time.perf_counter()
+    _WORKER.active = True
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        _WORKER.active = False
+    return result, time.perf_counter() - start
+
+
+class _Pool():
+    """
+    A concurrent.futures executor with a bounded queue and task timing.
+    """
+
+    def __init__(self, factory, workers, queue_size, threads=True):
+        self.factory = factory
+        self.threads = threads
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = None
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _executor(self):
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('cannot submit after shutdown')
+            if self.executor is None:
+                self.executor = self.factory(self.workers)
+            return self.executor
+
+    def _run_inline(self, fn, name, args, kwargs):
+        outer = Future()
+        outer.set_running_or_notify_cancel()
+        try:
+            result, run = _timed(fn, args, kwargs)
+        except BaseException as e:  # pylint: disable=broad-except
+            outer.set_exception(e)
+        else:
+            _record(name, 0.0, run)
+            outer.set_result(result)
+        finally:
+            _WORKER.active = True
+        return outer
+
+    def submit(self, fn, *args, **kwargs):
+        executor = self._executor()
+        name = getattr(fn, '__qualname__', repr(fn))
+        if self.threads and getattr(_WORKER, 'active', False):
+            # a task waiting on a task of its own pool could starve it
+            return self._run_inline(fn, name, args, kwargs)
+        self.slots.acquire()
+        outer = Future()
+        submitted = time.perf_counter()
+        try:
+            inner = executor.submit(_timed, fn, args, kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.pending.add(inner)
+
+        def done(inner):
+            with self.lock:
+                self.pending.discard(inner)
+            self.slots.release()
+            if inner.cancelled():
+                outer.cancel()
+                return
+            error = inner.exception()
+            if error is not None:
+                outer.set_exception(error)
+                return
+            result, run = inner.result()
+            _record(name, time.perf_counter() - submitted - run, run)
+            outer.set_result(result)
+
+        inner.add_done_callback(done)
+        return outer
+
+    def cancel_pending(self):
+        """
+        Cancel the tasks that have not started yet.
+        """
+        with self.lock:
+            pending = list(self.pending)
+        return sum(future.cancel() for future in pending)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.lock:
+            self.closed = True
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+_POOLS = {}
+
+
+def _record(name, wait, run):
+    with _STATS_LOCK:
+        _STATS.setdefault(name, TaskStats()).add(max(0.0, wait), run)
+
+
+def configure(io_workers=IO_WORKERS, cpu_workers=None, queue_size=QUEUE_SIZE):
+    """
+    Size the pools; takes effect for pools not started yet.
+
+    :param io_workers: The threads of the I/O pool
+    :param cpu_workers: The processes of the CPU pool (default is os.cpu_count())
+    :param queue_size: The tasks that can wait in each pool
+    """
+    for pool in _POOLS.values():
+        pool.shutdown()
+    _POOLS['io'] = _Pool(
+        lambda n: ThreadPoolExecutor(max_workers=n, thread_name_prefix='io'),
+        io_workers, queue_size)
+    _POOLS['cpu'] = _Pool(lambda n: ProcessPoolExecutor(max_workers=n),
+                          cpu_workers or os.cpu_count() or 1, queue_size,
+                          threads=False)
+
+
+def submit_io(fn, *args, **kwargs):
+    """
+    Run `fn(*args, **kwargs)` in the shared I/O thread pool.
+
+    :return: A concurrent.futures.Future of the result
+    """
+    return _POOLS['io'].submit(fn, *args, **kwargs)
+
+
+def submit_cpu(fn, *args, **kwargs):
+    """
+    Run `fn(*args, **kwargs)` in the shared process pool.
+
+    :return: A concurrent.futures.Future of the result
+    """
+    return _POOLS['cpu'].submit(fn, *args, **kwargs)
+
+
+def cpu_workers():
+    """
+    Return the number of processes of the CPU pool.
+    """
+    return _POOLS['cpu'].workers
+
+
+def map_cpu(fn, iterable, limit=None):
+    """
+    Map `fn` over `iterable` in the process pool, yielding results in order.
+
+    Tasks are submitted as queue slots free up, so at most `queue_size`
+    arguments are pending at any time.
+
+    :param limit: At most this many tasks of this map are submitted and
+        not yet returned, so at most `limit` processes work on it at once;
+        None for as many as the pool takes
+    """
+    futures = []
+    for args in iterable:
+        if limit is not None and len(futures) >= limit:
+            yield futures.pop(0).result()
+        futures.append(submit_cpu(fn, args))
+        while futures and futures[0].done():
+            yield futures.pop(0).result()
+    for future in futures:
+        yield future.result()
+
+
+def task_stats():
+    """
+    Return {task name: {'count', 'mean_wait', 'mean_run', 'max_run'}}.
+    """
+    with _STATS_LOCK:
+        return {name: stats.as_dict() for name, stats in _STATS.items()}
+
+
+def shutdown(wait=True, cancel_futures=False):
+    """
+    Stop the pools; later submissions raise RuntimeError.
+
+    :param wait: Wait for the running tasks to finish
+    :param cancel_futures: Cancel the tasks that have not started
+    """
+    for pool in _POOLS.values():
+        pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+# the handler each signal had before install_signal_handlers
+_PREVIOUS = {}
+
+
+def _handle_signal(sig, frame):
+    cancelled = sum(pool.cancel_pending() for pool in _POOLS.values())
+    print(f'{signal.Signals(sig).name}: cancelled {cancelled} queued tasks')
+    previous = _PREVIOUS.get(sig)
+    if previous == signal.SIG_IGN:
+        return
+    if callable(previous):
+        previous(sig, frame)
+    elif sig == signal.SIGINT:
+        raise KeyboardInterrupt
+    else:
+        sys.exit(128 + sig)
+
+
+def install_signal_handlers(signals=(signal.SIGINT, signal.SIGTERM)):
+    """
+    Cancel queued tasks when the process is interrupted or terminated.
+
+    The handlers cancel every task that has not started, then call the
+    handler that was installed before, so e.g. ShazamLogger can still save.
+    Without one, SIGINT raises KeyboardInterrupt and SIGTERM exits. The
+    running tasks finish before the interpreter exits.
+    Installing again is a no-op while the handler is in place; a handler
+    set meanwhile (e.g. by another ShazamLogger) becomes the one called,
+    so the handlers are never wrapped twice.
+    Signal handlers can only be installed from the main thread.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for signum in signals:
+        current = signal.getsignal(signum)
+        if current is _handle_signal:
+            continue
+        _PREVIOUS[signum] = current
+        signal.signal(signum, _handle_signal)
+
+
+configure()
+atexit.register(shutdown)
@@ -0,0 +1,226 @@
+"""
+file_watch - Module for waiting until a file is ready, without sleep-polling.
+
+This module waits for an output file, such as the one written by the
+    shazam_step shortcut, using Linux inotify through ctypes. The waiter
+    sleeps in the kernel and wakes as soon as the file is closed after
+    writing (or renamed into place), instead of checking `os.path.exists`
+    once a second. Where inotify is not available (macOS, missing libc
+    symbols, or a directory that does not exist yet) it falls back to
+    polling.
+
+A file is ready once its writer has closed it, not when it appears: the
+    shortcut creates the file, then writes it. A file that exists before
+    the watch starts is ready only if no process has it open for writing,
+    which Linux tells through a read lease (fcntl F_SETLEASE).
+
+Functions:
+    inotify_available(): Tell whether inotify can be used on this system.
+    wait_for_file(path, timeout=None, poll=1.0): Wait until `path` is ready.
+
+Usage Example:
+    if wait_for_file('www', timeout=60):
+        row = parse_row('www')
+
+Benchmark:
+    python file_watch.py [runs]
+        compares the wake-up latency of inotify with 1 second polling.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+_LIBC = None
+
+
+def _libc():
+    """
+    Load libc once and return it, None if it has no inotify.
+    """
+    global _LIBC  # pylint: disable=global-statement
+    if _LIBC is None:
+        _LIBC = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                   use_errno=True)
+                libc.inotify_init1.argtypes = [ctypes.c_int]
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                                   ctypes.c_uint32]
+                _LIBC = libc
+            except (OSError, AttributeError):
+                pass
+    return _LIBC or None
+
+
+def inotify_available():
+    """
+    Tell whether inotify can be used on this system.
+    """
+    return _libc() is not None
+
+
+def _open_for_writing(path):
+    """
+    Tell whether a process has `path` open for writing.
+
+    A read lease cannot be taken on such a file. Where leases are not
+    supported (other systems, some file systems, files of another user)
+    the file is taken as closed.
+    """
+    if fcntl is None or not hasattr(fcntl, 'F_SETLEASE'):
+        return False
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        fcntl.fcntl(fd, fcntl.F_SETLEASE, fcntl.F_RDLCK)
+        fcntl.fcntl(fd, fcntl.F_SETLEASE, fcntl.F_UNLCK)
+    except OSError as e:
+        return e.errno in (errno.EAGAIN, errno.EBUSY)
+    finally:
+        os.close(fd)
+    return False
+
+
+def _ready(path):
+    return os.path.exists(path) and not _open_for_writing(path)
+
+
+def _poll_for_file(path, timeout, poll):
+    """
+    Wait for `path` to be written by checking every `poll` seconds.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not _ready(path):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(poll, remaining))
+        else:
+            time.sleep(poll)
+    return True
+
+
+def _read_names(fd):
+    """
+    Read the pending inotify events of `fd` and return their file names.
+    """
+    try:
+        buf = os.read(fd, 64 * (EVENT.size + 256))
+    except BlockingIOError:
+        return []
+    names = []
+    offset = 0
+    while offset + EVENT.size <= len(buf):
+        _, _, _, length = EVENT.unpack_from(buf, offset)
+        offset += EVENT.size
+        names.append(buf[offset:offset + length].rstrip(b'\0'))
+        offset += length
+    return names
+
+
+def wait_for_file(path, timeout=None, poll=1.0):
+    """
+    Wait until `path` is closed after writing, or renamed into place.
+
+    The containing directory is watched for IN_CLOSE_WRITE and IN_MOVED_TO
+    events before the file is checked for, so a file finished between the
+    check and the wait is not missed. Only an event naming `path` ends the
+    wait, events of other files are skipped. A file that already exists
+    is returned immediately, unless it is still open for writing.
+
+    :param path: The file to wait for
+    :param timeout: Give up after this many seconds, None to wait forever
+    :param poll: The polling interval used when inotify is not available
+    :return: True if the file is ready, False if `timeout` was reached
+    """
+    libc = _libc()
+    directory = os.path.dirname(os.path.abspath(path))
+    if libc is None or not os.path.isdir(directory):
+        return _poll_for_file(path, timeout, poll)
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        return _poll_for_file(path, timeout, poll)
+    try:
+        wd = libc.inotify_add_watch(fd, os.fsencode(directory),
+                                    IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            return _poll_for_file(path, timeout, poll)
+        name = os.fsencode(os.path.basename(path))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if _ready(path):
+            return True
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready and name in _read_names(fd):
+                return True
+    finally:
+        os.close(fd)
+
+
+def _bench(runs=10, lag=1.0):
+    """
+    Measure how long after a file is written each waiter returns.
+    """
+    import random  # pylint: disable=import-outside-toplevel
+    import tempfile  # pylint: disable=import-outside-toplevel
+
+    def writer(fn, delay, done):
+        time.sleep(delay)
+        with open(fn, 'w', encoding='utf-8') as f:
+            f.write('<root></root>')
+        done.append(time.monotonic())
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, 'www')
+        for label, wait in (('inotify', lambda: wait_for_file(fn)),
+                            ('polling', lambda: _poll_for_file(fn, None, lag))):
+            if label == 'inotify' and not inotify_available():
+                continue
+            latencies = []
+            for _ in range(runs):
+                done = []
+                thread = threading.Thread(target=writer,
+                                          args=(fn, random.uniform(0.05, 0.5), done))
+                thread.start()
+                wait()
+                woke = time.monotonic()
+                thread.join()
+                latencies.append(max(0.0, woke - done[0]))
+                os.remove(fn)
+            results[label] = latencies
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) == 2 else 10
+    for waiter, lat in _bench(n).items():
+        print(f'{waiter}: mean latency {1000 * sum(lat) / len(lat):.2f} ms, '
+              f'max {1000 * max(lat):.2f} ms over {len(lat)} runs')
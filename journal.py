@@ -0,0 +1,218 @@
+"""
+journal - Module for a write-ahead journal of recognised rows.
+
+This module lets the logger persist every accepted row as soon as it is
+    recognised, without rewriting the database on every song. Rows are
+    appended to a JSON Lines journal and fsynced in small groups; a
+    background compactor periodically folds the journal into the database.
+    Rows left in the journal by a crash are folded in on the next start.
+
+Classes:
+    Journal(fn, group_rows=8, group_interval=5.0): The append-only journal.
+    Compactor(journal, writer, interval=300.0): The background compaction thread.
+
+Usage Example:
+    journal = Journal('wshazam.jsonl.journal')
+    fold = lambda rows: Write2Db(rows, 'wshazam.jsonl').run()
+    journal.compact(fold)                  # replay a previous session
+    compactor = Compactor(journal, fold)
+    compactor.start()
+    journal.append(row)                    # for every accepted row
+    compactor.stop()                       # syncs and compacts one last time
+
+Notes:
+    - At most `group_rows` rows, or `group_interval` seconds of rows, can be
+        lost on power failure; a process crash loses nothing that was appended.
+    - Compaction first renames the journal to `<fn>.compacting`, so appends
+        continue into a fresh journal while the rows are being written to
+        the database. The renamed file is deleted only once the writer
+        succeeds; folding the same rows twice is harmless because the
+        database drops duplicates.
+"""
+
+import json
+import os
+import threading
+import time
+
+COMPACTING_SUFFIX = '.compacting'
+
+
+class Journal():
+    """
+    An append-only JSON Lines journal with group commit.
+    """
+
+    def __init__(self, fn, group_rows=8, group_interval=5.0):
+        """
+        @param fn: the journal file
+        @param group_rows: fsync after this many appended rows
+        @param group_interval: fsync rows older than this many seconds
+        """
+        self.fn = fn
+        self.compacting_fn = fn + COMPACTING_SUFFIX
+        self.group_rows = group_rows
+        self.group_interval = group_interval
+        self.lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._f = None
+        self._pending = 0
+        self._first_pending = None
+
+    def _open(self):
+        if self._f is None:
+            self._f = open(self.fn, 'a', encoding='utf-8')
+        return self._f
+
+    def _sync(self):
+        if self._f is not None and self._pending:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        self._pending = 0
+        self._first_pending = None
+
+    def append(self, row):
+        """
+        Append a row, fsyncing the group once it is full or old enough.
+        """
+        line = json.dumps(row, ensure_ascii=False)
+        with self.lock:
+            f = self._open()
+            f.write(line + '\n')
+            f.flush()
+            self._pending += 1
+            now = time.monotonic()
+            if self._first_pending is None:
+                self._first_pending = now
+            if self._pending >= self.group_rows or \
+                    now - self._first_pending >= self.group_interval:
+                self._sync()
+
+    def sync(self):
+        """
+        Fsync the rows appended since the last group commit.
+        """
+        with self.lock:
+            self._sync()
+
+    def due(self):
+        """
+        Tell whether pending rows are older than `group_interval`.
+        """
+        first = self._first_pending
+        return first is not None and time.monotonic() - first >= self.group_interval
+
+    @staticmethod
+    def read(fn):
+        """
+        Return the rows of a journal file, skipping a torn last line.
+        """
+        rows = []
+        try:
+            with open(fn, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return rows
+
+    def replay(self):
+        """
+        Return the rows that have not been compacted yet, oldest first.
+        """
+        with self.lock:
+            self._sync()
+            return self.read(self.compacting_fn) + self.read(self.fn)
+
+    def _rotate(self):
+        """
+        Move the journal aside for compaction, see compact.
+        """
+        with self.lock:
+            self._sync()
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            if os.path.exists(self.compacting_fn):
+                # a previous compaction failed, fold those rows first
+                with open(self.compacting_fn, 'a', encoding='utf-8') as dst, \
+                        open(self.fn, 'a+', encoding='utf-8') as src:
+                    src.seek(0)
+                    dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.fn)
+            elif os.path.exists(self.fn):
+                os.replace(self.fn, self.compacting_fn)
+
+    def compact(self, writer):
+        """
+        Fold the journal into the database.
+
+        @param writer: called with the list of journaled rows, returns
+        True once they are safely stored in the database
+        @return: True if there was nothing to fold or the writer succeeded
+        """
+        with self._compact_lock:
+            self._rotate()
+            rows = self.read(self.compacting_fn)
+            if rows and not writer(rows):
+                return False
+            if os.path.exists(self.compacting_fn):
+                os.remove(self.compacting_fn)
+            return True
+
+    def close(self):
+        """
+        Fsync and close the journal file.
+        """
+        with self.lock:
+            self._sync()
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+
+class Compactor(threading.Thread):
+    """
+    A background thread committing journal groups and compacting the journal.
+    """
+
+    def __init__(self, journal, writer, interval=300.0):
+        """
+        @param journal: the Journal to compact
+        @param writer: the writer passed to Journal.compact
+        @param interval: seconds between two compactions
+        """
+        super().__init__(name='journal-compactor', daemon=True)
+        self.journal = journal
+        self.writer = writer
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = time.monotonic()
+        tick = min(self.journal.group_interval, self.interval)
+        while not self._stop_event.wait(tick):
+            if self.journal.due():
+                self.journal.sync()
+            if time.monotonic() - last >= self.interval:
+                try:
+                    self.journal.compact(self.writer)
+                except Exception as e:  # pylint: disable=broad-except
+                    print(f'{self.name}: compaction failed: {e}')
+                last = time.monotonic()
+
+    def stop(self):
+        """
+        Stop the thread, then sync and compact the journal one last time.
+
+        @return: the status of the final compaction
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        return self.journal.compact(self.writer)
@@ -0,0 +1,377 @@
+"""
+parquet_dataset - Module for storing the rows in a partitioned Parquet dataset.
+
+A '.parquet' database is one file that Write2Db rewrites in full on every
+    save. A '.parquet' path that is a directory is a dataset instead: every
+    save writes a small part file into the `year=YYYY/month=M` directory of
+    its rows, derived from their timestamp, and never touches the stored
+    parts. Reading a month only lists and reads the files of its directory,
+    and `compact` merges the small parts of each month into one file with
+    large row groups.
+
+Functions:
+    is_dataset(fn): Tell whether `fn` is a partitioned dataset.
+    create(fn): Create an empty dataset.
+    convert(fn): Turn a single Parquet file into a dataset.
+    partition_keys(df): Return the year and month of every row.
+    part_files(fn, year=None, month=None): List the part files of a partition.
+    append(fn, df): Write the rows into new part files.
+    read(fn, year=None, month=None, columns=None, filters=None): Read the
+        matching rows into a DataFrame.
+    iter_chunks(fn, chunksize, columns=None, filters=None): Read them in batches.
+    file_chunks(path, chunksize, columns=None, filters=None): Read the
+        batches of one Parquet file.
+    replace(df, fn): Replace the dataset with the rows of a DataFrame.
+    compact(fn, row_group_size=ROW_GROUP_SIZE): Merge the parts of every month.
+
+Usage Example:
+    parquet_dataset.create('wshazam.parquet')
+    Write2Db(rows, 'wshazam.parquet').run()      # appends a part file
+    march = ReadDb('wshazam.parquet').read_period(2024, 3)
+
+Command line:
+    python parquet_dataset.py create|convert|compact|stats db_file
+
+Notes:
+    - Rows whose timestamp cannot be parsed go to `year=0/month=0`.
+    - The year and month are only encoded in the directory names; the rows
+        read back have the columns they were written with.
+    - Part files are written through util.atomic_write, whose temporary
+        files start with a dot and are skipped by readers.
+    - `append` expects the caller to hold the exclusive db lock (see
+        db_lock), `convert`, `replace` and `compact` take it themselves.
+"""
+
+import os
+import shutil
+import sys
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from db_lock import DbLock
+from util import atomic_write, check_filters, filter_frame
+
+TIMESTAMP = 'timestamp'
+TIMESTAMP_FORMAT = '%d %B %Y at %H:%M'
+PARTITIONS = ('year', 'month')
+# partition of the rows without a valid timestamp
+UNKNOWN = 0
+PART_PREFIX = 'part-'
+PART_SUFFIX = '.parquet'
+ROW_GROUP_SIZE = 128 * 1024
+
+
+def is_dataset(fn):
+    """
+    Tell whether `fn` is a partitioned dataset, i.e. a directory.
+    """
+    return os.path.isdir(fn)
+
+
+def create(fn):
+    """
+    Create the empty dataset `fn`; new rows are appended to it.
+    """
+    os.makedirs(fn, exist_ok=True)
+
+
+def partition_keys(df):
+    """
+    Return a DataFrame with the year and month of every row of `df`.
+    """
+    if TIMESTAMP in df.columns:
+        dates = pd.to_datetime(df[TIMESTAMP], format=TIMESTAMP_FORMAT,
+                               errors='coerce')
+    else:
+        dates = pd.Series(pd.NaT, index=df.index)
+    return pd.DataFrame({
+        'year': dates.dt.year.fillna(UNKNOWN).astype(int),
+        'month': dates.dt.month.fillna(UNKNOWN).astype(int),
+    }, index=df.index)
+
+
+def _partition_dir(fn, year, month=None):
+    path = os.path.join(fn, f'year={year}')
+    return path if month is None else os.path.join(path, f'month={month}')
+
+
+def part_files(fn, year=None, month=None):
+    """
+    List the part files of the dataset `fn`, oldest first.
+
+    :param year: Only list the files of this year
+    :param month: Only list the files of this month of `year`
+    """
+    root = fn if year is None else _partition_dir(fn, year, month)
+    files = []
+    for directory, dirs, names in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('.', '_')))
+        files.extend(os.path.join(directory, name) for name in sorted(names)
+                     if name.startswith(PART_PREFIX) and name.endswith(PART_SUFFIX))
+    return files
+
+
+def signature(fn):
+    """
+    Return (number of parts, total size, newest mtime) of the dataset `fn`.
+    """
+    stats = [os.stat(f) for f in part_files(fn)]
+    return (len(stats), sum(st.st_size for st in stats),
+            max((st.st_mtime_ns for st in stats), default=0))
+
+
+def size(fn):
+    """
+    Return the total size of the part files of the dataset `fn`.
+    """
+    return signature(fn)[1]
+
+
+def columns(fn):
+    """
+    Return the columns of the stored rows, None if the dataset is empty.
+    """
+    files = part_files(fn)
+    return pq.read_schema(files[0]).names if files else None
+
+
+def _part_name():
+    # sorting the names sorts the parts by creation time
+    return f'{PART_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{PART_SUFFIX}'
+
+
+def _write_part(directory, df, row_group_size=ROW_GROUP_SIZE):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _part_name())
+    with atomic_write(path) as tmp:
+        df.to_parquet(tmp, index=False, row_group_size=row_group_size)
+    return path
+
+
+def append(fn, df):
+    """
+    Write the rows of `df` into one new part file per month.
+
+    :return: The paths of the new part files
+    """
+    df = df.reset_index(drop=True)
+    # columns without a value are stored as nulls, which read merges with
+    # the type of the other parts
+    df = df.assign(**{col: pd.Series(None, index=df.index, dtype=object)
+                      for col in df.columns if df[col].isna().all()})
+    keys = partition_keys(df)
+    return [_write_part(_partition_dir(fn, year, month), df.loc[group.index])
+            for (year, month), group in keys.groupby(['year', 'month'])]
+
+
+def _prune(fn, paths, filters):
+    """
+    Keep the part files whose partition matches the year/month `filters`.
+    """
+    if not filters:
+        return paths
+    keys = []
+    for path in paths:
+        parts = os.path.relpath(os.path.dirname(path), fn).split(os.sep)
+        keys.append({name: int(value) for name, value in
+                     (part.split('=', 1) for part in parts)})
+    keys = pd.DataFrame(keys, columns=list(PARTITIONS)).assign(path=paths)
+    return list(filter_frame(keys, filters=filters)['path'])
+
+
+def _select(fn, year, month, filters):
+    """
+    Return the part files matching the partition `filters`, and the
+    filters left to apply to their rows.
+    """
+    filters = check_filters(filters)
+    for col, op, value in filters:
+        if col in PARTITIONS and op in ('=', '=='):
+            if col == 'year' and year is None:
+                year = value
+            elif col == 'month' and month is None and year is not None:
+                month = value
+    paths = _prune(fn, part_files(fn, year, month),
+                   [f for f in filters if f[0] in PARTITIONS])
+    return paths, [f for f in filters if f[0] not in PARTITIONS]
+
+
+def file_chunks(path, chunksize, columns=None, filters=None):
+    """
+    Yield the rows of the Parquet file `path` in DataFrames of at most
+    `chunksize` rows, one row group batch at a time.
+
+    Row groups whose statistics exclude the `filters` are not read.
+    """
+    names = pq.read_schema(path).names
+    cols = None if columns is None else [c for c in names if c in columns]
+    expression = pq.filters_to_expression(filters) if filters else None
+    for batch in ds.dataset(path, format='parquet').to_batches(
+            columns=cols, filter=expression, batch_size=chunksize):
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def iter_chunks(fn, chunksize, columns=None, filters=None):
+    """
+    Yield the rows of the dataset `fn` part by part, in DataFrames of at
+    most `chunksize` rows; see read for the columns and filters.
+    """
+    paths, row_filters = _select(fn, None, None, filters)
+    for path in paths:
+        yield from file_chunks(path, chunksize, columns, row_filters)
+
+
+def read(fn, year=None, month=None, columns=None, filters=None):
+    """
+    Read the rows of the dataset `fn`, or of one of its partitions.
+
+    Only the files of the partition are listed and read. Filters on the
+    year and month select the partitions, the others are applied by
+    pyarrow while reading each part.
+
+    :param year: Only read the rows of this year
+    :param month: Only read the rows of this month of `year`
+    :param columns: The columns to read, None for all of them
+    :param filters: A list of (column, op, value) filters, see util.FILTER_OPS
+    :return: A DataFrame, empty if there are no rows
+    """
+    paths, row_filters = _select(fn, year, month, filters)
+    tables = []
+    for path in paths:
+        names = pq.read_schema(path).names
+        cols = None if columns is None else [c for c in names if c in columns]
+        tables.append(pq.read_table(path, columns=cols,
+                                    filters=row_filters or None))
+    if not tables:
+        return pd.DataFrame(columns=list(columns or []))
+    # parts written with other or all-null columns are aligned
+    table = pa.concat_tables(tables, promote_options='permissive')
+    return table.to_pandas()
+
+
+def _swap(tmp, fn):
+    """
+    Replace the file or directory `fn` with the directory `tmp`.
+    """
+    if not os.path.exists(fn):
+        os.rename(tmp, fn)
+        return
+    directory, base = os.path.split(os.path.abspath(fn))
+    old = os.path.join(directory, f'.{base}.{uuid.uuid4().hex}.old')
+    os.rename(fn, old)
+    try:
+        os.rename(tmp, fn)
+    except BaseException:
+        os.rename(old, fn)
+        raise
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+    else:
+        os.remove(old)
+
+
+def _tmp_dir(fn):
+    # a hidden sibling of `fn`, skipped by readers, see part_files
+    directory, base = os.path.split(os.path.abspath(fn))
+    tmp = os.path.join(directory, f'.{base}.{uuid.uuid4().hex}.tmp')
+    os.makedirs(tmp)
+    return tmp
+
+
+def _new_dataset(fn, df):
+    tmp = _tmp_dir(fn)
+    try:
+        if len(df):
+            append(tmp, df)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return tmp
+
+
+def replace(df, fn):
+    """
+    Replace the dataset `fn` with the rows of `df`, one part per month.
+    """
+    with DbLock(fn).exclusive():
+        _swap(_new_dataset(fn, df), fn)
+    return True
+
+
+def convert(fn):
+    """
+    Turn the single Parquet file `fn` into a dataset holding its rows.
+    """
+    with DbLock(fn).exclusive():
+        if is_dataset(fn):
+            return False
+        df = pd.read_parquet(fn) if os.path.exists(fn) else pd.DataFrame()
+        _swap(_new_dataset(fn, df), fn)
+    return True
+
+
+def compact(fn, row_group_size=ROW_GROUP_SIZE):
+    """
+    Merge the part files of every month of the dataset `fn` into one.
+
+    The merged part is written into a hidden sibling directory of the
+    month, which then replaces the month directory by a rename (see
+    _swap), under the exclusive db lock; readers never see a month twice,
+    and a failed merge leaves the month as it was.
+
+    :return: {partition directory: number of parts merged}
+    """
+    merged = {}
+    with DbLock(fn).exclusive():
+        by_dir = {}
+        for path in part_files(fn):
+            by_dir.setdefault(os.path.dirname(path), []).append(path)
+        for directory, paths in by_dir.items():
+            # a month directory holds no partitions of its own
+            if len(paths) < 2 or not os.path.basename(directory).startswith('month='):
+                continue
+            tables = [pq.read_table(path) for path in paths]
+            df = pa.concat_tables(tables, promote_options='permissive').to_pandas()
+            tmp = _tmp_dir(directory)
+            try:
+                _write_part(tmp, df, row_group_size)
+                _swap(tmp, directory)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+            merged[os.path.relpath(directory, fn)] = len(paths)
+    return merged
+
+
+def stats(fn):
+    """
+    Return {partition directory: (parts, rows)} of the dataset `fn`.
+    """
+    result = {}
+    for path in part_files(fn):
+        partition = os.path.relpath(os.path.dirname(path), fn)
+        parts, rows = result.get(partition, (0, 0))
+        result[partition] = (parts + 1, rows + pq.ParquetFile(path).metadata.num_rows)
+    return result
+
+
+COMMANDS = {
+    'create': create,
+    'convert': convert,
+    'compact': compact,
+    'stats': stats,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] in COMMANDS:
+        print(COMMANDS[sys.argv[1]](sys.argv[2]))
+    else:
+        print('command line use is parquet_dataset')
+        print(f'Usage: python {os.path.basename(sys.argv[0])} '
+              f'{"|".join(COMMANDS)} db_file')
@@ -0,0 +1,159 @@
+"""
+parse_batch - Module for parsing a spool of shortcut output files in parallel.
+
+This module parses many shortcut output files, such as the ones written by
+    `ShazamStep`, across a process pool and assembles the result into a
+    single pandas DataFrame.
+
+Functions:
+    list_spool(source, pattern='*'): List the files of a directory, glob or single file.
+    parse_files(paths, backend='expat', encoding='utf-8'): Parse files into columns.
+    parse_batch(source, processes=None, backend='expat', encoding='utf-8'):
+        Parse a spool into a DataFrame using up to `processes` processes of
+        the shared process pool.
+
+Example Usage:
+    >>> df = parse_batch('archive/2024/')
+    >>> df = parse_batch('archive/*.xml', processes=16)
+    >>> print(df[['artist', 'title']])
+
+Notes:
+    - Each worker returns its rows as a dictionary of column lists, and the
+        lists are concatenated in the parent before the DataFrame is built,
+        so no per-row dictionaries are pickled between processes or handed
+        to pandas.
+    - With the 'expat' backend every `<root>` record of a file is parsed
+        (see parse_row.parse_rows); the 'bs4' backend reads one per file.
+"""
+
+import glob
+import os
+import sys
+
+import pandas as pd
+
+import executor
+from parse_row import compile_template, parse_row, parse_rows
+from util import TRACK_ID
+
+
+def list_spool(source, pattern='*'):
+    """
+    List the shortcut output files described by `source`.
+
+    Parameters:
+        source (str): A directory, a glob pattern or the path of a single file.
+        pattern (str, optional): The glob used inside a directory (default is '*').
+
+    Returns:
+        list: The sorted paths of the regular files found.
+    """
+    if os.path.isdir(source):
+        source = os.path.join(source, pattern)
+    return sorted(fn for fn in glob.glob(source) if os.path.isfile(fn))
+
+
+def _records(fn, backend, encoding):
+    """
+    Yield the records of one file with the requested backend.
+    """
+    if backend == 'expat':
+        yield from parse_rows(fn, encoding)
+        return
+    row = parse_row(fn, encoding, backend=backend)
+    if row:
+        yield row
+
+
+def parse_files(paths, backend='expat', encoding='utf-8'):
+    """
+    Parse a list of files into columns.
+
+    Parameters:
+        paths (list): The files to be parsed.
+        backend (str, optional): The parse_row backend (default is 'expat').
+        encoding (str, optional): The encoding of the files (default is 'utf-8').
+
+    Returns:
+        dict: One list per template field and TRACK_ID, missing fields are None.
+    """
+    fields = compile_template() + (TRACK_ID,)
+    columns = {field: [] for field in fields}
+    for fn in paths:
+        for row in _records(fn, backend, encoding):
+            for field in fields:
+                columns[field].append(row.get(field))
+    return columns
+
+
+def _parse_chunk(args):
+    """
+    Pool worker, unpack the arguments of parse_files.
+    """
+    return parse_files(*args)
+
+
+def _chunks(paths, n):
+    """
+    Split `paths` into at most `n` contiguous chunks of similar size.
+    """
+    size = max(1, -(-len(paths) // n))
+    return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+
+def _to_frame(results, fields):
+    """
+    Concatenate the column lists of every chunk into one DataFrame.
+    """
+    columns = {field: [] for field in fields}
+    for chunk in results:
+        for field in fields:
+            columns[field].extend(chunk[field])
+    df = pd.DataFrame(columns, columns=list(fields))
+    df[TRACK_ID] = df[TRACK_ID].astype('Int64')
+    return df
+
+
+def parse_batch(source, processes=None, backend='expat', encoding='utf-8'):
+    """
+    Parse a spool of shortcut output files into a DataFrame.
+
+    The files are split into contiguous chunks which are parsed in a
+    process pool; the column lists returned by the workers are joined in
+    file order and the DataFrame is built once, column by column.
+
+    Parameters:
+        source (str or list): A directory, a glob pattern, a single file
+            or a list of files.
+        processes (int, optional): The most processes of the shared
+            process pool parsing the files at once (default is the size of
+            the pool, see executor.configure); the files are split into
+            four chunks per process. With 1 the files are parsed inline.
+        backend (str, optional): The parse_row backend (default is 'expat').
+        encoding (str, optional): The encoding of the files (default is 'utf-8').
+
+    Returns:
+        pd.DataFrame: One row per record, one column per template field and
+            the Int64 TRACK_ID column.
+    """
+    paths = list_spool(source) if isinstance(source, str) else list(source)
+    fields = compile_template() + (TRACK_ID,)
+    processes = processes or executor.cpu_workers()
+    processes = min(processes, len(paths)) or 1
+    # a few chunks per process keeps the pool busy when file sizes differ
+    tasks = [(chunk, backend, encoding)
+             for chunk in _chunks(paths, processes * 4)]
+
+    if processes == 1:
+        results = map(_parse_chunk, tasks)
+        return _to_frame(results, fields)
+    return _to_frame(executor.map_cpu(_parse_chunk, tasks, limit=processes),
+                     fields)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) in (2, 3):
+        nproc = int(sys.argv[2]) if len(sys.argv) == 3 else None
+        print(parse_batch(sys.argv[1], processes=nproc))
+    else:
+        print(f'Usage: python {os.path.basename(sys.argv[0])} spool_dir_or_glob [processes]')
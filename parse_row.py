@@ -3,13 +3,17 @@ parse_row - Module for parsing XML data using a template.
 
 This module provides a function for parsing XML data based on a
     predefined template. It utilizes the BeautifulSoup library
-    to navigate and extract information from XML documents.
+    to navigate and extract information from XML documents, or the
+    standard library streaming XML parser (expat) when speed matters.
 
 Constants:
     SHAZAM_TEMPLATE (str): A string containing an XML template with placeholders for specific tags.
+    PARSERS (dict): Maps a backend name ('bs4', 'expat') to its parser function.
 
 Functions:
-    parse_row(fn, encoding='utf-8'): Parse an XML file using the specified template.
+    compile_template(template=SHAZAM_TEMPLATE): Compile a template into a tuple of field names.
+    parse_row(fn, encoding='utf-8', backend='bs4'): Parse an XML file using the specified template.
+    parse_rows(fn, encoding='utf-8'): Yield one dictionary per `<root>` record in a file.
     
     The `parse_row` function takes the path to an XML file and optionally an encoding parameter.
         It parses the XML document using BeautifulSoup and a predefined template stored 
@@ -19,6 +23,7 @@ Functions:
     Parameters:
         fn (str): The path to the XML file to be parsed.
         encoding (str, optional): The encoding of the XML file (default is 'utf-8').
+        backend (str, optional): The parser backend, one of PARSERS (default is 'bs4').
 
     Returns:
         dict or None: A dictionary containing parsed data if the file exists and
@@ -28,6 +33,10 @@ Example Usage:
     >>> parsed_data = parse_row('example.xml')
     >>> print(parsed_data)
     {'timestamp': 'Date', 'title': 'Shazam Media (Title)', ...}
+    >>> parse_row('example.xml', backend='expat') == parsed_data
+    True
+    >>> for row in parse_rows('spool.xml'):
+    ...     print(row['title'])
 
 Notes:
     - This module requires the BeautifulSoup library to be installed.
@@ -36,10 +45,26 @@ Notes:
     ```
     - The `SHAZAM_TEMPLATE` string serves as a map to interpret the
         XML data and extract relevant information.
+    - `parse_rows` reads files holding many concatenated `<root>` records,
+        as written when the shortcut runs in a loop. Each record is
+        discarded once yielded, so memory stays constant with file size.
+        A malformed record is reported and skipped, the next ones are read.
+    - The shortcut writes URLs with bare `&` characters, which is not valid
+        XML. Both backends escape them before parsing so the URL query
+        string is kept intact.
+    - Both backends add the numeric Shazam track id found in `shazamurl`
+        ('/track/468503633/...') as an int under util.TRACK_ID, the key
+        rows are deduplicated on. Rows without such a URL have no id.
 """
 
+import re
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+
 from bs4 import BeautifulSoup
 
+from util import TRACK_ID, TRACK_URL, track_id
+
 SHAZAM_TEMPLATE = """
 <root>
 
@@ -90,43 +115,214 @@ Shazam Media (Name)
 </root>
 """
 
+# An `&` that does not start a character or entity reference
+BARE_AMP = re.compile(r'&(?!(?:[A-Za-z][\w.-]*|#[0-9]+|#x[0-9A-Fa-f]+);)')
+XML_DECL = re.compile(r'<\?xml[^>]*\?>')
+RECORD_START = re.compile(r'<root[\s/>]')
+RECORD_END = re.compile(r'</root\s*>')
+
 
-def parse_row(fn, encoding="utf-8"):
+@lru_cache(maxsize=None)
+def compile_template(template=SHAZAM_TEMPLATE):
     """
-    Parse an XML file using the specified template.
+    Compile an XML template into its field schema.
 
-    This function parses an XML file using the predefined 
-    template stored in the SHAZAM_TEMPLATE constant.
-    It extracts information from the XML document based on the template structure.
+    The template is parsed once and the names of the tags found under
+    `<root>` are returned in document order. The result is cached, so
+    repeated calls with the same template cost a dictionary lookup.
 
     Parameters:
-        fn (str): The path to the XML file to be parsed.
-        encoding (str, optional): The encoding of the XML file (default is 'utf-8').
+        template (str, optional): The XML template (default is SHAZAM_TEMPLATE).
 
     Returns:
-        dict or None: A dictionary containing parsed data if the file exists
-        and contains valid XML data. Returns None if the file does not exist or is empty.
+        tuple: The field names defined by the template.
+    """
+    soup = BeautifulSoup(template, "xml")
+    root = soup.find("root")
+    if root is None:
+        return ()
+    return tuple(tag.name for tag in root.find_all(recursive=False))
+
+
+def _escape_amp(text):
+    """
+    Escape bare ampersands so the text can be parsed as XML.
+    """
+    return BARE_AMP.sub('&amp;', text)
+
+
+def _add_track_id(dct):
+    """
+    Add the numeric track id of the row's shazamurl, if it has one.
+    """
+    tid = track_id(dct.get(TRACK_URL))
+    if tid is not None:
+        dct[TRACK_ID] = tid
+    return dct
+
+
+def _parse_bs4(fn, encoding="utf-8"):
+    """
+    Parse an XML file with BeautifulSoup, see parse_row.
     """
-    soup = BeautifulSoup(SHAZAM_TEMPLATE, "xml")
-    root = soup.findChildren()
-    tags = [tag.name for tag in root if tag and tag != "root"]
+    tags = compile_template()
     try:
         with open(fn, encoding=encoding) as f:
             row = f.read()
     except FileNotFoundError:
         return None
-    soup = BeautifulSoup(row.replace("\n", ""), "xml")
+    soup = BeautifulSoup(_escape_amp(row.replace("\n", "")), "xml")
     root = soup.select_one("root")
     if root:
         dct = {}
         for tag in tags:
-            if not tag:
-                continue
             tag_content = root.find(tag)
             if tag_content:
                 dct[tag] = tag_content.text
         if len(dct) != 0:
-            return dct
+            return _add_track_id(dct)
+
+
+def _element_to_dict(root, tags):
+    """
+    Collect the text of the template fields found under `root`.
+    """
+    dct = {}
+    for tag in tags:
+        tag_content = root.find(f'.//{tag}')
+        if tag_content is not None:
+            dct[tag] = ''.join(tag_content.itertext())
+    if len(dct) != 0:
+        return _add_track_id(dct)
+
+
+def _record_texts(f):
+    """
+    Split the lines of `f` into the text of each `<root>` record.
+
+    Only the record being read is buffered. A record that is not closed
+    before the next one starts, or before the end of the file, is yielded
+    as None and the split resumes at the next record start.
+
+    Yields:
+        str or None: The text of each record, None if it is incomplete.
+    """
+    buf = ''
+    for line in f:
+        buf += XML_DECL.sub('', line.replace("\n", ""))
+        while True:
+            start = RECORD_START.search(buf)
+            if start is None:
+                # keep what may be the beginning of a record start tag
+                buf = buf[-len('<root'):]
+                break
+            end = RECORD_END.search(buf, start.end())
+            following = RECORD_START.search(buf, start.end())
+            if following and (end is None or following.start() < end.start()):
+                yield None
+                buf = buf[following.start():]
+                continue
+            if end is None:
+                buf = buf[start.start():]
+                break
+            yield buf[start.start():end.end()]
+            buf = buf[end.end():]
+    if RECORD_START.search(buf):
+        yield None
+
+
+def _iter_records(fn, encoding="utf-8"):
+    """
+    Stream the `<root>` records of an XML file with expat.
+
+    Every record is parsed on its own, so concatenated documents (each
+    with its own XML declaration) are read one record at a time, and a
+    record that cannot be parsed is reported and skipped without losing
+    the records after it.
+
+    Yields:
+        dict or None: The parsed fields of each record, None if it has none.
+    """
+    tags = compile_template()
+    try:
+        with open(fn, encoding=encoding) as f:
+            for n, text in enumerate(_record_texts(f), 1):
+                if text is None:
+                    print(f'{fn}: record {n} is incomplete, skipped')
+                    continue
+                try:
+                    root = ET.fromstring(_escape_amp(text))
+                except ET.ParseError as e:
+                    print(f'{fn}: record {n} is not valid XML ({e}), skipped')
+                    continue
+                yield _element_to_dict(root, tags)
+    except FileNotFoundError:
+        return
+
+
+def _parse_expat(fn, encoding="utf-8"):
+    """
+    Parse an XML file with the streaming expat parser, see parse_row.
+
+    The file is read one line at a time and reading stops as soon as the
+    first valid `<root>` record is closed, so nothing past it is parsed.
+    """
+    records = _iter_records(fn, encoding)
+    try:
+        return next(records, None)
+    finally:
+        records.close()
+
+
+PARSERS = {
+    'bs4': _parse_bs4,
+    'expat': _parse_expat,
+}
+
+
+def parse_row(fn, encoding="utf-8", backend="bs4"):
+    """
+    Parse an XML file using the specified template.
+
+    This function parses an XML file using the predefined 
+    template stored in the SHAZAM_TEMPLATE constant.
+    It extracts information from the XML document based on the template structure.
+
+    Parameters:
+        fn (str): The path to the XML file to be parsed.
+        encoding (str, optional): The encoding of the XML file (default is 'utf-8').
+        backend (str, optional): 'bs4' for BeautifulSoup or 'expat' for the
+            streaming standard library parser (default is 'bs4').
+
+    Returns:
+        dict or None: A dictionary containing parsed data if the file exists
+        and contains valid XML data. Returns None if the file does not exist or is empty.
+    """
+    parser = PARSERS.get(backend)
+    if parser is None:
+        raise ValueError(f'Unknown parser backend: {backend}')
+    return parser(fn, encoding)
+
+
+def parse_rows(fn, encoding="utf-8"):
+    """
+    Parse every `<root>` record of an XML file using the specified template.
+
+    This generator reads the file incrementally with the expat backend and
+    yields records as soon as they are complete, so files holding many
+    concatenated shortcut outputs can be drained in constant memory.
+
+    Parameters:
+        fn (str): The path to the XML file to be parsed.
+        encoding (str, optional): The encoding of the XML file (default is 'utf-8').
+
+    Yields:
+        dict: The parsed data of each non-empty record, in file order.
+            Nothing is yielded if the file does not exist.
+    """
+    for dct in _iter_records(fn, encoding):
+        if dct:
+            yield dct
 
 
 #print(parse_row('r.txt'))
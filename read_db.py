@@ -30,6 +30,27 @@ Note:
     in Unix-like systems. see util.py for details
 - The 'read_frmt' function determines the file format based on both the
     file extension and the detected MIME type.
+- '.sql' files are SQLite databases, read through sqlite_db.
+- '.jsonl' files hold one JSON row per line and are only ever appended to.
+    ReadDb can stream them (iter_rows) or read only their last rows (tail)
+    without loading the whole history.
+- iter_chunks(chunksize=...) reads any db in DataFrames of bounded size:
+    CSV and JSON Lines chunks, HDF table chunks, Parquet record batches,
+    Arrow record batches and SQLite cursor fetches (CHUNK_FRMT). Other
+    formats are read whole and sliced.
+- read_db(columns=[...], filters=[(column, op, value), ...]) reads only
+    the given columns of the matching rows. The projection and the filters
+    are passed down to the backend where it supports them (PUSHDOWN_FRMT,
+    SQLite and Parquet datasets) and applied in memory otherwise.
+- '.feather' files are memory-mapped (see arrow_db). read_arrow returns
+    the mapped rows without copying them, and converts a column to pandas
+    only when it is used.
+- A '.parquet' directory is a dataset partitioned by year and month (see
+    parquet_dataset); read_period reads only the directory of a month.
+- Formats written in place (util.APPEND_FRMT) are read under the shared
+    lock of db_lock.DbLock, so a read never sees a file that another process
+    is appending to. Other formats are only ever replaced by an atomic
+    rename (see util.atomic_write) and are read without locking.
 - This module requires the 'pandas' library to be installed.
 ```sh
 pip install panadas
@@ -38,21 +59,27 @@ For more details about the 'file' command, refer to:
 https://man7.org/linux/man-pages/man1/file.1.html
 """
 
+import json
 import os
-import re
-import signal
 import sys
-import threading
+from contextlib import ExitStack
+from functools import partial
 
 import pandas as pd
+import pyarrow.parquet as pq
 
+import arrow_db
+import parquet_dataset
+import sqlite_db
 import util
+from db_lock import DbLock
 
 READ_FRMT = {
     '.csv': 'read_csv',
     '.xls': 'read_excel',
     '.xlsx': 'read_excel',
     '.json': 'read_json',
+    '.jsonl': 'read_json',
     '.html': 'read_html',
     '.sql': 'read_sql',
     '.parquet': 'read_parquet',
@@ -62,43 +89,295 @@ READ_FRMT = {
     '.dta': 'read_stata',
     '.sas7bdat': 'read_sas',
 }
+# formats whose pandas reader takes an encoding
+ENCODED_FRMT = ('.csv', '.json', '.jsonl', '.html', '.h5', '.hdf', '.sas7bdat')
+# formats read with a projection or filters by a ReadDb method, instead
+# of in full through READ_FRMT
+PUSHDOWN_FRMT = {
+    '.csv': '_read_csv',
+    '.jsonl': '_read_jsonl',
+    '.parquet': '_read_parquet',
+    '.h5': '_read_hdf',
+    '.hdf': '_read_hdf',
+}
+# formats read chunk by chunk by a ReadDb method, see iter_chunks
+CHUNK_FRMT = {
+    '.csv': '_chunks_csv',
+    '.jsonl': '_chunks_jsonl',
+    '.parquet': '_chunks_parquet',
+    '.feather': '_chunks_feather',
+    '.h5': '_chunks_hdf',
+    '.hdf': '_chunks_hdf',
+}
+# default rows per chunk of iter_chunks
+CHUNK_ROWS = 10000
 
 class ReadDb():
     def __init__(self, fn, **akwargs):
-        self.file_lock = threading.Lock()
-        signal.signal(signal.SIGINT, self.signal_handler)
+        # shared with other processes, see db_lock
+        self.file_lock = DbLock(fn)
         self.fn = fn
         self.akwargs = akwargs
-    def signal_handler(self, sig, frame):
-        print("Interrupt received. Exiting gracefully.")
-        sys.exit(0)
     
-    def read_db(self):
+    def read_db(self, chunksize=None, columns=None, filters=None):
+        """
+        Read the db file.
+
+        @param chunksize: return iter_chunks(chunksize) instead of one
+        DataFrame
+        @param columns: the columns to read, in file order; None for all
+        @param filters: only read the rows matching every (column, op,
+        value) filter, with op one of util.FILTER_OPS
+        @return: a DataFrame, an iterator of DataFrames with a chunksize,
+        or None if the file does not exist
+        """
         if not os.path.exists(self.fn):
             return None
-        _, ext = os.path.splitext(self.fn)
-
-        rgx = '|'.join(map(lambda c: c.strip('.'), READ_FRMT.keys()))
-        rgx = rf'({rgx})'
-        ft = util.detect_file_type(self.fn)
-        ft = re.findall(rgx, ft)
-        if len(ft) > 0:
-            frmt = f'.{ft[0]}'
-        else:
-            frmt = ext
-        return self.read(frmt)
+        filters = util.check_filters(filters)
+        frmt = self._format()
+        if chunksize:
+            return self.iter_chunks(chunksize, columns, filters)
+        return self.read(frmt, columns, filters)
+
+    def _format(self):
+        if parquet_dataset.is_dataset(self.fn):
+            return '.parquet'
+        return util.detect_format(self.fn, READ_FRMT)
+
+    def read_arrow(self, columns=None):
+        """
+        Return the rows of a '.feather' db as an arrow_db.ArrowFrame, which
+        reads the memory-mapped file in place and converts a column to
+        pandas only when it is used.
+
+        @param columns: the columns to keep, None for all of them
+        @return: an ArrowFrame, or None if the file does not exist
+        """
+        if not os.path.exists(self.fn):
+            return None
+        if self._format() != '.feather':
+            raise ValueError(f'{self.fn}: only Feather files can be memory-mapped')
+        return arrow_db.ArrowFrame(arrow_db.open_table(self.fn, columns))
+
+    def read_period(self, year, month=None):
+        """
+        Read the rows logged in `year`, or in `month` of `year`.
+
+        Only the matching directories of a partitioned Parquet dataset are
+        read; other formats are read whole and filtered on their timestamp.
+
+        @return: a DataFrame, or None if the file does not exist
+        """
+        if not os.path.exists(self.fn):
+            return None
+        if parquet_dataset.is_dataset(self.fn):
+            with self.file_lock.shared():
+                return parquet_dataset.read(self.fn, year, month)
+        df = self.read(self._format())
+        if not isinstance(df, pd.DataFrame):
+            return df
+        keys = parquet_dataset.partition_keys(df)
+        match = keys['year'] == year
+        if month is not None:
+            match &= keys['month'] == month
+        return df[match].reset_index(drop=True)
+
+    def iter_chunks(self, chunksize=CHUNK_ROWS, columns=None, filters=None):
+        """
+        Yield the rows of the db in DataFrames of at most `chunksize` rows.
+
+        Only one chunk is held in memory at a time for the formats of
+        CHUNK_FRMT and SQLite; other formats are read whole first. The
+        columns and filters are those of read_db; chunks left empty by the
+        filters are skipped. The shared lock is held until the iterator is
+        exhausted or closed.
+        """
+        if not os.path.exists(self.fn):
+            return
+        filters = util.check_filters(filters)
+        frmt = self._format()
+        if frmt == '.sql':
+            # WAL mode, readers do not block the writer
+            yield from sqlite_db.iter_chunks(self.fn, chunksize, columns, filters)
+            return
+        needed = util.needed_columns(columns, filters)
+        with ExitStack() as stack:
+            if frmt in util.APPEND_FRMT:
+                stack.enter_context(self.file_lock.shared())
+            if frmt in CHUNK_FRMT:
+                chunks = getattr(self, CHUNK_FRMT[frmt])(chunksize, needed, filters)
+            else:
+                df = self.read(frmt, needed, filters)
+                chunks = (df[start:start + chunksize]
+                          for start in range(0, len(df) if df is not None else 0,
+                                             chunksize))
+            for chunk in chunks:
+                chunk = util.filter_frame(chunk, columns, filters)
+                if len(chunk):
+                    yield chunk
 
+    def _chunks_csv(self, chunksize, needed, filters):
+        usecols = None if needed is None else (lambda col: col in needed)
+        with pd.read_csv(self.fn, usecols=usecols, chunksize=chunksize,
+                         encoding='utf-8') as reader:
+            yield from reader
 
-    def read(self, frmt):
-        args = self.akwargs if 'args' in self.akwargs else {'encoding': 'utf-8'}
+    def _chunks_jsonl(self, chunksize, needed, filters):
+        with pd.read_json(self.fn, chunksize=chunksize, encoding='utf-8',
+                          **util.READ_ARGS['.jsonl']) as reader:
+            for chunk in reader:
+                # JSON has no projection, drop the other columns early
+                yield util.filter_frame(chunk, needed)
+
+    def _chunks_parquet(self, chunksize, needed, filters):
+        if parquet_dataset.is_dataset(self.fn):
+            return parquet_dataset.iter_chunks(self.fn, chunksize, needed, filters)
+        return parquet_dataset.file_chunks(self.fn, chunksize, needed, filters)
+
+    def _chunks_feather(self, chunksize, needed, filters):
+        return arrow_db.iter_chunks(self.fn, chunksize, needed)
+
+    def _chunks_hdf(self, chunksize, needed, filters):
+        with pd.HDFStore(self.fn, mode='r') as store:
+            if not store.keys():
+                return
+            key, select = self._hdf_select(store, needed, filters)
+            if not select:
+                df = store.select(key)
+                for start in range(0, len(df), chunksize):
+                    yield df[start:start + chunksize]
+                return
+            yield from store.select(key, chunksize=chunksize, **select)
+
+    def iter_rows(self):
+        """
+        Stream the rows of a JSON Lines db one dict at a time.
+
+        Blank lines are skipped; a line cut short by a crashed writer is
+        reported and ignored.
+        """
+        with self.file_lock.shared(), open(self.fn, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print(f'{self.fn}:{number}: ignoring a malformed row')
+
+    def tail(self, n=10, block=65536):
+        """
+        Return the last `n` rows of a JSON Lines db.
+
+        The file is read backwards `block` bytes at a time, so the cost
+        depends on `n`, not on the size of the history.
+        """
+        with self.file_lock.shared(), open(self.fn, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            data = b''
+            while end > 0 and data.count(b'\n') <= n:
+                start = max(0, end - block)
+                f.seek(start)
+                data = f.read(end - start) + data
+                end = start
+        lines = [line for line in data.splitlines() if line.strip()]
+        if end > 0:
+            # the first line may start before the bytes read
+            lines = lines[1:]
+        rows = []
+        for line in lines[-n:] if n > 0 else []:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                print(f'{self.fn}: ignoring a malformed row')
+        return pd.DataFrame(rows)
+
+
+    def read(self, frmt, columns=None, filters=None):
+        if frmt == '.sql':
+            # WAL mode, readers do not block the writer
+            return sqlite_db.read(self.fn, columns, filters)
+        if frmt == '.parquet' and parquet_dataset.is_dataset(self.fn):
+            with self.file_lock.shared():
+                return parquet_dataset.read(self.fn, columns=columns, filters=filters)
+        if frmt == '.feather':
+            # memory mapped, see arrow_db
+            df = arrow_db.read(self.fn, util.needed_columns(columns, filters))
+            if columns is not None or filters:
+                df = util.filter_frame(df, columns, filters)
+            return df
+        if 'args' in self.akwargs:
+            args = self.akwargs
+        else:
+            args = {'encoding': 'utf-8'} if frmt in ENCODED_FRMT else {}
+        args = {**args, **util.READ_ARGS.get(frmt, {})}
         method = READ_FRMT.get(frmt)
         if method:
-            read_method = getattr(pd, method)
-            self.file_lock.acquire()
-            df = read_method(self.fn, **args)
-            self.file_lock.release()
+            if frmt in PUSHDOWN_FRMT and (columns is not None or filters):
+                read_method = partial(getattr(self, PUSHDOWN_FRMT[frmt]), args,
+                                      util.needed_columns(columns, filters), filters)
+            else:
+                read_method = partial(getattr(pd, method), self.fn, **args)
+            if frmt in util.APPEND_FRMT:
+                with self.file_lock.shared():
+                    df = read_method()
+            else:
+                # only ever replaced by rename, see util.atomic_write
+                df = read_method()
+            if columns is not None or filters:
+                # whatever the backend could not filter or project
+                df = util.filter_frame(df, columns, filters)
             return df
 
+    def _read_csv(self, args, needed, filters):
+        usecols = None if needed is None else (lambda col: col in needed)
+        return pd.read_csv(self.fn, usecols=usecols, **args)
+
+    def _read_jsonl(self, args, needed, filters):
+        # JSON has no projection, keep only the needed rows of each chunk
+        chunks = [util.filter_frame(chunk, needed, filters)
+                  for chunk in self._chunks_jsonl(CHUNK_ROWS, needed, filters)]
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+    def _read_parquet(self, args, needed, filters):
+        if needed is not None:
+            stored = pq.read_schema(self.fn).names
+            needed = [col for col in stored if col in needed]
+        return pd.read_parquet(self.fn, columns=needed, filters=filters or None)
+
+    def _read_hdf(self, args, needed, filters):
+        with pd.HDFStore(self.fn, mode='r') as store:
+            if not store.keys():
+                return pd.DataFrame()
+            key, select = self._hdf_select(store, needed, filters)
+            return store.select(key, **select)
+
+    def _hdf_select(self, store, needed, filters):
+        """
+        Return the key of the rows in `store` and the HDFStore.select
+        arguments reading the `needed` columns of the rows matching the
+        `filters`, as far as PyTables can.
+        """
+        key = util.HDF_KEY if f'/{util.HDF_KEY}' in store.keys() else store.keys()[0]
+        storer = store.get_storer(key)
+        if not storer.is_table:
+            # the fixed format can only be read whole
+            return key, {}
+        stored = store.select(key, stop=0).columns
+        if needed is not None:
+            needed = [col for col in stored if col in needed]
+        # PyTables can only select on the data columns
+        data_columns = set(storer.data_columns)
+        where = [self._hdf_term(col, op, value) for col, op, value in filters
+                 if col in data_columns]
+        return key, {'where': where or None, 'columns': needed}
+
+    @staticmethod
+    def _hdf_term(col, op, value):
+        if op in ('in', 'not in'):
+            return f'{col} {"=" if op == "in" else "!="} {list(value)!r}'
+        return f'{col} {"==" if op == "=" else op} {value!r}'
+
 if __name__ == "__main__":
     if len(sys.argv) == 2:
         print(ReadDb(sys.argv[1]).read_db())
@@ -0,0 +1,203 @@
+"""
+resident_db - Module for a database kept in memory across saves.
+
+Every `Write2Db.run` reads the whole database back through ReadDb before
+    writing, so saving costs time proportional to the history. This module
+    keeps a long-lived handle instead: the file is loaded once per process,
+    new rows are checked against the dedup keys held in memory and kept as
+    dirty rows, and a flush writes only those rows when the format can be
+    appended to (see util.APPEND_FRMT), or rewrites the file from memory
+    when it cannot.
+
+Functions:
+    open_db(fn): Return the process-wide ResidentDb of a database file.
+
+Classes:
+    ResidentDb(fn): The in-memory copy of the database file `fn`.
+
+Usage Example:
+    db = open_db('wshazam.csv')
+    db.add(rows)       # duplicates are dropped, new rows become dirty
+    db.flush()         # appends the dirty rows, or rewrites the file
+
+Notes:
+    - The file is reloaded only when its modification time or size differs
+        from what the handle last read or wrote, i.e. when another writer
+        changed it. Dirty rows are checked against the reloaded keys.
+    - Rows stay dirty until a flush succeeds, so a failed flush is retried
+        by the next one.
+    - A flush holds the exclusive db lock (see db_lock) from the change
+        check to the end of the write.
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+import parquet_dataset
+from db_lock import DbLock
+from dedup_index import frame_hashes
+from read_db import ReadDb
+from util import APPEND_FRMT, TRACK_ID, WRITE_FRMT, track_ids
+from write_db_class import Write2Db
+
+
+class ResidentDb():
+    """
+    A database file loaded once and updated in memory.
+    """
+
+    def __init__(self, fn):
+        """
+        @param fn: the database file
+        """
+        self.fn = fn
+        self.frmt = os.path.splitext(fn)[1]
+        self.lock = threading.RLock()
+        self.frames = []
+        self.keys = set()
+        self.dirty = []
+        self.signature = None
+        self.loads = 0
+
+    @staticmethod
+    def _signature(fn):
+        if parquet_dataset.is_dataset(fn):
+            # new parts go into subdirectories, see parquet_dataset
+            return parquet_dataset.signature(fn)
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        """
+        Read the database file into memory and rebuild the dedup keys.
+        """
+        with self.lock:
+            self.signature = self._signature(self.fn)
+            df = ReadDb(self.fn, encoding='utf-8').read_db() \
+                if self.signature else None
+            df = df if isinstance(df, pd.DataFrame) else pd.DataFrame()
+            self.frames = [df] if len(df.columns) else []
+            self.keys = set(frame_hashes(df))
+            self.loads += 1
+            # rows another writer stored meanwhile are no longer dirty
+            dirty, self.dirty = self.dirty, []
+            for df in dirty:
+                self._add_frame(df)
+
+    def changed(self):
+        """
+        Tell whether the file changed since it was last read or written.
+        """
+        return self.loads == 0 or self._signature(self.fn) != self.signature
+
+    def _add_frame(self, df):
+        hashes = frame_hashes(df)
+        is_new = []
+        for h in hashes:
+            is_new.append(h not in self.keys)
+            self.keys.add(h)
+        df = df[is_new]
+        if len(df):
+            self.dirty.append(df)
+        return len(df)
+
+    def add(self, rows):
+        """
+        Add rows in memory, dropping the ones whose dedup key is stored.
+
+        @param rows: a list of dicts, as accepted by Write2Db
+        @return: the number of new (dirty) rows
+        """
+        with self.lock:
+            if self.changed():
+                self.load()
+            df = pd.DataFrame(rows)
+            if TRACK_ID in df.columns:
+                df[TRACK_ID] = track_ids(df)
+            return self._add_frame(df)
+
+    def frame(self):
+        """
+        Return the stored rows followed by the dirty ones.
+        """
+        with self.lock:
+            frames = self.frames + self.dirty
+            if not frames:
+                return pd.DataFrame()
+            if any(TRACK_ID in df.columns for df in frames):
+                frames = [df if TRACK_ID in df.columns
+                          else df.assign(**{TRACK_ID: track_ids(df)})
+                          for df in frames]
+            return pd.concat(frames).reset_index(drop=True)
+
+    def _compatible(self):
+        """
+        Tell whether the dirty rows have the columns of the stored ones.
+        """
+        if not self.frames:
+            return True
+        stored = set(self.frames[0].columns) - {TRACK_ID}
+        return all(set(df.columns) - {TRACK_ID} == stored for df in self.dirty)
+
+    def flush(self):
+        """
+        Write the dirty rows to the database file.
+
+        Formats in APPEND_FRMT get only the dirty rows appended; any other
+        format is rewritten from memory, without reading it back.
+
+        @return: True if nothing was dirty or the rows were written
+        """
+        with self.lock, DbLock(self.fn).exclusive():
+            if self.changed():
+                self.load()
+            if not self.dirty:
+                return True
+            dirty = pd.concat(self.dirty).reset_index(drop=True)
+            writer = Write2Db(dirty.to_dict('records'), self.fn)
+            status = None
+            if self.frmt in APPEND_FRMT:
+                try:
+                    status = writer.append_rows(self.frmt)
+                except (ValueError, TypeError) as e:
+                    # e.g. an HDF file written in fixed format, rewrite it
+                    print(f'Cannot append to {self.fn}: {e}')
+            if status is None:
+                status = self._rewrite(writer)
+                if status:
+                    self.frames = [writer.df]
+            elif status:
+                # concatenated only when the file is rewritten, see frame
+                self.frames.append(dirty)
+            if status:
+                self.dirty = []
+                self.signature = self._signature(self.fn)
+            return bool(status)
+
+    def _rewrite(self, writer):
+        if not self._compatible():
+            print(f'file: {self.fn} has an incompatibale structure with you data')
+            return False
+        frmt = self.frmt if self.frmt in WRITE_FRMT else '.csv'
+        writer.df = self.frame()
+        return writer.write(frmt)
+
+
+_DBS = {}
+_DBS_LOCK = threading.Lock()
+
+
+def open_db(fn):
+    """
+    Return the ResidentDb of `fn`, shared by every writer of the process.
+    """
+    key = os.path.abspath(fn)
+    with _DBS_LOCK:
+        if key not in _DBS:
+            _DBS[key] = ResidentDb(fn)
+        return _DBS[key]
@@ -0,0 +1,191 @@
+"""
+scheduler - Module for deciding when to run the next recognition.
+
+The Shazam URL stored with every row carries where in the track the
+    recognition happened and how long the track is:
+
+    https://www.shazam.com/track/468503633/...?co=GB&referrer=shortcuts
+        &offsetInMilliseconds=36123&timeSkew=-3.695488E-6
+        &trackLength=202865&startDate=2024-05-13T16:35:20.925Z
+
+    so the end of the current track can be predicted as
+    startDate + trackLength - offsetInMilliseconds. Instead of recognising
+    again after a fixed delay, the scheduler sleeps until shortly before
+    that moment.
+
+When nothing is playing the shortcut keeps returning no row, or the same
+    track again. AdaptiveBackoff widens the polling interval after each
+    such empty or duplicate result, up to a maximum, and snaps back to the
+    minimum as soon as a new track is recognised. It counts the recognition
+    calls that polling at the minimum interval would have made meanwhile.
+
+Functions:
+    track_params(url): Extract the offset, track length and start date of a Shazam URL.
+
+Classes:
+    AdaptiveBackoff(min_interval=5.0, max_interval=600.0, factor=2.0):
+        The polling interval while nothing new is recognised.
+    TrackScheduler: Compute the delay before the next recognition.
+
+Usage Example:
+    scheduler = TrackScheduler(backoff=AdaptiveBackoff(10, 300))
+    while True:
+        row = recognise()
+        time.sleep(scheduler.next_delay(row, changed=is_new(row)))
+    print(scheduler.backoff.saved_calls)
+
+Notes:
+    - Rows parsed before bare `&` were escaped (see parse_row) have lost the
+        parameter names: '?co=GB=shortcuts=36123=-3.695488E-6=202865=2024-...'.
+        These are read by position.
+"""
+
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+# parameter order of the shortcut's Shazam URLs
+URL_PARAMS = ['co', 'referrer', 'offsetInMilliseconds', 'timeSkew',
+              'trackLength', 'startDate']
+
+
+def _parse_date(value):
+    try:
+        date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def track_params(url):
+    """
+    Extract the playback position parameters of a Shazam URL.
+
+    :param url: The shazamurl of a row
+    :return: A dict with 'offset_ms', 'track_length_ms' and 'start_date'
+        (an aware datetime or None), or None if the URL has no track length
+    """
+    if not url:
+        return None
+    query = urlsplit(url.strip()).query
+    params = {key: values[0] for key, values in parse_qs(query).items()}
+    if 'trackLength' not in params and '&' not in query:
+        params = dict(zip(URL_PARAMS, query.split('=')[1:]))
+    try:
+        length = int(float(params['trackLength']))
+        offset = int(float(params.get('offsetInMilliseconds', 0)))
+    except (KeyError, ValueError):
+        return None
+    return {'offset_ms': offset, 'track_length_ms': length,
+            'start_date': _parse_date(params.get('startDate'))}
+
+
+class AdaptiveBackoff():
+    """
+    Widen the polling interval after empty or duplicate results.
+    """
+
+    def __init__(self, min_interval=5.0, max_interval=600.0, factor=2.0):
+        """
+        @param min_interval: the interval after the first empty result, and
+            the baseline the saved calls are counted against
+        @param max_interval: the widest interval
+        @param factor: the growth of the interval after each further result
+        """
+        if min_interval <= 0 or max_interval < min_interval or factor < 1:
+            raise ValueError('need 0 < min_interval <= max_interval and factor >= 1')
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.misses = 0
+        self.calls = 0
+        self.waited = 0.0
+
+    @property
+    def interval(self):
+        """
+        The interval the next miss will wait.
+        """
+        return min(self.max_interval,
+                   self.min_interval * self.factor ** self.misses)
+
+    def widen(self, delay=None):
+        """
+        Record an empty or duplicate result and return the seconds to wait.
+
+        :param delay: The wait actually used, if the caller bounds `interval`
+        """
+        delay = self.interval if delay is None else delay
+        self.misses += 1
+        self.calls += 1
+        self.waited += delay
+        return delay
+
+    def reset(self):
+        """
+        Record a new track, the next miss waits `min_interval` again.
+        """
+        self.misses = 0
+
+    @property
+    def saved_calls(self):
+        """
+        The recognition calls avoided compared to polling every `min_interval`.
+        """
+        return max(0, int(self.waited // self.min_interval) - self.calls)
+
+    def stats(self):
+        return {'misses': self.misses, 'interval': self.interval,
+                'saved_calls': self.saved_calls}
+
+
+class TrackScheduler():
+    """
+    Compute the delay before the next recognition from the last result.
+    """
+
+    def __init__(self, lead=5.0, default=20.0, min_delay=0.0, max_delay=600.0,
+                 backoff=None):
+        """
+        @param lead: wake this many seconds before the predicted end of track
+        @param default: the delay after a row without track parameters
+        @param min_delay, max_delay: the bounds of every delay, in seconds
+        @param backoff: the AdaptiveBackoff used after empty or duplicate
+            results, AdaptiveBackoff() by default
+        """
+        self.lead = lead
+        self.default = default
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.backoff = backoff or AdaptiveBackoff()
+
+    def _clamp(self, delay):
+        return max(self.min_delay, min(self.max_delay, delay))
+
+    def remaining(self, row, now=None):
+        """
+        Return the seconds left until the track of `row` ends, None if unknown.
+        """
+        params = track_params(row.get('shazamurl')) if row else None
+        if params is None:
+            return None
+        left = (params['track_length_ms'] - params['offset_ms']) / 1000
+        if params['start_date'] is not None:
+            now = now or datetime.now(timezone.utc)
+            left -= (now - params['start_date']).total_seconds()
+        return left
+
+    def next_delay(self, row, now=None, changed=True):
+        """
+        Return the seconds to sleep before recognising again.
+
+        :param row: The last parsed row, None or empty if nothing was recognised
+        :param now: The current time, an aware datetime (default is now)
+        :param changed: False if `row` is the track recognised last time
+        """
+        if not row or not changed:
+            return self.backoff.widen(self._clamp(self.backoff.interval))
+        self.backoff.reset()
+        left = self.remaining(row, now)
+        if left is None:
+            return self._clamp(self.default)
+        return self._clamp(left - self.lead)
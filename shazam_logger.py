@@ -1,6 +1,6 @@
 
 
-from multiprocessing.pool import ThreadPool
+import asyncio
 import os  # The os module is a built-in Python module
 import time  # The time module is a built-in Python module
 import sys
@@ -9,87 +9,222 @@ import signal
 # ###########################################################
 # Custom module find in file ./shazam_step.py
 from shazam_step import ShazamStep
-# Custom module find in file ./write_db_class.py
-from write_db_class import Write2Db
+# Custom module find in file ./resident_db.py
+from resident_db import open_db
 # Custom module find in file ./parse_row.py
 from parse_row import parse_row
+# Custom module find in file ./journal.py
+from journal import COMPACTING_SUFFIX, Compactor, Journal
+# Custom module find in file ./file_watch.py
+from file_watch import wait_for_file
+# Custom module find in file ./shazam_pipeline.py
+from shazam_pipeline import ShazamPipeline
+# Custom module find in file ./scheduler.py
+from scheduler import AdaptiveBackoff, TrackScheduler
+# Custom module find in file ./executor.py
+import executor
+# Custom module find in file ./util.py
+from util import TRACK_ID
+# Custom module find in file ./db_tools.py
+import db_tools
 # ###########################################################
 
+# JSON Lines: saving a row appends one line, see util.APPEND_FRMT
+DEFAULT_DB = 'wshazam.jsonl'
+# the default db of earlier versions, see migrate_db
+LEGACY_DB = 'wshazam.json'
+
+
+def migrate_db(new=DEFAULT_DB, old=LEGACY_DB):
+    """
+    Convert the JSON db of earlier versions into the JSON Lines db `new`,
+    on the first run that finds the old one and not the new one.
+
+    The rows are copied with db_tools.export and the old db is kept as
+    it is; the rows of its journal are moved to the journal of `new`, so
+    rows recognised but not yet folded are not lost.
+
+    :return: The db to use, `new`
+    """
+    if os.path.exists(new) or not os.path.exists(old):
+        return new
+    rows = db_tools.export(old, new)
+    for suffix in ('.journal', f'.journal{COMPACTING_SUFFIX}'):
+        if os.path.exists(old + suffix) and not os.path.exists(new + suffix):
+            os.replace(old + suffix, new + suffix)
+    print(f'converted {rows} rows of {old} to {new}, {old} is kept as is')
+    return new
+
+
 class ShazamLogger():
     # Define a signal handler for interrupt signal
     def signal_handler(self, sig, frame):
+        """
+        Stop the logger on SIGINT.
+
+        The handler runs on the main thread, possibly while it holds the
+        journal lock in Journal.append, so it must not save: it only sets
+        `stopping` and raises KeyboardInterrupt, and run() folds the
+        journal once its loop has exited. A second interrupt does not
+        break that last folding.
+        """
         print("Interrupt received. Exiting gracefully.")
-        print(self.stored)
-        if not self.stored:
-            save()
-        sys.exit(0)
-    def __init__(self, filename) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        raise KeyboardInterrupt
+    def __init__(self, filename, group_rows=8, group_interval=5.0,
+                 compact_interval=300.0, min_interval=5.0,
+                 max_interval=600.0, step_timeout=120.0) -> None:
+        """
+        @param filename: the db file
+        @param group_rows, group_interval: journal rows are fsynced every
+            `group_rows` rows or `group_interval` seconds, see journal.Journal
+        @param compact_interval: seconds between two foldings of the
+            journal into the db
+        @param min_interval, max_interval: the bounds of the polling interval
+            while nothing new is recognised, see scheduler.AdaptiveBackoff
+        @param step_timeout: seconds to wait for the output of the shortcut
+        """
         self.subset = ['title', 'artist']
         self.stored = False
+        self.stopping = False
         self.db_file = filename
         self.outfile = './www'
+        self.step_timeout = step_timeout
         self.data = list()
         self.past = list()
-        self.rows = list()
+        self.journal = Journal(f'{filename}.journal', group_rows, group_interval)
+        self.compactor = Compactor(self.journal, self.fold, compact_interval)
+        # loaded on the first save, then kept in memory, see resident_db
+        self.db = open_db(filename)
+        self.scheduler = TrackScheduler(
+            backoff=AdaptiveBackoff(min_interval, max_interval))
         signal.signal(signal.SIGINT, self.signal_handler)
+        # cancel queued db work before the handler above stops the loop
+        executor.install_signal_handlers()
 
-    def wait_for_file(self, limit=1e12, lag=1):
+    def wait_for_file(self, timeout=None, lag=1):
         """
         The wait_for_file function waits for a file to be created.
         --------------------------------------------------
-        :param outfile: Specify the file that is being waited for
-        :param limit: Set a limit on the number of times the while loop will run
-        :param lag: time delay in seconds,
-            after every file check it sleep for `lag` seconds
-        :return: True if the file exists, and false if `limit` is reached
-        """
-        cnt = 0
-        while not os.path.exists(self.outfile):
-            time.sleep(lag)
-            if cnt > limit:
-                return False
-            cnt += 1
-        return True
+        :param timeout: Give up after `timeout` seconds, None to wait forever
+        :param lag: time delay in seconds between two checks,
+            only used where inotify is not available (see file_watch)
+        :return: True if the file exists, and false if `timeout` is reached
+        """
+        return wait_for_file(self.outfile, timeout=timeout, poll=lag)
 
     def song_changed(self):
+        """
+        Tell whether self.data is a different song than self.past, comparing
+        their track ids, or the subset columns when either has no id.
+        """
+        if not self.data:
+            return False
         if not self.past:
             return True
-        if self.data:
-            return all((self.data[k] == self.past[k]) for k in self.subset if k in self.data and k in self.past)
+        if TRACK_ID in self.data and TRACK_ID in self.past:
+            return self.data[TRACK_ID] != self.past[TRACK_ID]
+        return not all((self.data[k] == self.past[k]) for k in self.subset if k in self.data and k in self.past)
     
     def flow(self):
-        ShazamStep(self.outfile).run()
-        self.past = self.data
-        self.wait_for_file()
+        ShazamStep(self.outfile).run(timeout=self.step_timeout)
+        # keep the last recognised track across silences
+        if self.data:
+            self.past = self.data
+        if not self.wait_for_file(timeout=0):
+            print(f'no output in {self.outfile} after {self.step_timeout} s')
+            # nothing recognised, back off
+            self.data = None
+            time.sleep(self.scheduler.next_delay(None))
+            return
         self.data = parse_row(self.outfile)
         os.remove(self.outfile)
         if self.data and len(self.data)>0:
             print(self.data['title'], ' by ',self.data['artist'])
-        if not self.song_changed():
-            time.sleep(20)
-        else:
+        changed = self.song_changed()
+        if changed:
             if self.data and any(k in self.data for k in self.subset):
-                self.rows.append(self.data)
+                self.journal.append(self.data)
+        # sleep until shortly before the track ends, or back off while
+        # nothing new is recognised, see scheduler
+        time.sleep(self.scheduler.next_delay(self.data, changed=changed))
+
+    def fold(self, rows):
+        """
+        Write journaled rows to the db, used by the journal compactor.
+
+        Only the rows that are new to the resident db are written.
+        """
+        self.db.add(rows)
+        return self.db.flush()
+
     def save(self):
-        wc = Write2Db([self.rows], self.db_file, encoding='utf-8')
-        pool = ThreadPool(processes=1)
-        async_result = pool.apply_async(wc.run)
-        status = async_result.get()
-        return status
+        """
+        Fold every journaled row into the db.
+        """
+        self.journal.sync()
+        return executor.submit_io(self.journal.compact, self.fold).result()
+
+    def stop(self):
+        """
+        Stop the compactor, which folds the journal one last time.
+
+        The folding runs on the I/O pool, as in save(), so an interrupt
+        handled by the main thread meanwhile does not break the write.
+        """
+        return executor.submit_io(self.compactor.stop).result()
     
    
     def run(self):
-
+        # fold the rows a previous session left in the journal
+        self.save()
+        self.compactor.start()
         while True:
             try:
                 self.flow()
             except KeyboardInterrupt:
-                save()
+                self.stop()
                 self.stored = True
                 time.sleep(10)
                 break
         if not self.stored:
-            save()
+            self.stop()
+        self.report()
+
+    def report(self):
+        """
+        Print how many recognition calls the adaptive backoff saved.
+        """
+        saved = self.scheduler.backoff.saved_calls
+        print(f'adaptive backoff saved {saved} recognition calls')
+        return saved
+
+    def run_async(self, limit=None, queue_size=4):
+        """
+        Run the logger as an asyncio pipeline, see shazam_pipeline.
+
+        :param limit: stop after this many recognitions, None to run forever
+        :param queue_size: the capacity of the queues between stages
+        :return: the pipeline stats (queue depths and stage latencies)
+        """
+        self.save()
+        self.compactor.start()
+        pipeline = ShazamPipeline(self, queue_size=queue_size)
+        try:
+            return asyncio.run(pipeline.run(limit))
+        except KeyboardInterrupt:
+            return pipeline.stats()
+        finally:
+            self.stored = True
+            self.stop()
+            self.report()
 
 if __name__ == "__main__":
-    print(ShazamLogger('wshazam.json').run())
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    db_file = args[0] if args else migrate_db()
+    if '--async' in sys.argv:
+        print(ShazamLogger(db_file).run_async())
+    else:
+        print(ShazamLogger(db_file).run())
@@ -0,0 +1,201 @@
+"""
+shazam_pipeline - Module for running the Shazam logger as an asyncio pipeline.
+
+`ShazamLogger.flow` runs the shortcut, waits for its output, parses it and
+    stores the row strictly in series. This module runs the same work as
+    three asyncio stages connected by bounded queues, so a slow database
+    write never delays the next recognition:
+
+    recognize --(output files)--> parse --(rows)--> persist
+
+    - recognize: runs the shazam_step shortcut as an asyncio subprocess
+        (see shazam_step.AsyncShazamStep), each run writing its own output
+        file so the next run cannot overwrite it.
+    - parse: parses each output file, drops it, and forwards rows whose
+        song changed. The delay before the next recognition depends on the
+        parsed row (see scheduler), so it is sent back to the recognize
+        stage, which waits for it.
+    - persist: appends the rows to the logger's journal.
+
+Classes:
+    StageStats: Count and latency of the items handled by a stage.
+    ShazamPipeline(logger, recognize=None, queue_size=4, scheduler=None, step=None):
+        The pipeline.
+
+Usage Example:
+    logger = ShazamLogger('wshazam.jsonl')
+    logger.run_async()
+
+Notes:
+    - Blocking work (parsing, file I/O) runs in the shared I/O pool (see
+        executor); the event loop itself waits on the shortcut and moves
+        items between queues.
+    - `ShazamPipeline.stats()` returns the queue depths, the per-stage
+        latencies and the backoff state (including the recognition calls it
+        saved), which are also printed when the pipeline stops.
+"""
+
+import asyncio
+import itertools
+import os
+import time
+
+import executor
+from parse_row import parse_row
+from shazam_step import AsyncShazamStep
+
+
+class StageStats():
+    """
+    Count and latency of the items handled by a pipeline stage.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {'count': self.count, 'mean': mean, 'max': self.max}
+
+
+class ShazamPipeline():
+    """
+    Recognize, parse and persist stages connected by bounded queues.
+    """
+
+    def __init__(self, logger, recognize=None, queue_size=4, scheduler=None,
+                 step=None):
+        """
+        @param logger: the ShazamLogger whose output file, change detection
+            and journal are used
+        @param recognize: a blocking callable taking the output file and
+            returning True once it is written, used instead of `step`
+        @param queue_size: the capacity of each queue
+        @param scheduler: the TrackScheduler deciding how long to wait
+            before recognising again, the logger's by default
+        @param step: the AsyncShazamStep running the shortcut, one writing
+            next to the logger's output file by default
+        """
+        self.logger = logger
+        self.recognize_fn = recognize
+        self.step = step
+        self.queue_size = queue_size
+        self.scheduler = scheduler or logger.scheduler
+        self.parse_queue = None
+        self.persist_queue = None
+        # the delay after each parsed file, from parse to recognize
+        self.delay_queue = None
+        self.stage_stats = {stage: StageStats()
+                            for stage in ('recognize', 'parse', 'persist')}
+        self._seq = itertools.count()
+
+    def stats(self):
+        """
+        Return the queue depths and the latency of every stage.
+        """
+        return {
+            'queues': {
+                'parse': self.parse_queue.qsize() if self.parse_queue else 0,
+                'persist': self.persist_queue.qsize() if self.persist_queue else 0,
+            },
+            'stages': {stage: st.as_dict() for stage, st in self.stage_stats.items()},
+            'backoff': self.scheduler.backoff.stats(),
+        }
+
+    def _recognize_once(self):
+        """
+        Run `recognize` and move its output aside, return the new path.
+        """
+        outfile = self.logger.outfile
+        if not self.recognize_fn(outfile) or not os.path.exists(outfile):
+            return None
+        path = f'{outfile}.{os.getpid()}.{next(self._seq)}'
+        os.replace(outfile, path)
+        return path
+
+    async def recognize(self, limit=None):
+        """
+        Producer stage, put the output file of every run on the parse queue.
+
+        Before the next run it sleeps for the delay the parse stage sent back
+        for the file, or for the backoff delay if nothing was recognised.
+        """
+        if self.recognize_fn is None and self.step is None:
+            self.step = AsyncShazamStep(self.logger.outfile)
+        runs = itertools.count() if limit is None else range(limit)
+        delay = 0
+        for _ in runs:
+            if delay:
+                await asyncio.sleep(delay)
+            start = time.monotonic()
+            if self.recognize_fn is None:
+                path = await self.step.fetch()
+                if not path:
+                    print(f'recognition failed: {path!r}')
+                    path = None
+            else:
+                path = await asyncio.wrap_future(executor.submit_io(self._recognize_once))
+            self.stage_stats['recognize'].add(time.monotonic() - start)
+            if path:
+                await self.parse_queue.put(path)
+                delay = await self.delay_queue.get()
+            else:
+                delay = self.scheduler.next_delay(None)
+        await self.parse_queue.put(None)
+
+    def _parse_file(self, path):
+        row = parse_row(path, backend='expat')
+        os.remove(path)
+        return row
+
+    async def parse(self):
+        """
+        Parse stage, forward the rows whose song changed.
+        """
+        logger = self.logger
+        while (path := await self.parse_queue.get()) is not None:
+            start = time.monotonic()
+            if logger.data:
+                logger.past = logger.data
+            logger.data = await asyncio.wrap_future(
+                executor.submit_io(self._parse_file, path))
+            self.stage_stats['parse'].add(time.monotonic() - start)
+            if logger.data:
+                print(logger.data.get('title'), ' by ', logger.data.get('artist'))
+            changed = logger.song_changed()
+            await self.delay_queue.put(
+                self.scheduler.next_delay(logger.data, changed=changed))
+            if changed and any(k in logger.data for k in logger.subset):
+                await self.persist_queue.put(logger.data)
+        await self.persist_queue.put(None)
+
+    async def persist(self):
+        """
+        Persistence stage, append the rows to the logger's journal.
+        """
+        while (row := await self.persist_queue.get()) is not None:
+            start = time.monotonic()
+            await asyncio.wrap_future(executor.submit_io(self.logger.journal.append, row))
+            self.stage_stats['persist'].add(time.monotonic() - start)
+
+    async def run(self, limit=None):
+        """
+        Run the three stages until `limit` recognitions, or forever.
+
+        @return: the final stats, see stats
+        """
+        self.parse_queue = asyncio.Queue(self.queue_size)
+        self.persist_queue = asyncio.Queue(self.queue_size)
+        self.delay_queue = asyncio.Queue()
+        try:
+            await asyncio.gather(self.recognize(limit), self.parse(), self.persist())
+        finally:
+            print(f'pipeline stats: {self.stats()}')
+        return self.stats()
@@ -1,52 +1,169 @@
+import asyncio
+import itertools
 import os
 import re
 import subprocess
-import threading
-import time
-import signal
-import sys
+
+import executor
+from file_watch import wait_for_file
+from parse_row import parse_row
+
+SHORTCUT = ["shortcuts", "run", "shazam_step"]
+
+
+def clean_filename(filename):
+    """
+    Keep only the alphanumeric characters of an output file name.
+    """
+    if re.match ('[^A-Za-z0-9]',filename):
+        print('Only alphanumeric names allowed, cleaning up the filename')
+    filename = re.sub('[^A-Za-z0-9]','',filename)
+    if len(filename) == 0:
+        filename = 'outfile'
+    return filename
+
 
 class ShazamStep():
     def __init__(self, filename):
-        if re.match ('[^A-Za-z0-9]',filename):
-            print('Only alphanumeric names allowed, cleaning up the filename')
-        self.filename = re.sub('[^A-Za-z0-9]','',filename)
-        if len(self.filename) == 0:
-            self.filename = 'outfile'
+        self.filename = clean_filename(filename)
 
     def fetch_row(self):
         """
-        Run the shazam_step shortcut using subprocess
-        and return a subprocess.CompletedProcess object.
+        Start the shazam_step shortcut using subprocess
+        and return its subprocess.Popen object.
         """
-        script = ["shortcuts", "run", "shazam_step",
-                  "-o", self.filename]
+        script = SHORTCUT + ["-o", self.filename]
         print(f'run: {' '.join(script)}')
-        return subprocess.call(script,)
+        return subprocess.Popen(script)
 
-    def run(self):
+    def run(self, timeout=None):
         """
-        Create a new thread to run the fetch_row function asynchronously
-        and continuously check for the existence of the output file until
-        the Shazam process completes.
+        Start the shortcut with fetch_row and wait for the output file
+        until the Shazam process completes.
+
+        On timeout the shortcut is killed and a partial output file is
+        removed, so a late file of this run is never taken for the output
+        of the next one.
+
+        :param timeout: Give up after `timeout` seconds, None to wait forever
+        :return: True once the output file is written, False on timeout
         """
-        # Define a signal handler for interrupt signal
-        def signal_handler(sig, frame):
-            print("Interrupt received. Exiting gracefully.")
-            sys.exit(0)
+        try:
+            proc = self.fetch_row()
+        except OSError as e:
+            print(f'cannot run the shortcut: {e}')
+            return False
+
+        # Wait for the shortcut to close the output file
+        if wait_for_file(self.filename, timeout=timeout):
+            print("Shazamed Successfully!")
+            return True
+        proc.kill()
+        proc.wait()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        return False
+
+
+class StepFailure():
+    """
+    Why a shortcut run produced no row. Failures are falsy, so
+    `if result:` tells a parsed row from a failure.
+    """
+    TIMEOUT = 'timeout'
+    EXIT = 'exit'
+    NO_OUTPUT = 'no output'
+    NO_MATCH = 'no match'
+
+    def __init__(self, reason, returncode=None, stderr=''):
+        self.reason = reason
+        self.returncode = returncode
+        self.stderr = stderr
+
+    def __bool__(self):
+        return False
+
+    def __eq__(self, other):
+        return isinstance(other, StepFailure) and self.reason == other.reason
 
-        signal.signal(signal.SIGINT, signal_handler)  # Register signal handler
+    def __repr__(self):
+        return (f'StepFailure({self.reason!r}, returncode={self.returncode!r}, '
+                f'stderr={self.stderr!r})')
 
-        # Create and start a new thread for the fetch_row function
-        thr_fetch_row = threading.Thread(target=self.fetch_row)
-        thr_fetch_row.start()
 
-        # Continuous check for the existence of the output file
-        while True:
-            if os.path.exists(self.filename):
-                print("Shazamed Successfully!")
-                return True
-            time.sleep(1)
+class AsyncShazamStep():
+    """
+    Run the shazam_step shortcut with asyncio subprocesses.
+
+    Every run writes to its own output file, is killed once `timeout`
+    seconds have passed or when it is cancelled, and at most
+    `max_in_flight` runs execute at once. All runs share the caller's event loop; no thread is started.
+    """
+
+    def __init__(self, filename, timeout=60, max_in_flight=1, backend='expat'):
+        """
+        @param filename: the base name of the output files
+        @param timeout: the deadline of one run in seconds
+        @param max_in_flight: the maximum number of concurrent runs
+        @param backend: the parse_row backend used by run
+        """
+        self.filename = clean_filename(filename)
+        self.timeout = timeout
+        self.backend = backend
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._seq = itertools.count()
+
+    async def fetch(self):
+        """
+        Run the shortcut once.
+
+        :return: the path of the output file, or a StepFailure
+        """
+        outfile = f'{self.filename}{next(self._seq)}'
+        script = SHORTCUT + ["-o", outfile]
+        async with self._semaphore:
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *script, stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE)
+            except OSError as e:
+                return StepFailure(StepFailure.EXIT, None, str(e))
+            try:
+                _, stderr = await asyncio.wait_for(proc.communicate(), self.timeout)
+            except BaseException as e:
+                # a timeout, or the run cancelled: no child or file is left
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                if os.path.exists(outfile):
+                    os.remove(outfile)
+                if isinstance(e, asyncio.TimeoutError):
+                    return StepFailure(StepFailure.TIMEOUT)
+                raise
+        stderr = stderr.decode(errors='replace').strip()
+        if proc.returncode != 0:
+            if os.path.exists(outfile):
+                os.remove(outfile)
+            return StepFailure(StepFailure.EXIT, proc.returncode, stderr)
+        if not os.path.exists(outfile):
+            return StepFailure(StepFailure.NO_OUTPUT, proc.returncode, stderr)
+        return outfile
+
+    async def run(self):
+        """
+        Run the shortcut once and parse its output.
+
+        :return: the parsed row, or a StepFailure
+        """
+        outfile = await self.fetch()
+        if not outfile:
+            return outfile
+        row = await asyncio.wrap_future(
+            executor.submit_io(parse_row, outfile, 'utf-8', self.backend))
+        os.remove(outfile)
+        return row or StepFailure(StepFailure.NO_MATCH)
 
 
 if __name__ == "__main__":
@@ -39,13 +39,12 @@ https://man7.org/linux/man-pages/man1/file.1.html
 """
 
 import os
-import re
 import signal
 import sys
-from multiprocessing.pool import ThreadPool
 import threading
 import pandas as pd
 
+import executor
 import util
 
 READ_FRMT = {
@@ -53,6 +52,7 @@ READ_FRMT = {
     '.xls': 'read_excel',
     '.xlsx': 'read_excel',
     '.json': 'read_json',
+    '.jsonl': 'read_json',
     '.html': 'read_html',
     '.sql': 'read_sql',
     '.parquet': 'read_parquet',
@@ -67,6 +67,7 @@ WRITE_FRMT = {
     '.xls': 'to_excel',
     '.xlsx': 'to_excel',
     '.json': 'to_json',
+    '.jsonl': 'to_json',
     '.html': 'to_html',
     '.sql': 'to_sql',
     '.parquet': 'to_parquet',
@@ -93,6 +94,7 @@ class ReadDb:
         :return: A dataframe
         """
         args = akwargs if 'args' in akwargs else {'encoding': 'utf-8'}
+        args = {**args, **util.READ_ARGS.get(frmt, {})}
         method = READ_FRMT.get(frmt)
         if method:
             read_method = getattr(pd, method)
@@ -109,20 +111,9 @@ class ReadDb:
         if not os.path.exists(fn):
             return None
 
-        _, ext = os.path.splitext(fn)
+        frmt = util.detect_format(fn, READ_FRMT)
 
-        rgx = '|'.join(map(lambda c: c.strip('.'), READ_FRMT.keys()))
-        rgx = rf'({rgx})'
-        ft = util.detect_file_type(fn)
-        ft = re.findall(rgx, ft)
-        if len(ft) > 0:
-            frmt = f'.{ft[0]}'
-        else:
-            frmt = ext
-
-        pool = ThreadPool(processes=1)
-        async_result = pool.apply_async(self.read, (frmt,))
-        data = async_result.get()
+        data = executor.submit_io(self.read, fn, frmt).result()
         if data is not None:
             return data
 
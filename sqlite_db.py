@@ -0,0 +1,280 @@
+"""
+sqlite_db - Module for storing the rows in an SQLite database (.sql files).
+
+pandas' `read_sql` and `to_sql` need a connection, not a path, so this
+    module is the storage engine behind the '.sql' format of ReadDb,
+    Write2Db and write_db. The rows live in the table util.SQL_TABLE, with
+    one column per field plus KEY_COLUMN, the 64-bit dedup key of the row
+    (see dedup_index.frame_hashes), under a UNIQUE index. New rows are
+    inserted with a single `executemany` in one transaction and rows whose
+    key is already stored are skipped by the index, so appending costs
+    time proportional to the new rows, not to the history.
+
+Functions:
+    connect(fn): Open a database in WAL mode.
+    upsert(fn, df): Insert the rows of a DataFrame whose dedup key is new.
+    read(fn, columns=None, filters=None): Read the matching rows into a DataFrame.
+    iter_chunks(fn, chunksize, columns=None, filters=None): Read them through a cursor.
+    write(df, fn): Replace the rows of a database with those of a DataFrame.
+    rewrite(fn): Replace the rows of a database with the rows inserted in a block.
+
+Usage Example:
+    sqlite_db.upsert('wshazam.sql', pd.DataFrame(rows))
+    df = sqlite_db.read('wshazam.sql')
+
+Notes:
+    - In WAL journal mode readers never block the writer and the writer
+        never blocks readers; writers wait for each other up to TIMEOUT.
+    - Tables created by earlier versions (through `to_sql`, without the
+        key column) are migrated on the first upsert: the keys are computed,
+        duplicate rows dropped and the UNIQUE index created.
+    - Columns missing from the table are added, so rows with new fields
+        (e.g. util.TRACK_ID) can be stored in an older database.
+    - A database is never replaced by renaming another file over it, which
+        corrupts the WAL of open connections. `rewrite` fills NEW_TABLE and
+        swaps it for the table in the same transaction instead, so readers
+        see the old rows or the new ones.
+    - The functions that write do not take the db lock (see db_lock); the
+        callers in write_db and write_db_class hold it exclusively.
+"""
+
+import sqlite3
+from contextlib import contextmanager
+from functools import partial
+
+import pandas as pd
+
+from dedup_index import frame_hashes
+from util import SQL_TABLE, check_filters
+
+KEY_COLUMN = 'dedup_key'
+# the table `rewrite` fills before it replaces SQL_TABLE
+NEW_TABLE = f'{SQL_TABLE}_new'
+# seconds a writer waits for another one
+TIMEOUT = 30.0
+# SQL of the util.FILTER_OPS operators
+SQL_OPS = {
+    '=': '=',
+    '==': '=',
+    '!=': '!=',
+    '<': '<',
+    '<=': '<=',
+    '>': '>',
+    '>=': '>=',
+    'in': 'IN',
+    'not in': 'NOT IN',
+}
+
+
+def _signed(key):
+    """
+    SQLite integers are signed 64-bit, store the unsigned keys as such.
+    """
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def connect(fn):
+    """
+    Open the database `fn` in WAL journal mode.
+    """
+    con = sqlite3.connect(fn, timeout=TIMEOUT)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    return con
+
+
+def _key_index(table):
+    # index names are global to the database, one per table
+    return f'{table}_{KEY_COLUMN}'
+
+
+def _columns(con, table=SQL_TABLE):
+    return [row[1] for row in con.execute(f'PRAGMA table_info({_quote(table)})')]
+
+
+def _migrate(con, columns, table=SQL_TABLE):
+    """
+    Add the key column, its UNIQUE index and the missing `columns`.
+    """
+    existing = _columns(con, table)
+    if not existing:
+        cols = ''.join(f', {_quote(c)}' for c in columns)
+        con.execute(f'CREATE TABLE {_quote(table)} '
+                    f'({_quote(KEY_COLUMN)} INTEGER NOT NULL{cols})')
+        existing = [KEY_COLUMN, *columns]
+    for col in columns:
+        if col not in existing:
+            con.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)}')
+    if KEY_COLUMN not in existing:
+        # a table written by to_sql, key its rows and drop the duplicates
+        con.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(KEY_COLUMN)} INTEGER')
+        df = pd.read_sql(f'SELECT rowid, * FROM {_quote(table)}', con)
+        keys = [_signed(k) for k in frame_hashes(df)]
+        con.executemany(f'UPDATE {_quote(table)} SET {_quote(KEY_COLUMN)} = ? '
+                        'WHERE rowid = ?', zip(keys, df['rowid'].tolist()))
+        con.execute(f'DELETE FROM {_quote(table)} WHERE rowid NOT IN '
+                    f'(SELECT MIN(rowid) FROM {_quote(table)} GROUP BY {_quote(KEY_COLUMN)})')
+    con.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {_quote(_key_index(table))} '
+                f'ON {_quote(table)} ({_quote(KEY_COLUMN)})')
+
+
+def _values(df):
+    """
+    Convert a DataFrame to rows of Python values, NA becomes NULL.
+    """
+    values = df.astype(object).where(df.notna(), None)
+    return values.itertuples(index=False, name=None)
+
+
+def _insert(con, df, table=SQL_TABLE):
+    """
+    Insert the rows of `df` whose dedup key is not in `table` yet, in the
+    current transaction of `con`.
+    """
+    df = df.reset_index(drop=True)
+    keys = pd.Series([_signed(k) for k in frame_hashes(df)], dtype=object)
+    columns = [c for c in df.columns if c != KEY_COLUMN]
+    rows = _values(df[columns].assign(**{KEY_COLUMN: keys}))
+    placeholders = ', '.join('?' * (len(columns) + 1))
+    names = ', '.join(_quote(c) for c in [*columns, KEY_COLUMN])
+    _migrate(con, columns, table)
+    before = con.total_changes
+    con.executemany(f'INSERT INTO {_quote(table)} ({names}) '
+                    f'VALUES ({placeholders}) '
+                    f'ON CONFLICT({_quote(KEY_COLUMN)}) DO NOTHING', rows)
+    return con.total_changes - before
+
+
+def upsert(fn, df):
+    """
+    Insert the rows of `df` whose dedup key is not stored yet.
+
+    :param fn: The database file, created if needed
+    :param df: The rows to insert
+    :return: The number of rows inserted
+    """
+    con = connect(fn)
+    try:
+        with con:
+            return _insert(con, df)
+    finally:
+        con.close()
+
+
+def _where(filters, stored):
+    """
+    Return the WHERE clause of `filters` and its parameters.
+    """
+    terms, params = [], []
+    for col, op, value in check_filters(filters):
+        if col not in stored:
+            raise ValueError(f'cannot filter on the unknown column {col!r}')
+        if op in ('in', 'not in'):
+            value = list(value)
+            terms.append(f'{_quote(col)} {SQL_OPS[op]} ({", ".join("?" * len(value))})')
+            params.extend(value)
+        else:
+            terms.append(f'{_quote(col)} {SQL_OPS[op]} ?')
+            params.append(value)
+    return (' WHERE ' + ' AND '.join(terms) if terms else ''), params
+
+
+def _select(con, columns, filters):
+    """
+    Return the SELECT statement of the rows and its parameters, None if
+    there is no column to select.
+    """
+    stored = [c for c in _columns(con) if c != KEY_COLUMN]
+    if not stored:
+        return None, []
+    where, params = _where(filters, stored)
+    if columns is not None:
+        stored = [c for c in stored if c in columns]
+    if not stored:
+        return None, []
+    names = ', '.join(_quote(c) for c in stored)
+    return f'SELECT {names} FROM {_quote(SQL_TABLE)}{where} ORDER BY rowid', params
+
+
+def read(fn, columns=None, filters=None):
+    """
+    Read the rows of the database `fn`, without the key column.
+
+    :param columns: The columns to read, None for all of them
+    :param filters: A list of (column, op, value) filters, see util.FILTER_OPS
+    :return: A DataFrame, empty if the table does not exist
+    """
+    con = connect(fn)
+    try:
+        sql, params = _select(con, columns, filters)
+        if sql is None:
+            return pd.DataFrame(columns=list(columns or []))
+        return pd.read_sql(sql, con, params=params)
+    finally:
+        con.close()
+
+
+def iter_chunks(fn, chunksize, columns=None, filters=None):
+    """
+    Yield the rows of the database `fn` in DataFrames of at most
+    `chunksize` rows, fetched from one cursor.
+
+    The connection stays open until the iterator is exhausted or closed;
+    in WAL mode it does not block writers.
+    """
+    con = connect(fn)
+    try:
+        sql, params = _select(con, columns, filters)
+        if sql is not None:
+            yield from pd.read_sql(sql, con, params=params, chunksize=chunksize)
+    finally:
+        con.close()
+
+
+@contextmanager
+def rewrite(fn):
+    """
+    Replace the rows of the database `fn` with the rows inserted in the
+    block, in one transaction.
+
+    The block gets a function inserting the rows of a DataFrame, see
+    upsert; duplicates are dropped. The rows go to NEW_TABLE, which
+    replaces SQL_TABLE when the block ends. Until then, and for good if
+    the block raises, readers and the block itself read the old rows.
+
+    Usage Example:
+        with sqlite_db.rewrite('wshazam.sql') as insert:
+            for chunk in chunks:
+                insert(chunk)
+    """
+    con = connect(fn)
+    try:
+        # the write lock is taken now, not at the first insert
+        con.execute('BEGIN IMMEDIATE')
+        con.execute(f'DROP TABLE IF EXISTS {_quote(NEW_TABLE)}')
+        yield partial(_insert, con, table=NEW_TABLE)
+        _migrate(con, [], NEW_TABLE)
+        con.execute(f'DROP TABLE IF EXISTS {_quote(SQL_TABLE)}')
+        con.execute(f'ALTER TABLE {_quote(NEW_TABLE)} RENAME TO {_quote(SQL_TABLE)}')
+        con.execute(f'DROP INDEX {_quote(_key_index(NEW_TABLE))}')
+        _migrate(con, [])
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+
+
+def write(df, fn):
+    """
+    Replace the rows of the database `fn` with those of `df`, duplicates
+    dropped, see rewrite.
+    """
+    with rewrite(fn) as insert:
+        insert(df)
+    return True
@@ -0,0 +1,112 @@
+"""
+Test module for the 'arrow_db' module.
+
+The 'arrow_db' module reads Feather databases through a memory map and
+    converts their columns to pandas on use.
+
+Test Cases:
+- test_zero_copy: Tests that Write2Db writes uncompressed Feather files
+    whose table is read without allocating memory.
+- test_arrow_frame: Tests that only the columns used are converted.
+- test_read_db: Tests that ReadDb reads Feather files through the map,
+    with columns, filters and chunks.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+import pyarrow as pa
+
+import arrow_db
+from read_db import ReadDb
+from write_db_class import Write2Db
+
+
+def _rows(n=6):
+    return [{'timestamp': f'{i + 1} March 2024 at 10:00', 'title': f'T{i}',
+             'artist': 'A' if i % 2 else 'B', 'plays': i,
+             'shazamurl': f'https://www.shazam.com/track/{i + 1}/t'}
+            for i in range(n)]
+
+
+class TestArrowDb(unittest.TestCase):
+    """
+    Test suite for the arrow_db module.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp, 'db.feather')
+        self.assertTrue(Write2Db(_rows(), self.fn).run())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_zero_copy(self):
+        """
+        Test that the mapped table holds no allocated buffers.
+        """
+        before = pa.total_allocated_bytes()
+        table = arrow_db.open_table(self.fn)
+        self.assertEqual(pa.total_allocated_bytes(), before)
+        self.assertEqual(table.num_rows, 6)
+
+        # a compressed file has to be decompressed into memory
+        fn = os.path.join(self.tmp, 'lz4.feather')
+        pd.DataFrame(_rows(1000)).to_feather(fn, compression='lz4')
+        before = pa.total_allocated_bytes()
+        table = arrow_db.open_table(fn)
+        self.assertGreater(pa.total_allocated_bytes(), before)
+
+    def test_arrow_frame(self):
+        """
+        Test the lazy conversion of the columns.
+        """
+        frame = ReadDb(self.fn).read_arrow()
+        self.assertEqual(len(frame), 6)
+        self.assertEqual(frame.columns, list(_rows()[0]))
+        self.assertEqual(frame.converted(), [])
+
+        self.assertEqual(list(frame['title']), [f'T{i}' for i in range(6)])
+        self.assertEqual(frame.converted(), ['title'])
+        self.assertIs(frame['title'], frame['title'])
+        df = frame[['artist', 'plays']]
+        self.assertEqual(list(df.columns), ['artist', 'plays'])
+        self.assertEqual(frame.converted(), ['title', 'artist', 'plays'])
+        with self.assertRaises(KeyError):
+            frame['missing']
+
+        frame = ReadDb(self.fn).read_arrow(columns=['plays'])
+        self.assertEqual(frame.columns, ['plays'])
+        self.assertIsNone(ReadDb(os.path.join(self.tmp, 'none.feather')).read_arrow())
+        csv = os.path.join(self.tmp, 'db.csv')
+        Write2Db(_rows(), csv).run()
+        with self.assertRaises(ValueError):
+            ReadDb(csv).read_arrow()
+
+    def test_read_db(self):
+        """
+        Test reading a Feather db through ReadDb.
+        """
+        db = ReadDb(self.fn)
+        pd.testing.assert_frame_equal(db.read_db(), pd.DataFrame(_rows()))
+        df = db.read_db(columns=['title'], filters=[('artist', '==', 'A')])
+        self.assertEqual(list(df['title']), ['T1', 'T3', 'T5'])
+        chunks = list(db.iter_chunks(4, columns=['plays']))
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 2])
+
+        # a new save replaces the file, an open frame keeps its rows
+        frame = db.read_arrow()
+        self.assertTrue(Write2Db(_rows(8), self.fn).run())
+        self.assertEqual(len(frame), 6)
+        self.assertEqual(len(db.read_db()), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Test module for the 'db_lock' module.
+
+The 'db_lock' module provides the cross-process shared/exclusive lock
+    taken around every read and write of a database file.
+
+Test Cases:
+- test_shared: Tests that readers hold the lock at the same time.
+- test_exclusive_process: Tests that a writer in another process blocks
+    readers, and that the wait is recorded.
+- test_reentrant: Tests that a thread holding the exclusive lock can take
+    it again, and cannot upgrade a shared one.
+- test_writers_serialized: Tests that concurrent Write2Db appends from
+    several processes lose no rows.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import pandas as pd
+
+from db_lock import DbLock, lock_stats
+
+HOLD = '''
+import sys, time
+from db_lock import DbLock
+with DbLock(sys.argv[1]).exclusive():
+    print('locked', flush=True)
+    time.sleep(float(sys.argv[2]))
+'''
+
+APPEND = '''
+import sys
+from write_db_class import Write2Db
+proc = sys.argv[2]
+rows = [{'title': f'{proc}-{i}', 'artist': 'A', 'name': proc} for i in range(10)]
+for row in rows:
+    assert Write2Db([row], sys.argv[1]).run()
+'''
+
+
+class TestDbLock(unittest.TestCase):
+    """
+    Test suite for the DbLock class.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp, 'db.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _python(self, code, *args):
+        return subprocess.Popen([sys.executable, '-c', code, *args],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, text=True)
+
+    def test_shared(self):
+        """
+        Test that a second reader does not wait for the first.
+        """
+        inside = threading.Barrier(2, timeout=2)
+
+        def reader():
+            with DbLock(self.fn).shared():
+                inside.wait()
+
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(inside.broken)
+        self.assertEqual(lock_stats(self.fn)['shared']['count'], 2)
+
+    def test_exclusive_process(self):
+        """
+        Test that a reader waits for a writer in another process.
+        """
+        proc = self._python(HOLD, self.fn, '0.3')
+        self.assertEqual(proc.stdout.readline().strip(), 'locked')
+        start = time.monotonic()
+        with DbLock(self.fn).shared():
+            waited = time.monotonic() - start
+        proc.wait()
+        self.assertGreater(waited, 0.1)
+        self.assertGreater(lock_stats(self.fn)['shared']['max'], 0.1)
+        self.assertIn(os.path.abspath(self.fn) + '.lock', lock_stats())
+
+    def test_reentrant(self):
+        """
+        Test that the exclusive lock can be taken again by its holder.
+        """
+        lock = DbLock(self.fn)
+        with lock.exclusive():
+            with lock.shared(), DbLock(self.fn).exclusive():
+                pass
+        with lock.shared():
+            with self.assertRaises(RuntimeError):
+                with lock.exclusive():
+                    pass
+        # released: another process can take it
+        proc = self._python(HOLD, self.fn, '0')
+        self.assertEqual(proc.wait(timeout=5), 0)
+
+    def test_writers_serialized(self):
+        """
+        Test that three processes appending to one db lose no rows.
+        """
+        procs = [self._python(APPEND, self.fn, str(i)) for i in range(3)]
+        for proc in procs:
+            self.assertEqual(proc.wait(timeout=60), 0)
+
+        df = pd.read_csv(self.fn)
+        self.assertEqual(len(df), 30)
+        self.assertEqual(df['title'].nunique(), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
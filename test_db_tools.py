@@ -0,0 +1,186 @@
+"""
+Test module for the 'db_tools' module and the chunked reads it relies on.
+
+The 'db_tools' module rebuilds dedup indexes, deduplicates, exports and
+    summarizes a database in one streaming pass, through ReadDb.iter_chunks
+    and write_db_class.ChunkWriter.
+
+Test Cases:
+- test_iter_chunks: Tests that every format is read in chunks of bounded
+    size holding the same rows as a full read.
+- test_stream_rewrite: Tests that Write2Db rewrites a Parquet file chunk
+    by chunk, without reading it whole, and keeps an incompatible file.
+- test_export: Tests exporting between formats with columns and filters.
+- test_dedup: Tests that the first row of every key is kept.
+- test_sqlite_in_place: Tests that deduplicating and rewriting an SQLite
+    database keep a reader connection working.
+- test_stats: Tests the row, key, artist and month counts.
+- test_rebuild_index: Tests that the rebuilt index holds every key.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+import db_tools
+import parquet_dataset
+import sqlite_db
+from dedup_index import open_index
+from read_db import ReadDb
+from util import SQL_TABLE
+from write_db_class import ChunkWriter, Write2Db
+
+
+def _rows(n=10, start=0):
+    return [{'timestamp': f'{i % 28 + 1} {"March" if i % 2 else "April"} 2024 at 10:00',
+             'title': f'T{i}', 'artist': f'A{i % 3}', 'name': f'N{i}',
+             'lyricssnippet': '' if i % 4 else 'la la',
+             'shazamurl': f'https://www.shazam.com/track/{i + 1}/t'}
+            for i in range(start, start + n)]
+
+
+class TestDbTools(unittest.TestCase):
+    """
+    Test suite for the db_tools module.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _db(self, ext, rows=None):
+        fn = os.path.join(self.tmp, f'db{ext}')
+        if ext == '.dataset':
+            fn = os.path.join(self.tmp, 'dataset.parquet')
+            parquet_dataset.create(fn)
+        if ext == '.feather':
+            pd.DataFrame(rows or _rows()).to_feather(fn)
+        else:
+            self.assertTrue(Write2Db(rows or _rows(), fn).run())
+        return fn
+
+    def test_iter_chunks(self):
+        """
+        Test chunked reads of every format.
+        """
+        for ext in ('.csv', '.jsonl', '.json', '.parquet', '.dataset',
+                    '.feather', '.h5', '.sql'):
+            with self.subTest(ext=ext):
+                db = ReadDb(self._db(ext))
+                chunks = list(db.iter_chunks(3))
+                self.assertTrue(all(0 < len(chunk) <= 3 for chunk in chunks))
+                titles = [t for chunk in chunks for t in chunk['title']]
+                self.assertEqual(sorted(titles), sorted(db.read_db()['title']))
+
+                chunks = list(db.iter_chunks(3, columns=['title'],
+                                             filters=[('artist', '==', 'A1')]))
+                self.assertTrue(all(list(chunk.columns) == ['title'] for chunk in chunks))
+                self.assertEqual(sorted(t for chunk in chunks for t in chunk['title']),
+                                 ['T1', 'T4', 'T7'])
+        self.assertEqual(list(ReadDb(os.path.join(self.tmp, 'none.csv')).iter_chunks()), [])
+
+    def test_stream_rewrite(self):
+        """
+        Test that a Parquet file is rewritten without a full read.
+        """
+        fn = self._db('.parquet')
+        with patch.object(ReadDb, 'read_db') as read_db:
+            self.assertTrue(Write2Db(_rows(4, start=8), fn).run())
+            read_db.assert_not_called()
+        df = pd.read_parquet(fn)
+        self.assertEqual(list(df['title']), [f'T{i}' for i in range(12)])
+
+        self.assertFalse(Write2Db([{'title': 'T', 'x': 1}], fn).run())
+        pd.testing.assert_frame_equal(pd.read_parquet(fn), df)
+        self.assertEqual([name for name in os.listdir(self.tmp)
+                          if name.startswith('.')], [])
+
+    def test_export(self):
+        """
+        Test exporting a CSV file to other formats.
+        """
+        fn = self._db('.csv')
+        for ext in ('.parquet', '.jsonl', '.sql', '.json', '.dataset'):
+            with self.subTest(ext=ext):
+                out = os.path.join(self.tmp, f'out{ext}')
+                part = os.path.join(self.tmp, f'part{ext}')
+                if ext == '.dataset':
+                    out = os.path.join(self.tmp, 'out_dataset.parquet')
+                    part = os.path.join(self.tmp, 'part_dataset.parquet')
+                    parquet_dataset.create(out)
+                    parquet_dataset.create(part)
+                self.assertEqual(db_tools.export(fn, out, chunksize=3), 10)
+                df = ReadDb(out).read_db()
+                self.assertEqual(sorted(df['title']), sorted(f'T{i}' for i in range(10)))
+                self.assertEqual(db_tools.export(fn, part, columns=['title'],
+                                                 filters=[('title', '<', 'T2')]), 2)
+                self.assertEqual(list(ReadDb(part).read_db().columns), ['title'])
+
+    def test_dedup(self):
+        """
+        Test deduplicating a file in place and into another file.
+        """
+        fn = os.path.join(self.tmp, 'dup.csv')
+        rows = _rows(6)
+        dup = dict(rows[2], title='Renamed')
+        pd.DataFrame(rows + [dup, rows[0]]).to_csv(fn, index=False)
+
+        out = os.path.join(self.tmp, 'dedup.jsonl')
+        self.assertEqual(db_tools.dedup(fn, out, chunksize=4), {'read': 8, 'kept': 6})
+        self.assertEqual(list(ReadDb(out).read_db()['title']), [r['title'] for r in rows])
+        self.assertEqual(db_tools.dedup(fn, chunksize=4), {'read': 8, 'kept': 6})
+        self.assertEqual(len(pd.read_csv(fn)), 6)
+
+    def test_sqlite_in_place(self):
+        """
+        Test the streaming passes over an SQLite database with a reader open.
+        """
+        fn = self._db('.sql')
+        reader = sqlite_db.connect(fn)
+        try:
+            self.assertEqual(db_tools.dedup(fn, chunksize=4), {'read': 10, 'kept': 10})
+            with patch.object(ReadDb, 'read_db') as read_db:
+                self.assertTrue(Write2Db(_rows(12), fn, append=False).run())
+                read_db.assert_not_called()
+            self.assertEqual(reader.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+            titles = [row[0] for row in reader.execute(f'SELECT title FROM {SQL_TABLE}')]
+            self.assertEqual(titles, [f'T{i}' for i in range(12)])
+        finally:
+            reader.close()
+
+    def test_stats(self):
+        """
+        Test the summary of a database.
+        """
+        fn = self._db('.sql')
+        stats = db_tools.stats(fn, chunksize=4)
+        self.assertEqual(stats['rows'], 10)
+        self.assertEqual(stats['unique'], 10)
+        self.assertEqual(stats['with_trackid'], 10)
+        self.assertEqual(stats['top_artists'][0], ('A0', 4))
+        self.assertEqual(stats['months'], {'2024-03': 5, '2024-04': 5})
+
+    def test_rebuild_index(self):
+        """
+        Test rebuilding the dedup index of a database.
+        """
+        fn = self._db('.jsonl')
+        os.remove(fn + '.idx')
+        self.assertEqual(db_tools.rebuild_index(fn, chunksize=3), 10)
+        self.assertFalse(open_index(fn).stale())
+        with ChunkWriter(os.path.join(self.tmp, 'empty.csv')) as writer:
+            writer.write(pd.DataFrame(columns=['title']))
+        self.assertEqual(pd.read_csv(writer.fn).columns.tolist(), ['title'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Test module for the 'dedup_index' module.
+
+The 'dedup_index' module keeps a sidecar file of 64-bit hashes of the dedup
+    key of every row stored in a database file.
+
+Test Cases:
+- test_key_hash: Tests that keys are normalized before hashing.
+- test_add_and_load: Tests that committed keys survive a reload.
+- test_stale: Tests that a database changed behind the index is detected,
+    also when its size is unchanged.
+- test_track_id_keys: Tests that rows are keyed on their track id when
+    they have one, and on the text columns otherwise.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from dedup_index import (ID_FLAG, DedupIndex, drop_duplicate_keys, frame_hashes,
+                         key_hash)
+
+
+class TestDedupIndex(unittest.TestCase):
+    """
+    Test suite for the DedupIndex class.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, 'db.csv')
+        with open(self.db, 'w', encoding='utf-8') as f:
+            f.write('artist,title,name\nA,T,A - T\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_key_hash(self):
+        """
+        Test that case and spacing do not change the hash of a key.
+        """
+        self.assertEqual(key_hash(['Jang  Wooram', 'Work']),
+                         key_hash(['jang wooram ', 'WORK']))
+        self.assertNotEqual(key_hash(['A', 'BC']), key_hash(['AB', 'C']))
+        self.assertLess(key_hash(['A']), 2 ** 64)
+
+    def test_add_and_load(self):
+        """
+        Test that keys added to the index are found after a reload.
+        """
+        df = pd.DataFrame({'artist': ['A', 'B'], 'title': ['T', 'U']})
+        hashes = frame_hashes(df)
+        index = DedupIndex(self.db)
+        self.assertTrue(index.stale())
+        index.rebuild(hashes[:1])
+
+        with open(self.db, 'a', encoding='utf-8') as f:
+            f.write('B,U,B - U\n')
+        index.add(hashes[1:])
+
+        reloaded = DedupIndex(self.db)
+        self.assertFalse(reloaded.stale())
+        self.assertEqual(len(reloaded), 2)
+        self.assertTrue(all(h in reloaded for h in hashes))
+
+    def test_stale(self):
+        """
+        Test that the index is stale once the database changes behind it.
+        """
+        index = DedupIndex(self.db)
+        index.rebuild([key_hash(['A', 'T', 'A - T'])])
+        self.assertFalse(index.stale())
+
+        with open(self.db, 'a', encoding='utf-8') as f:
+            f.write('C,V,C - V\n')
+        self.assertTrue(index.stale())
+        os.remove(self.db)
+        self.assertTrue(index.stale())
+
+        # a change of the same size, in place or renamed into place
+        with open(self.db, 'w', encoding='utf-8') as f:
+            f.write('artist,title,name\nA,T,A - T\n')
+        index.rebuild([key_hash(['A', 'T', 'A - T'])])
+        time.sleep(0.01)
+        with open(self.db, 'r+', encoding='utf-8') as f:
+            f.write('artist,title,name\nB,U,B - U\n')
+        self.assertEqual(os.path.getsize(self.db), index.db_stamp[0])
+        self.assertTrue(index.stale())
+        index.rebuild([key_hash(['B', 'U', 'B - U'])])
+        tmp = os.path.join(self.tmp, 'tmp.csv')
+        shutil.copy2(self.db, tmp)
+        os.replace(tmp, self.db)
+        self.assertTrue(index.stale())
+        self.assertTrue(DedupIndex(self.db).stale())
+
+    def test_track_id_keys(self):
+        """
+        Test that the track id, given or taken from the URL, is the key.
+        """
+        url = 'https://www.shazam.com/track/468503633/work?co=GB'
+        df = pd.DataFrame({'artist': ['A', 'a', 'B', 'A'],
+                           'title': ['T', 'Other', 'U', 'T'],
+                           'shazamurl': [url, None, None, None],
+                           'trackid': [None, 468503633, None, None]})
+        keys = frame_hashes(df)
+
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(keys[0], 468503633 | ID_FLAG)
+        self.assertEqual(keys[3], key_hash(['A', 'T', '']))
+        self.assertFalse(keys[3] & ID_FLAG)
+        self.assertEqual(list(drop_duplicate_keys(df).index), [0, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Test module for the 'executor' module.
+
+The 'executor' module owns the process-wide I/O thread pool and CPU process
+    pool that blocking work is submitted to.
+
+Test Cases:
+- test_submit_io: Tests results, exceptions and task timing.
+- test_bounded: Tests that submitting blocks while the queue is full.
+- test_nested: Tests that a task waiting on another task of its pool
+    does not deadlock a one-thread pool.
+- test_map_cpu: Tests mapping a function in the process pool, in order,
+    with and without a limit on the tasks running at once.
+- test_signal: Tests that a signal cancels queued tasks and calls the
+    previous handler.
+- test_signal_once: Tests that the signal handlers are installed once,
+    calling the handler set last before the install.
+- test_shutdown: Tests that the pools refuse work once shut down.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import executor
+
+
+def _square(x):
+    return x * x
+
+
+class TestExecutor(unittest.TestCase):
+    """
+    Test suite for the executor module.
+    """
+
+    def setUp(self):
+        executor.configure(io_workers=1, cpu_workers=2, queue_size=1)
+
+    def tearDown(self):
+        executor.configure()
+
+    def test_submit_io(self):
+        """
+        Test that results and exceptions come back through the future.
+        """
+        self.assertEqual(executor.submit_io(_square, 3).result(), 9)
+        with self.assertRaises(ZeroDivisionError):
+            executor.submit_io(lambda: 1 / 0).result()
+
+        stats = executor.task_stats()['_square']
+        self.assertGreaterEqual(stats['count'], 1)
+        self.assertGreaterEqual(stats['mean_wait'], 0)
+
+    def test_bounded(self):
+        """
+        Test that a third task waits for a slot in a 1 + 1 pool.
+        """
+        release = threading.Event()
+        executor.submit_io(release.wait)
+        executor.submit_io(release.wait)
+        started = threading.Event()
+        submitted = threading.Event()
+
+        def producer():
+            started.set()
+            executor.submit_io(_square, 2)
+            submitted.set()
+
+        thread = threading.Thread(target=producer)
+        thread.start()
+        started.wait()
+        self.assertFalse(submitted.wait(0.2))
+        release.set()
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+
+    def test_nested(self):
+        """
+        Test that a task can wait on a task it submits.
+        """
+        def outer():
+            return executor.submit_io(_square, 4).result(timeout=5)
+
+        self.assertEqual(executor.submit_io(outer).result(timeout=5), 16)
+
+    def test_map_cpu(self):
+        """
+        Test that map_cpu returns the results in order.
+        """
+        self.assertEqual(list(executor.map_cpu(_square, range(6))),
+                         [0, 1, 4, 9, 16, 25])
+
+        # with a limit, at most `limit` tasks of the map run at once
+        submitted = []
+        submit_cpu = executor.submit_cpu
+
+        def submit(fn, *args):
+            running = sum(not future.done() for future in submitted)
+            self.assertLess(running, 2)
+            submitted.append(submit_cpu(fn, *args))
+            return submitted[-1]
+
+        with patch('executor.submit_cpu', side_effect=submit):
+            self.assertEqual(list(executor.map_cpu(_square, range(6), limit=2)),
+                             [0, 1, 4, 9, 16, 25])
+        self.assertEqual(len(submitted), 6)
+
+    def test_signal(self):
+        """
+        Test that SIGTERM cancels the queued task and reaches the previous handler.
+        """
+        received = []
+        previous = signal.signal(signal.SIGTERM, lambda sig, frame: received.append(sig))
+        try:
+            executor.install_signal_handlers([signal.SIGTERM])
+            release = threading.Event()
+            running = executor.submit_io(release.wait)
+            queued = executor.submit_io(_square, 5)
+
+            os.kill(os.getpid(), signal.SIGTERM)
+            time.sleep(0.05)
+            release.set()
+
+            self.assertTrue(running.result(timeout=5))
+            self.assertTrue(queued.cancelled())
+            self.assertEqual(received, [signal.SIGTERM])
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+    def test_signal_once(self):
+        """
+        Test that installing the handlers again does not wrap them twice.
+        """
+        received = []
+        previous = signal.signal(signal.SIGTERM, lambda sig, frame: received.append(1))
+        try:
+            executor.install_signal_handlers([signal.SIGTERM])
+            handler = signal.getsignal(signal.SIGTERM)
+            executor.install_signal_handlers([signal.SIGTERM])
+            self.assertIs(signal.getsignal(signal.SIGTERM), handler)
+
+            # as a second ShazamLogger: its own handler, then the install
+            signal.signal(signal.SIGTERM, lambda sig, frame: received.append(2))
+            executor.install_signal_handlers([signal.SIGTERM])
+            with patch('builtins.print') as printed:
+                os.kill(os.getpid(), signal.SIGTERM)
+                time.sleep(0.05)
+            self.assertEqual(received, [2])
+            self.assertEqual(printed.call_count, 1)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+    def test_shutdown(self):
+        """
+        Test that submitting after shutdown raises RuntimeError.
+        """
+        executor.submit_io(_square, 1).result()
+        executor.shutdown()
+        with self.assertRaises(RuntimeError):
+            executor.submit_io(_square, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""
+Test module for the 'file_watch' module.
+
+The 'file_watch' module waits for a file to be written using inotify, with
+    a polling fallback.
+
+Test Cases:
+- test_existing_file: Tests that an existing file is returned immediately.
+- test_timeout: Tests that a missing file times out.
+- test_wakes_on_write: Tests that the waiter wakes when the file is written,
+    well before the polling interval.
+- test_polling_fallback: Tests the same with inotify unavailable.
+- test_waits_for_close: Tests that a file still being written is not ready
+    until its writer closes it, whether it existed before the wait or not.
+- test_other_files: Tests that files of the same directory do not end the
+    wait.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from file_watch import wait_for_file
+
+
+class TestFileWatch(unittest.TestCase):
+    """
+    Test suite for the wait_for_file function.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp, 'www')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _write_later(self, delay):
+        def write():
+            time.sleep(delay)
+            with open(self.fn, 'w', encoding='utf-8') as f:
+                f.write('<root></root>')
+        thread = threading.Thread(target=write)
+        thread.start()
+        return thread
+
+    def test_existing_file(self):
+        """
+        Test that a file which already exists is ready.
+        """
+        with open(self.fn, 'w', encoding='utf-8') as f:
+            f.write('')
+        self.assertTrue(wait_for_file(self.fn, timeout=0))
+
+    def test_timeout(self):
+        """
+        Test that waiting for a file that never comes times out.
+        """
+        start = time.monotonic()
+        self.assertFalse(wait_for_file(self.fn, timeout=0.2))
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_wakes_on_write(self):
+        """
+        Test that the waiter returns as soon as the file is written.
+        """
+        thread = self._write_later(0.1)
+        start = time.monotonic()
+        self.assertTrue(wait_for_file(self.fn, timeout=10, poll=5))
+        self.assertLess(time.monotonic() - start, 4)
+        thread.join()
+
+    @patch('file_watch._libc', return_value=None)
+    def test_polling_fallback(self, _):
+        """
+        Test that polling is used when inotify is not available.
+        """
+        thread = self._write_later(0.1)
+        self.assertTrue(wait_for_file(self.fn, timeout=10, poll=0.05))
+        thread.join()
+
+    def _write_slowly(self, opened, delay):
+        """
+        Open the file, wait `delay` seconds with half of it written, writing
+        another file meanwhile, then finish and close it; return the thread
+        and the closing time.
+        """
+        closed = []
+
+        def write():
+            with open(self.fn, 'w', encoding='utf-8') as f:
+                f.write('<root>')
+                f.flush()
+                opened.set()
+                time.sleep(delay / 2)
+                # an event of another file, while the target is open
+                with open(os.path.join(self.tmp, 'other'), 'w', encoding='utf-8') as other:
+                    other.write('x')
+                time.sleep(delay / 2)
+                f.write('</root>')
+            closed.append(time.monotonic())
+        thread = threading.Thread(target=write)
+        thread.start()
+        return thread, closed
+
+    def test_waits_for_close(self):
+        """
+        Test that the waiter returns after the writer closes the file.
+        """
+        for exists in (False, True):
+            with self.subTest(exists=exists):
+                opened = threading.Event()
+                thread, closed = self._write_slowly(opened, 0.4)
+                try:
+                    if exists:
+                        # the file is created before the watch starts
+                        opened.wait()
+                    self.assertTrue(wait_for_file(self.fn, timeout=10))
+                    woke = time.monotonic()
+                    with open(self.fn, encoding='utf-8') as f:
+                        self.assertEqual(f.read(), '<root></root>')
+                finally:
+                    thread.join()
+                self.assertGreaterEqual(woke, closed[0])
+                os.remove(self.fn)
+
+    def test_other_files(self):
+        """
+        Test that another file written next to the target is ignored.
+        """
+        def write_other():
+            time.sleep(0.1)
+            with open(os.path.join(self.tmp, 'other'), 'w', encoding='utf-8') as f:
+                f.write('x')
+        thread = threading.Thread(target=write_other)
+        thread.start()
+        self.assertFalse(wait_for_file(self.fn, timeout=0.5))
+        thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Test module for the 'journal' module.
+
+The 'journal' module provides the write-ahead journal used by ShazamLogger
+    to persist recognised rows before they are folded into the database.
+
+Test Cases:
+- test_group_commit: Tests that rows are fsynced once per group.
+- test_compact: Tests that compaction hands the rows to the writer and
+    empties the journal.
+- test_failed_compact: Tests that rows are kept, and replayed, when the
+    writer fails.
+- test_torn_line: Tests that a partially written last line is skipped.
+- test_compactor: Tests that stopping the compactor folds pending rows.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from journal import Compactor, Journal
+
+ROWS = [{'artist': 'A', 'title': 'T'}, {'artist': 'B', 'title': 'U'},
+        {'artist': 'C', 'title': 'V'}]
+
+
+class TestJournal(unittest.TestCase):
+    """
+    Test suite for the Journal and Compactor classes.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp, 'db.json.journal')
+        self.folded = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def writer(self, rows):
+        self.folded.extend(rows)
+        return True
+
+    @patch('journal.os.fsync')
+    def test_group_commit(self, mock_fsync):
+        """
+        Test that one fsync is issued per group of rows.
+        """
+        journal = Journal(self.fn, group_rows=2, group_interval=3600)
+        for row in ROWS:
+            journal.append(row)
+        self.assertEqual(mock_fsync.call_count, 1)
+
+        journal.sync()
+        self.assertEqual(mock_fsync.call_count, 2)
+        self.assertEqual(journal.replay(), ROWS)
+        journal.close()
+
+    def test_compact(self):
+        """
+        Test that compaction folds the rows and leaves an empty journal.
+        """
+        journal = Journal(self.fn)
+        for row in ROWS:
+            journal.append(row)
+
+        self.assertTrue(journal.compact(self.writer))
+        self.assertEqual(self.folded, ROWS)
+        self.assertEqual(journal.replay(), [])
+
+        journal.append(ROWS[0])
+        self.assertEqual(journal.replay(), ROWS[:1])
+        journal.close()
+
+    def test_failed_compact(self):
+        """
+        Test that rows survive a failed compaction and a restart.
+        """
+        journal = Journal(self.fn)
+        journal.append(ROWS[0])
+        self.assertFalse(journal.compact(lambda rows: False))
+        journal.append(ROWS[1])
+        journal.close()
+
+        restarted = Journal(self.fn)
+        self.assertEqual(restarted.replay(), ROWS[:2])
+        self.assertTrue(restarted.compact(self.writer))
+        self.assertEqual(self.folded, ROWS[:2])
+
+    def test_torn_line(self):
+        """
+        Test that a torn last line, left by a crash, is ignored.
+        """
+        journal = Journal(self.fn)
+        journal.append(ROWS[0])
+        journal.close()
+        with open(self.fn, 'a', encoding='utf-8') as f:
+            f.write('{"artist": "B", "ti')
+
+        self.assertEqual(Journal(self.fn).replay(), ROWS[:1])
+
+    def test_compactor(self):
+        """
+        Test that stopping the compactor folds the remaining rows.
+        """
+        journal = Journal(self.fn, group_interval=0.01)
+        compactor = Compactor(journal, self.writer, interval=3600)
+        compactor.start()
+        journal.append(ROWS[0])
+
+        self.assertTrue(compactor.stop())
+        self.assertFalse(compactor.is_alive())
+        self.assertEqual(self.folded, ROWS[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+Test module for the 'parquet_dataset' module.
+
+The 'parquet_dataset' module stores the rows of a '.parquet' directory in
+    part files partitioned by the year and month of their timestamp.
+
+Test Cases:
+- test_append_partitions: Tests that each save writes a part file into the
+    directory of its month, without rewriting the stored parts, and that
+    duplicates are dropped.
+- test_read_period: Tests that reading a month only reads its directory.
+- test_compact: Tests that the parts of a month are merged into one file
+    holding the same rows.
+- test_failed_compact: Tests that a failed merge leaves the month as it
+    was, without duplicated rows.
+- test_convert: Tests turning a single Parquet file into a dataset.
+- test_resident_db: Tests that ResidentDb flushes append part files.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import parquet_dataset
+from read_db import ReadDb
+from resident_db import ResidentDb
+from write_db_class import Write2Db
+
+
+def _row(i, timestamp='10 March 2024 at 15:51'):
+    return {'timestamp': timestamp, 'title': f'T{i}', 'artist': 'A',
+            'name': f'A - T{i}',
+            'shazamurl': f'https://www.shazam.com/track/{i}/t', 'trackid': i}
+
+
+class TestParquetDataset(unittest.TestCase):
+    """
+    Test suite for the parquet_dataset module.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp, 'db.parquet')
+        parquet_dataset.create(self.fn)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _months(self):
+        return sorted(os.path.relpath(os.path.dirname(path), self.fn)
+                      for path in parquet_dataset.part_files(self.fn))
+
+    def test_append_partitions(self):
+        """
+        Test that rows are appended into their month's directory.
+        """
+        self.assertTrue(Write2Db([_row(1), _row(2, '2 April 2024 at 08:00')],
+                                 self.fn).run())
+        first = parquet_dataset.part_files(self.fn)
+        self.assertTrue(Write2Db([_row(1), _row(3), _row(4, 'unknown')],
+                                 self.fn).run())
+
+        self.assertTrue(set(first) <= set(parquet_dataset.part_files(self.fn)))
+        self.assertEqual(self._months(), [
+            'year=0/month=0', 'year=2024/month=3', 'year=2024/month=3',
+            'year=2024/month=4'])
+        df = ReadDb(self.fn).read_db()
+        self.assertEqual(sorted(df['title']), ['T1', 'T2', 'T3', 'T4'])
+        self.assertNotIn('year', df.columns)
+
+    def test_read_period(self):
+        """
+        Test that reading March only lists the March directory.
+        """
+        Write2Db([_row(1), _row(2, '2 April 2024 at 08:00'),
+                  _row(3, '1 March 2023 at 10:00')], self.fn).run()
+        with patch('parquet_dataset.os.walk', wraps=os.walk) as walk:
+            df = ReadDb(self.fn).read_period(2024, 3)
+        self.assertEqual(list(df['title']), ['T1'])
+        self.assertEqual(walk.call_args[0][0],
+                         os.path.join(self.fn, 'year=2024', 'month=3'))
+        self.assertEqual(sorted(ReadDb(self.fn).read_period(2024)['title']),
+                         ['T1', 'T2'])
+
+        # other formats are filtered on the timestamp
+        csv = os.path.join(self.tmp, 'db.csv')
+        Write2Db([_row(1), _row(2, '2 April 2024 at 08:00')], csv).run()
+        self.assertEqual(list(ReadDb(csv).read_period(2024, 4)['title']), ['T2'])
+
+    def test_compact(self):
+        """
+        Test that compaction leaves one part per month.
+        """
+        for i in range(4):
+            Write2Db([_row(i)], self.fn).run()
+        Write2Db([_row(9, '2 April 2024 at 08:00')], self.fn).run()
+        self.assertEqual(len(parquet_dataset.part_files(self.fn, 2024, 3)), 4)
+
+        self.assertEqual(parquet_dataset.compact(self.fn),
+                         {os.path.join('year=2024', 'month=3'): 4})
+        self.assertEqual(self._months(), ['year=2024/month=3', 'year=2024/month=4'])
+        self.assertEqual(sorted(ReadDb(self.fn).read_db()['title']),
+                         ['T0', 'T1', 'T2', 'T3', 'T9'])
+        # the dedup index follows the new parts
+        self.assertTrue(Write2Db([_row(0), _row(5)], self.fn).run())
+        self.assertEqual(len(ReadDb(self.fn).read_db()), 6)
+
+    def test_failed_compact(self):
+        """
+        Test that a merge failing before its month is replaced changes nothing.
+        """
+        for i in range(3):
+            Write2Db([_row(i)], self.fn).run()
+        parts = parquet_dataset.part_files(self.fn)
+        rename = os.rename
+
+        def rename_old_only(src, dst):
+            # the month is moved aside, the merged one fails to take its place
+            if src.endswith('.tmp'):
+                raise OSError('disk full')
+            rename(src, dst)
+
+        for target, fail in (('parquet_dataset._swap', OSError('disk full')),
+                             ('parquet_dataset.os.rename', rename_old_only)):
+            with self.subTest(target=target), patch(target, side_effect=fail):
+                with self.assertRaises(OSError):
+                    parquet_dataset.compact(self.fn)
+                self.assertEqual(parquet_dataset.part_files(self.fn), parts)
+                self.assertEqual(sorted(ReadDb(self.fn).read_db()['title']),
+                                 ['T0', 'T1', 'T2'])
+        # no merged copy is left behind, hidden or not
+        self.assertEqual(os.listdir(os.path.join(self.fn, 'year=2024')), ['month=3'])
+
+    def test_convert(self):
+        """
+        Test converting a single file into a dataset.
+        """
+        fn = os.path.join(self.tmp, 'single.parquet')
+        Write2Db([_row(1), _row(2, '2 April 2024 at 08:00')], fn).run()
+        self.assertFalse(parquet_dataset.is_dataset(fn))
+
+        self.assertTrue(parquet_dataset.convert(fn))
+        self.assertTrue(parquet_dataset.is_dataset(fn))
+        self.assertEqual(len(parquet_dataset.part_files(fn)), 2)
+        self.assertEqual(sorted(ReadDb(fn).read_db()['title']), ['T1', 'T2'])
+        # no temporary directory is left behind
+        self.assertEqual([name for name in os.listdir(self.tmp)
+                          if name.startswith('.')], [])
+
+    def test_resident_db(self):
+        """
+        Test that flushes append parts instead of rewriting the dataset.
+        """
+        db = ResidentDb(self.fn)
+        db.add([_row(1)])
+        self.assertTrue(db.flush())
+        with patch.object(Write2Db, 'write') as write:
+            self.assertEqual(db.add([_row(1), _row(2)]), 1)
+            self.assertTrue(db.flush())
+            write.assert_not_called()
+        self.assertEqual(len(parquet_dataset.part_files(self.fn)), 2)
+        self.assertEqual(sorted(ReadDb(self.fn).read_db()['title']), ['T1', 'T2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Test module for the 'parse_batch' module.
+
+This module contains unit tests for the functions in the 'parse_batch'
+    module. It ensures that a spool directory is parsed into a single
+    DataFrame with one row per record, inline and in a process pool.
+
+Classes:
+    - TestParseBatch: A TestCase class containing unit tests for 'parse_batch'.
+
+Test Cases:
+    - test_list_spool: Tests that directories and globs are expanded to files.
+    - test_parse_batch: Tests parsing a spool inline and with a process pool.
+    - test_processes: Tests that `processes` bounds the parallel tasks.
+
+Dependencies:
+    - unittest module for creating and running unit tests.
+    - pandas for the returned DataFrame.
+    - parse_batch module: The module being tested.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+import executor
+from parse_batch import list_spool, parse_batch
+from parse_row import compile_template, parse_row
+from util import TRACK_ID
+
+
+class TestParseBatch(unittest.TestCase):
+    """
+    A TestCase class containing unit tests for the 'parse_batch' module.
+    """
+
+    def setUp(self):
+        """
+        Create a spool directory holding three shortcut outputs, one of
+        which contains two concatenated records.
+        """
+        self.spool = tempfile.mkdtemp()
+        with open('short', encoding='utf-8') as f:
+            record = f.read()
+        for i, count in enumerate((1, 2, 1)):
+            with open(os.path.join(self.spool, f'out{i}'), 'w',
+                      encoding='utf-8') as f:
+                f.write((record + '\n') * count)
+
+    def tearDown(self):
+        """
+        Remove the spool directory.
+        """
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+    def test_list_spool(self):
+        """
+        Test that a directory and a glob list the same files.
+        """
+        files = list_spool(self.spool)
+
+        self.assertEqual(len(files), 3)
+        self.assertEqual(list_spool(os.path.join(self.spool, 'out*')), files)
+        self.assertEqual(list_spool(os.path.join(self.spool, 'missing')), [])
+
+    def test_parse_batch(self):
+        """
+        Test that every record becomes a row, in the template column order
+        followed by the track id,
+        whether the files are parsed inline or in a process pool.
+        """
+        expected = parse_row('short')
+
+        for processes in (1, 2):
+            with self.subTest(processes=processes):
+                df = parse_batch(self.spool, processes=processes)
+
+                self.assertIsInstance(df, pd.DataFrame)
+                self.assertEqual(list(df.columns), [*compile_template(), TRACK_ID])
+                self.assertEqual(df[TRACK_ID].dtype, 'Int64')
+                self.assertEqual(len(df), 4)
+                self.assertEqual(df.iloc[3].to_dict(), expected)
+
+    def test_processes(self):
+        """
+        Test that `processes` bounds the tasks parsed at once in the pool.
+        """
+        with patch('parse_batch.executor.map_cpu', wraps=executor.map_cpu) as map_cpu:
+            self.assertEqual(len(parse_batch(self.spool, processes=2)), 4)
+            self.assertEqual(map_cpu.call_args.kwargs['limit'], 2)
+            # by default, as many as the pool has processes
+            map_cpu.reset_mock()
+            parse_batch(self.spool)
+            if executor.cpu_workers() > 1:
+                self.assertEqual(map_cpu.call_args.kwargs['limit'],
+                                 min(executor.cpu_workers(), 3))
+            else:
+                map_cpu.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
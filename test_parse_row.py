@@ -13,6 +13,11 @@ Functions:
 
 Test Cases:
     - test_parse_row: Tests the 'parse_row' function with a sample XML file.
+    - test_compile_template: Tests that the template schema is compiled once and reused.
+    - test_backend_parity: Tests that every parser backend returns the same dictionary.
+    - test_parse_rows: Tests the 'parse_rows' generator with concatenated records.
+    - test_malformed_record: Tests that a malformed or truncated record is
+        skipped and the records after it are still parsed.
 
 Dependencies:
     - unittest module for creating and running unit tests.
@@ -23,7 +28,7 @@ Dependencies:
 
 import unittest
 import os
-from parse_row import parse_row, SHAZAM_TEMPLATE
+from parse_row import parse_row, parse_rows, compile_template, PARSERS, SHAZAM_TEMPLATE
 
 
 class TestParseRow(unittest.TestCase):
@@ -105,6 +110,90 @@ class TestParseRow(unittest.TestCase):
         # Assert that the result is None
         self.assertIsNone(result)
 
+    def test_compile_template(self):
+        """
+        Test the compile_template function with the default template.
+
+        This method checks that the schema lists the template fields in
+        document order, excludes the root tag, and that repeated calls
+        return the cached schema rather than re-parsing the template.
+        """
+        fields = compile_template()
+
+        self.assertEqual(fields[0], 'timestamp')
+        self.assertEqual(fields[-1], 'name')
+        self.assertEqual(len(fields), 11)
+        self.assertNotIn('root', fields)
+        self.assertIs(compile_template(), fields)
+
+    def test_backend_parity(self):
+        """
+        Test that all parser backends agree on the sample files.
+
+        This method runs every backend in PARSERS against the template
+        fixture and the `short` sample shortcut output, which contains
+        multi-line lyrics, an empty tag and a URL with bare ampersands,
+        and that the numeric track id is taken from the URL.
+        """
+        for fn in ('test.xml', 'short'):
+            expected = parse_row(fn, backend='bs4')
+            self.assertIsNotNone(expected)
+            for backend in PARSERS:
+                with self.subTest(fn=fn, backend=backend):
+                    self.assertEqual(parse_row(fn, backend=backend), expected)
+
+        self.assertIn('&trackLength=202865&',
+                      parse_row('short', backend='expat')['shazamurl'])
+        self.assertEqual(parse_row('short', backend='expat')['trackid'], 468503633)
+        self.assertNotIn('trackid', parse_row('test.xml', backend='expat'))
+        self.assertIsNone(parse_row('non_existent.xml', backend='expat'))
+
+    def test_parse_rows(self):
+        """
+        Test the parse_rows generator with a spool of concatenated records.
+
+        This method writes the `short` sample three times into one file,
+        each copy with its own XML declaration, and checks that one
+        dictionary is yielded per record and that a missing file yields
+        nothing.
+        """
+        with open('short', encoding='utf-8') as f:
+            record = f.read()
+        with open('test.xml', 'w', encoding='utf-8') as f:
+            f.write((record + '\n') * 3)
+
+        rows = list(parse_rows('test.xml'))
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows, [parse_row('short')] * 3)
+        self.assertEqual(list(parse_rows('non_existent.xml')), [])
+
+    def test_malformed_record(self):
+        """
+        Test the parse_rows generator with a bad record in the spool.
+
+        This method writes four records, the second with a bare `<` in its
+        title, and checks that only that one is lost; then cuts a record
+        short before the next one starts, and at the end of the file.
+        """
+        with open('short', encoding='utf-8') as f:
+            record = f.read()
+        title = 'I Don’t Really Wanna Go to Work'
+        records = [record.replace(title, name)
+                   for name in ('One', 'Love <3 You', 'Three', 'Four')]
+        with open('test.xml', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(records))
+
+        rows = list(parse_rows('test.xml'))
+
+        self.assertEqual([row['title'] for row in rows], ['One', 'Three', 'Four'])
+        self.assertEqual(parse_row('test.xml', backend='expat')['title'], 'One')
+
+        truncated = records[0][:records[0].index('<shazamurl>')]
+        with open('test.xml', 'w', encoding='utf-8') as f:
+            f.write('\n'.join([truncated, records[2], truncated]))
+        self.assertEqual([row['title'] for row in parse_rows('test.xml')], ['Three'])
+
 if __name__ == '__main__':
     unittest.main()
    
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+Test module for the column projection and filters of 'read_db.ReadDb'.
+
+ReadDb.read_db(columns=[...], filters=[(column, op, value), ...]) passes the
+    projection and the filters down to the backend of each format, and
+    applies what the backend cannot do in memory.
+
+Test Cases:
+- test_formats: Tests that every format returns the same columns and rows.
+- test_pushdown: Tests that the bulky columns are not read from CSV,
+    Parquet and Feather files, and that HDF tables select the rows.
+- test_sqlite: Tests that SQLite reads only the selected columns and rows.
+- test_invalid_filters: Tests that malformed filters and unknown columns
+    are reported.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+import arrow_db
+import parquet_dataset
+import sqlite_db
+from read_db import ReadDb
+from write_db_class import Write2Db
+
+
+def _rows(n=6):
+    return [{'timestamp': f'{i + 1} March 2024 at 10:00', 'title': f'T{i}',
+             'artist': 'A' if i % 2 else 'B', 'name': f'N{i}',
+             'lyricssnippet': 'la ' * 100,
+             'shazamurl': f'https://www.shazam.com/track/{i + 1}/t'}
+            for i in range(n)]
+
+
+COLUMNS = ['title', 'artist']
+FILTERS = [('artist', '==', 'A'), ('title', 'in', ['T1', 'T3', 'T4'])]
+
+
+class TestReadDbPushdown(unittest.TestCase):
+    """
+    Test suite for ReadDb.read_db(columns=..., filters=...).
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _db(self, ext):
+        fn = os.path.join(self.tmp, f'db{ext}')
+        if ext == '.dataset':
+            fn = os.path.join(self.tmp, 'dataset.parquet')
+            parquet_dataset.create(fn)
+        if ext == '.feather':
+            pd.DataFrame(_rows()).to_feather(fn)
+        else:
+            self.assertTrue(Write2Db(_rows(), fn).run())
+        return fn
+
+    def test_formats(self):
+        """
+        Test the same projection and filters on every format.
+        """
+        for ext in ('.csv', '.jsonl', '.json', '.parquet', '.dataset',
+                    '.feather', '.h5', '.sql'):
+            with self.subTest(ext=ext):
+                db = ReadDb(self._db(ext))
+                df = db.read_db(columns=COLUMNS, filters=FILTERS)
+                self.assertEqual(list(df.columns), COLUMNS)
+                self.assertEqual(list(df['title']), ['T1', 'T3'])
+                self.assertEqual(list(df.index), [0, 1])
+
+                df = db.read_db(columns=['title'])
+                self.assertEqual(list(df.columns), ['title'])
+                self.assertEqual(len(df), 6)
+                df = db.read_db(filters=[('title', '>=', 'T4')])
+                self.assertIn('lyricssnippet', df.columns)
+                self.assertEqual(list(df['title']), ['T4', 'T5'])
+
+    def test_pushdown(self):
+        """
+        Test that the backends are asked for the needed columns only.
+        """
+        needed = ['artist', 'title']
+        fn = self._db('.csv')
+        with patch('read_db.pd.read_csv', wraps=pd.read_csv) as read_csv:
+            ReadDb(fn).read_db(columns=['title'], filters=[('artist', '=', 'A')])
+        usecols = read_csv.call_args.kwargs['usecols']
+        self.assertEqual([c for c in _rows()[0] if usecols(c)], ['title', 'artist'])
+
+        fn = self._db('.parquet')
+        with patch('read_db.pd.read_parquet', wraps=pd.read_parquet) as read_parquet:
+            ReadDb(fn).read_db(columns=['title'], filters=[('artist', '=', 'A')])
+        self.assertEqual(sorted(read_parquet.call_args.kwargs['columns']), needed)
+
+        fn = self._db('.feather')
+        with patch('arrow_db.open_table', wraps=arrow_db.open_table) as open_table:
+            ReadDb(fn).read_db(columns=['title'], filters=[('artist', '=', 'A')])
+        self.assertEqual(sorted(open_table.call_args.args[1]), needed)
+
+        fn = self._db('.h5')
+        with patch.object(pd.HDFStore, 'select', autospec=True,
+                          side_effect=pd.HDFStore.select) as select:
+            df = ReadDb(fn).read_db(columns=['title'], filters=[('artist', '=', 'A')])
+        self.assertEqual(select.call_args.kwargs['where'], ["artist == 'A'"])
+        self.assertEqual(list(df['title']), ['T1', 'T3', 'T5'])
+
+    def test_sqlite(self):
+        """
+        Test that SQLite filters in its WHERE clause.
+        """
+        fn = self._db('.sql')
+        df = sqlite_db.read(fn, ['title'], [('artist', 'not in', ['B']),
+                                            ('title', '<', 'T5')])
+        self.assertEqual(list(df.columns), ['title'])
+        self.assertEqual(list(df['title']), ['T1', 'T3'])
+        self.assertEqual(len(sqlite_db.read(fn, filters=[('title', 'in', [])])), 0)
+
+    def test_invalid_filters(self):
+        """
+        Test that bad filters raise ValueError.
+        """
+        for ext in ('.csv', '.sql'):
+            with self.subTest(ext=ext):
+                db = ReadDb(self._db(ext))
+                with self.assertRaises(ValueError):
+                    db.read_db(filters=[('title', 'like', 'T%')])
+                with self.assertRaises(ValueError):
+                    db.read_db(filters=[('title', '==')])
+                with self.assertRaises(ValueError):
+                    db.read_db(filters=[('missing', '==', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
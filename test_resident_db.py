@@ -0,0 +1,119 @@
+"""
+Test module for the 'resident_db' module.
+
+The 'resident_db' module keeps a database file in memory across saves and
+    writes only the rows added since the last flush.
+
+Test Cases:
+- test_load_once: Tests that the file is read once over many flushes and
+    that duplicates are dropped in memory.
+- test_delta_append: Tests that append-capable formats only get the dirty
+    rows appended.
+- test_rewrite: Tests that other formats are rewritten from memory.
+- test_reload_on_change: Tests that a file changed by another writer is
+    reloaded, and that dirty rows it already holds are dropped.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+import resident_db
+from resident_db import ResidentDb, open_db
+
+
+def _row(i):
+    return {'title': f'T{i}', 'artist': 'A', 'name': f'A - T{i}',
+            'shazamurl': f'https://www.shazam.com/track/{i}/t', 'trackid': i}
+
+
+class TestResidentDb(unittest.TestCase):
+    """
+    Test suite for the ResidentDb class.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_load_once(self):
+        """
+        Test that many saves read the database file once.
+        """
+        fn = os.path.join(self.tmp, 'db.json')
+        pd.DataFrame([_row(0)]).to_json(fn)
+        db = ResidentDb(fn)
+        with patch.object(resident_db, 'ReadDb', wraps=resident_db.ReadDb) as read:
+            for i in range(1, 4):
+                self.assertEqual(db.add([_row(i), _row(i - 1)]), 1)
+                self.assertTrue(db.flush())
+            self.assertEqual(read.call_count, 1)
+        self.assertEqual(db.add([_row(2)]), 0)
+        self.assertTrue(db.flush())
+        self.assertEqual(len(pd.read_json(fn)), 4)
+        self.assertIs(open_db(fn), open_db(os.path.join(self.tmp, '.', 'db.json')))
+
+    def test_delta_append(self):
+        """
+        Test that a flush appends the dirty rows instead of rewriting.
+        """
+        fn = os.path.join(self.tmp, 'db.csv')
+        db = ResidentDb(fn)
+        db.add([_row(0), _row(1)])
+        self.assertTrue(db.flush())
+        with patch('write_db_class.Write2Db.write') as write:
+            db.add([_row(2)])
+            self.assertTrue(db.flush())
+            write.assert_not_called()
+        self.assertEqual(list(pd.read_csv(fn)['trackid']), [0, 1, 2])
+        self.assertEqual(db.dirty, [])
+
+    def test_rewrite(self):
+        """
+        Test that formats without append support are rewritten from memory.
+        """
+        fn = os.path.join(self.tmp, 'db.json')
+        db = ResidentDb(fn)
+        db.add([_row(0)])
+        self.assertTrue(db.flush())
+        db.add([_row(1)])
+        self.assertTrue(db.flush())
+        self.assertEqual(list(pd.read_json(fn)['title']), ['T0', 'T1'])
+        self.assertEqual(len(db.frame()), 2)
+
+        db.add([{'title': 'x'}])
+        self.assertFalse(db.flush())
+        self.assertEqual(len(db.dirty), 1)
+
+    def test_reload_on_change(self):
+        """
+        Test that a change by another writer is picked up before flushing.
+        """
+        fn = os.path.join(self.tmp, 'db.json')
+        db = ResidentDb(fn)
+        db.add([_row(0)])
+        self.assertTrue(db.flush())
+        self.assertFalse(db.changed())
+
+        db.add([_row(1), _row(2)])
+        time.sleep(0.01)
+        pd.DataFrame([_row(0), _row(1), _row(5)]).to_json(fn)
+        self.assertTrue(db.changed())
+        self.assertTrue(db.flush())
+
+        self.assertEqual(db.loads, 2)
+        self.assertEqual(sorted(pd.read_json(fn)['trackid']), [0, 1, 2, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
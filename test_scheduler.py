@@ -0,0 +1,101 @@
+"""
+Test module for the 'scheduler' module.
+
+The 'scheduler' module decides how long to wait before the next recognition
+    from the track length and offset carried by the Shazam URL.
+
+Test Cases:
+- test_track_params: Tests parsing a URL with named query parameters.
+- test_track_params_positional: Tests parsing a URL whose parameter names
+    were lost to unescaped `&`.
+- test_track_params_missing: Tests URLs without a track length.
+- test_next_delay: Tests sleeping until shortly before the track ends.
+- test_clamp: Tests that delays stay within min_delay and max_delay.
+- test_default: Tests the delay after a row without track parameters.
+- test_backoff: Tests the exponential backoff after empty results.
+- test_duplicate: Tests that a duplicate result widens the interval and a
+    new track snaps it back.
+- test_saved_calls: Tests counting the recognition calls saved by backoff.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from scheduler import AdaptiveBackoff, TrackScheduler, track_params
+
+START = datetime(2024, 5, 13, 16, 35, 20, 925000, tzinfo=timezone.utc)
+URL = ('https://www.shazam.com/track/468503633/dance-the-night?co=GB'
+       '&referrer=shortcuts&offsetInMilliseconds=36123&timeSkew=-3.695488E-6'
+       '&trackLength=202865&startDate=2024-05-13T16:35:20.925Z')
+MANGLED = ('https://www.shazam.com/track/468503633/dance-the-night'
+           '?co=GB=shortcuts=36123=-3.695488E-6=202865=2024-05-13T16:35:20.925Z')
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    Test suite for track_params and TrackScheduler.
+    """
+
+    def test_track_params(self):
+        self.assertEqual(track_params(URL), {'offset_ms': 36123,
+                                             'track_length_ms': 202865,
+                                             'start_date': START})
+
+    def test_track_params_positional(self):
+        self.assertEqual(track_params(MANGLED), track_params(URL))
+
+    def test_track_params_missing(self):
+        self.assertIsNone(track_params(None))
+        self.assertIsNone(track_params('https://www.shazam.com/track/1/x?co=GB'))
+
+    def test_next_delay(self):
+        scheduler = TrackScheduler(lead=5)
+        now = START + timedelta(seconds=10)
+        left = (202865 - 36123) / 1000 - 10
+        self.assertAlmostEqual(scheduler.remaining({'shazamurl': URL}, now), left)
+        self.assertAlmostEqual(scheduler.next_delay({'shazamurl': URL}, now),
+                               left - 5)
+
+    def test_clamp(self):
+        scheduler = TrackScheduler(min_delay=3, max_delay=60)
+        self.assertEqual(scheduler.next_delay({'shazamurl': URL}, START), 60)
+        late = START + timedelta(hours=1)
+        self.assertEqual(scheduler.next_delay({'shazamurl': URL}, late), 3)
+
+    def test_default(self):
+        scheduler = TrackScheduler(default=20)
+        self.assertEqual(scheduler.next_delay({'title': 'T'}), 20)
+
+    def test_backoff(self):
+        scheduler = TrackScheduler(backoff=AdaptiveBackoff(5, 30, 2))
+        delays = [scheduler.next_delay(None) for _ in range(5)]
+        self.assertEqual(delays, [5, 10, 20, 30, 30])
+        scheduler.next_delay({'title': 'T'})
+        self.assertEqual(scheduler.next_delay({}), 5)
+        with self.assertRaises(ValueError):
+            AdaptiveBackoff(0, 30)
+
+    def test_duplicate(self):
+        scheduler = TrackScheduler(default=20, backoff=AdaptiveBackoff(5, 30, 2))
+        row = {'title': 'T'}
+        self.assertEqual(scheduler.next_delay(row), 20)
+        self.assertEqual(scheduler.next_delay(row, changed=False), 5)
+        self.assertEqual(scheduler.next_delay(row, changed=False), 10)
+        self.assertEqual(scheduler.next_delay(row), 20)
+        self.assertEqual(scheduler.next_delay(None), 5)
+
+    def test_saved_calls(self):
+        backoff = AdaptiveBackoff(5, 40, 2)
+        for _ in range(4):
+            backoff.widen()
+        # waited 5 + 10 + 20 + 40 seconds, 15 polls at 5 s against 4 calls
+        self.assertEqual(backoff.saved_calls, 11)
+        self.assertEqual(backoff.stats(), {'misses': 4, 'interval': 40,
+                                           'saved_calls': 11})
+
+
+if __name__ == '__main__':
+    unittest.main()
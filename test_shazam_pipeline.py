@@ -0,0 +1,234 @@
+"""
+Test module for the 'shazam_pipeline' module.
+
+The 'shazam_pipeline' module runs the Shazam logger as asyncio recognize,
+    parse and persist stages connected by bounded queues.
+
+Test Cases:
+- test_pipeline: Tests that recognised songs are journaled once per change
+    and that stage stats are collected.
+- test_slow_persist: Tests that a slow persistence stage does not hold back
+    recognitions beyond the queue capacity.
+- test_delay: Tests that the delay of the scheduler, decided on the parsed
+    row, is slept between recognitions.
+- test_flow_timeout: Tests that the serial ShazamLogger.flow gives up on a
+    shortcut without output and backs off.
+- test_migrate_db: Tests that the JSON db of earlier versions and its
+    journal are carried over to the JSON Lines default db.
+- test_interrupt: Tests that SIGINT does not deadlock on the journal lock
+    and that run() folds the journal after its loop.
+- test_interrupt_flow: Tests that a SIGINT sent during a real flow() reaches
+    the logger, which folds the journal without changing the handler.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from read_db import ReadDb
+from shazam_logger import ShazamLogger, migrate_db
+from write_db_class import Write2Db
+from shazam_pipeline import ShazamPipeline
+from scheduler import TrackScheduler
+
+
+class TestShazamPipeline(unittest.TestCase):
+    """
+    Test suite for the ShazamPipeline class.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # ShazamLogger installs its handler, restored in tearDown
+        self.sigint = signal.getsignal(signal.SIGINT)
+        self.logger = ShazamLogger(os.path.join(self.tmp, 'db.json'))
+        self.logger.outfile = os.path.join(self.tmp, 'www')
+        with open('short', encoding='utf-8') as f:
+            self.record = f.read()
+        self.titles = []
+
+    def tearDown(self):
+        signal.signal(signal.SIGINT, self.sigint)
+        self.logger.journal.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def recognize(self, outfile):
+        title = self.titles.pop(0)
+        with open(outfile, 'w', encoding='utf-8') as f:
+            # every title is a different track, with its own track id
+            f.write(self.record.replace('I Don’t Really Wanna Go to Work', title)
+                    .replace('/track/468503633/', f'/track/{sum(map(ord, title))}/'))
+        return True
+
+    def test_pipeline(self):
+        """
+        Test that a song is journaled once, however often it is recognised.
+        """
+        self.titles = ['A', 'A', 'B']
+        pipeline = ShazamPipeline(self.logger, recognize=self.recognize,
+                                  scheduler=TrackScheduler(max_delay=0))
+
+        stats = asyncio.run(pipeline.run(limit=3))
+
+        rows = self.logger.journal.replay()
+        self.assertEqual([row['title'] for row in rows], ['A', 'B'])
+        self.assertEqual(stats['stages']['recognize']['count'], 3)
+        self.assertEqual(stats['stages']['parse']['count'], 3)
+        self.assertEqual(stats['stages']['persist']['count'], 2)
+        self.assertEqual(stats['queues'], {'parse': 0, 'persist': 0})
+        # the duplicate 'A' widened the interval, 'B' snapped it back
+        self.assertEqual(stats['backoff']['misses'], 0)
+        self.assertFalse([fn for fn in os.listdir(self.tmp) if fn.startswith('www')])
+
+    def test_slow_persist(self):
+        """
+        Test that recognitions continue while the journal write is slow.
+        """
+        self.titles = [str(i) for i in range(4)]
+        append = self.logger.journal.append
+
+        def slow_append(row):
+            time.sleep(0.2)
+            append(row)
+
+        self.logger.journal.append = slow_append
+        pipeline = ShazamPipeline(self.logger, recognize=self.recognize,
+                                  queue_size=4,
+                                  scheduler=TrackScheduler(max_delay=0))
+
+        stats = asyncio.run(pipeline.run(limit=4))
+
+        self.assertLess(stats['stages']['recognize']['max'], 0.2)
+        self.assertEqual(len(self.logger.journal.replay()), 4)
+
+    def test_delay(self):
+        """
+        Test the spacing of the recognitions with a nonzero delay.
+        """
+        self.titles = ['A', 'B', 'B', 'C']
+        calls = []
+
+        def recognize(outfile):
+            calls.append(time.monotonic())
+            return self.recognize(outfile)
+
+        pipeline = ShazamPipeline(self.logger, recognize=recognize,
+                                  scheduler=TrackScheduler(min_delay=0.3, max_delay=0.3))
+
+        asyncio.run(pipeline.run(limit=4))
+
+        gaps = [b - a for a, b in zip(calls, calls[1:])]
+        self.assertEqual(len(gaps), 3)
+        self.assertTrue(all(gap >= 0.3 for gap in gaps), gaps)
+        # the repeated 'B' was a miss of the backoff
+        self.assertEqual(pipeline.scheduler.backoff.calls, 1)
+
+    @patch('shazam_logger.time.sleep')
+    @patch('shazam_logger.ShazamStep')
+    def test_flow_timeout(self, step, sleep):
+        """
+        Test that a missing output file ends the flow instead of hanging it.
+        """
+        step.return_value.run.return_value = False
+        self.logger.step_timeout = 0.1
+        start = time.monotonic()
+        self.logger.flow()
+
+        self.assertLess(time.monotonic() - start, 2)
+        step.return_value.run.assert_called_once_with(timeout=0.1)
+        sleep.assert_called_once_with(self.logger.scheduler.backoff.min_interval)
+        self.assertIsNone(self.logger.data)
+        self.assertEqual(self.logger.journal.replay(), [])
+
+    def test_migrate_db(self):
+        """
+        Test the conversion of the old default db on the first run.
+        """
+        old = os.path.join(self.tmp, 'wshazam.json')
+        new = os.path.join(self.tmp, 'wshazam.jsonl')
+        rows = [{'title': 'A', 'artist': 'X'}, {'title': 'B', 'artist': 'Y'}]
+        self.assertTrue(Write2Db(rows, old).run())
+        with open(old + '.journal', 'w', encoding='utf-8') as f:
+            f.write('{"title": "C", "artist": "Z"}\n')
+
+        self.assertEqual(migrate_db(new, old), new)
+        self.assertEqual(list(ReadDb(new).read_db()['title']), ['A', 'B'])
+        self.assertTrue(os.path.exists(old))
+        self.assertTrue(os.path.exists(new + '.journal'))
+        self.assertFalse(os.path.exists(old + '.journal'))
+
+        # later runs keep the converted db
+        self.assertTrue(Write2Db([{'title': 'D', 'artist': 'W'}], new).run())
+        self.assertEqual(migrate_db(new, old), new)
+        self.assertEqual(len(ReadDb(new).read_db()), 3)
+
+    def test_interrupt(self):
+        """
+        Test an interrupt arriving while the journal lock is held.
+        """
+        self.logger.journal.append({'title': 'A', 'artist': 'X'})
+        raised = []
+
+        def interrupt():
+            try:
+                self.logger.signal_handler(signal.SIGINT, None)
+            except KeyboardInterrupt:
+                raised.append(True)
+
+        # as in Journal.append, interrupted on the main thread
+        with self.logger.journal.lock:
+            thread = threading.Thread(target=interrupt, daemon=True)
+            thread.start()
+            thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(raised, [True])
+        self.assertTrue(self.logger.stopping)
+        # a second interrupt does not break the folding
+        self.logger.signal_handler(signal.SIGINT, None)
+
+        with patch.object(self.logger, 'flow', side_effect=KeyboardInterrupt), \
+                patch('shazam_logger.time.sleep'):
+            self.logger.run()
+        self.assertEqual(list(ReadDb(self.logger.db_file).read_db()['title']), ['A'])
+        self.assertEqual(self.logger.journal.replay(), [])
+
+    @patch('shazam_logger.time.sleep')
+    def test_interrupt_flow(self, _):
+        """
+        Test Ctrl-C while the shortcut of the second flow() runs.
+        """
+        self.titles = ['A']
+        handler = signal.getsignal(signal.SIGINT)
+        # the step writes a file name without a directory, see clean_filename
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp)
+        self.logger.outfile = 'www'
+
+        def fetch_row(step):
+            if self.titles:
+                self.recognize(step.filename)
+            else:
+                os.kill(os.getpid(), signal.SIGINT)
+            return None
+
+        with patch('shazam_step.ShazamStep.fetch_row', fetch_row):
+            self.logger.run()
+
+        self.assertTrue(self.logger.stopping)
+        self.assertEqual(list(ReadDb(self.logger.db_file).read_db()['title']), ['A'])
+        self.assertEqual(self.logger.journal.replay(), [])
+        # neither the step nor the writers of the last folding replaced it
+        self.assertIs(signal.getsignal(signal.SIGINT), handler)
+
+
+if __name__ == '__main__':
+    unittest.main()
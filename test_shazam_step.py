@@ -7,6 +7,10 @@ It tests the functionality of the 'fetch_row' and 'run_fetch_row' functions.
 Tested Functions:
 - test_fetch_row: Tests the fetch_row function.
 - test_run_fetch_row: Tests the run_fetch_row function.
+- test_run_timeout: Tests that ShazamStep.run kills a shortcut past its
+    timeout and removes its partial output.
+- TestAsyncShazamStep: Tests the AsyncShazamStep class with a stand-in
+    shortcut command, including the cleanup of a cancelled run.
 
 Usage:
 1. Run this module to execute all the unit tests.
@@ -16,9 +20,15 @@ Example:
 python test_shazam_step.py
 """
 
+import asyncio
+import os
+import subprocess
+import sys
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 import shazam_step
+from parse_row import parse_row
 
 class TestShazamStep(unittest.TestCase):
     """
@@ -96,5 +106,116 @@ class TestShazamStep(unittest.TestCase):
         # Assert that the function returns True when the output file exists
         self.assertTrue(result)
 
+    def test_run_timeout(self):
+        """
+        Test that a shortcut still writing at the timeout is killed.
+        """
+        fake = _fake_shortcut('import sys, time\n'
+                              'with open(sys.argv[2], "w") as f:\n'
+                              '    f.write("<root>"); f.flush(); time.sleep(10)')
+        procs = []
+        real_popen = subprocess.Popen
+
+        def popen(*args, **kwargs):
+            procs.append(real_popen(*args, **kwargs))
+            return procs[-1]
+
+        with patch('shazam_step.SHORTCUT', fake), \
+                patch('shazam_step.subprocess.Popen', side_effect=popen):
+            step = shazam_step.ShazamStep('teststepsync')
+            start = time.monotonic()
+            self.assertFalse(step.run(timeout=0.5))
+        self.assertLess(time.monotonic() - start, 5)
+        # killed and reaped, not left writing the output of the next run
+        self.assertIsNotNone(procs[0].returncode)
+        self.assertFalse(os.path.exists('teststepsync'))
+
+def _fake_shortcut(code):
+    """
+    A command standing in for the shortcut, the output file is sys.argv[2].
+    """
+    return [sys.executable, '-c', code]
+
+
+class TestAsyncShazamStep(unittest.TestCase):
+    """
+    Unit tests for the AsyncShazamStep class.
+    """
+
+    def test_run(self):
+        """
+        Test that a successful run returns the parsed output file.
+        """
+        fake = _fake_shortcut('import shutil, sys; shutil.copy("short", sys.argv[2])')
+        with patch('shazam_step.SHORTCUT', fake):
+            step = shazam_step.AsyncShazamStep('teststep')
+            row = asyncio.run(step.run())
+
+        self.assertEqual(row, parse_row('short'))
+        self.assertFalse(os.path.exists('teststep0'))
+
+    def test_failures(self):
+        """
+        Test the typed failures: exit code, missing output and timeout.
+        """
+        cases = [
+            ('import sys; sys.exit(3)', shazam_step.StepFailure.EXIT),
+            ('pass', shazam_step.StepFailure.NO_OUTPUT),
+            ('import time; time.sleep(10)', shazam_step.StepFailure.TIMEOUT),
+        ]
+        for code, reason in cases:
+            with self.subTest(reason=reason), \
+                    patch('shazam_step.SHORTCUT', _fake_shortcut(code)):
+                step = shazam_step.AsyncShazamStep('teststep', timeout=0.5)
+                start = time.monotonic()
+                result = asyncio.run(step.run())
+
+                self.assertFalse(result)
+                self.assertEqual(result.reason, reason)
+                self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(result, shazam_step.StepFailure('timeout'))
+
+    def test_max_in_flight(self):
+        """
+        Test that concurrent runs are capped by max_in_flight.
+        """
+        fake = _fake_shortcut('import time; time.sleep(0.3)')
+
+        async def main():
+            step = shazam_step.AsyncShazamStep('teststep', max_in_flight=1)
+            return await asyncio.gather(step.fetch(), step.fetch())
+
+        with patch('shazam_step.SHORTCUT', fake):
+            start = time.monotonic()
+            asyncio.run(main())
+        self.assertGreaterEqual(time.monotonic() - start, 0.6)
+
+    def test_cancel(self):
+        """
+        Test that a cancelled run kills the shortcut and removes its file.
+        """
+        fake = _fake_shortcut('import os, sys, time\n'
+                              'open(sys.argv[2], "w").write(str(os.getpid()))\n'
+                              'time.sleep(10)')
+
+        async def main():
+            step = shazam_step.AsyncShazamStep('teststep')
+            task = asyncio.create_task(step.fetch())
+            while not os.path.exists('teststep0') or not os.path.getsize('teststep0'):
+                await asyncio.sleep(0.05)
+            with open('teststep0', encoding='utf-8') as f:
+                pid = int(f.read())
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return pid
+
+        with patch('shazam_step.SHORTCUT', fake):
+            pid = asyncio.run(asyncio.wait_for(main(), 5))
+        self.assertFalse(os.path.exists('teststep0'))
+        # the child was reaped, its pid is gone
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
 if __name__ == '__main__':
     unittest.main()
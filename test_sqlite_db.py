@@ -0,0 +1,175 @@
+"""
+Test module for the 'sqlite_db' module.
+
+The 'sqlite_db' module stores '.sql' databases in SQLite, with a UNIQUE
+    index on the dedup key of every row.
+
+Test Cases:
+- test_upsert: Tests that only rows with new dedup keys are inserted.
+- test_wal_reader: Tests that an open read transaction does not block
+    the writer.
+- test_migrate: Tests that a table written by to_sql gets its keys, loses
+    its duplicates and takes new columns.
+- test_read_write_db: Tests '.sql' files through Write2Db and ReadDb.
+- test_rewrite_open_reader: Tests that a full rewrite keeps the database
+    readable by a connection left open across it, and leaves no file.
+- test_rewrite_rollback: Tests that an aborted rewrite keeps the old rows.
+- test_append_lock: Tests that appends wait for the exclusive db lock.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+import pandas as pd
+
+import sqlite_db
+from db_lock import DbLock
+from read_db import ReadDb
+from util import SQL_TABLE
+from write_db_class import ChunkWriter, Write2Db
+
+
+def _rows(ids, title='T'):
+    return pd.DataFrame({'title': [f'{title}{i}' for i in ids], 'artist': 'A',
+                         'shazamurl': [f'https://www.shazam.com/track/{i}/t'
+                                       for i in ids]})
+
+
+class TestSqliteDb(unittest.TestCase):
+    """
+    Test suite for the sqlite_db module.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp, 'db.sql')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_upsert(self):
+        """
+        Test that rows whose track id is stored are skipped.
+        """
+        self.assertEqual(sqlite_db.upsert(self.fn, _rows(range(5))), 5)
+        self.assertEqual(sqlite_db.upsert(self.fn, _rows(range(3, 8), 'X')), 3)
+
+        df = sqlite_db.read(self.fn)
+        self.assertEqual(list(df['title']), [f'T{i}' for i in range(5)] +
+                         ['X5', 'X6', 'X7'])
+        self.assertNotIn(sqlite_db.KEY_COLUMN, df.columns)
+        with sqlite3.connect(self.fn) as con:
+            self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_wal_reader(self):
+        """
+        Test that the writer commits while a reader holds a snapshot.
+        """
+        sqlite_db.upsert(self.fn, _rows(range(2)))
+        reader = sqlite_db.connect(self.fn)
+        try:
+            reader.execute('BEGIN')
+            count = f'SELECT COUNT(*) FROM {SQL_TABLE}'
+            self.assertEqual(reader.execute(count).fetchone()[0], 2)
+
+            self.assertEqual(sqlite_db.upsert(self.fn, _rows(range(2, 4))), 2)
+
+            self.assertEqual(reader.execute(count).fetchone()[0], 2)
+            reader.execute('COMMIT')
+            self.assertEqual(reader.execute(count).fetchone()[0], 4)
+        finally:
+            reader.close()
+
+    def test_migrate(self):
+        """
+        Test that a to_sql table is keyed, deduplicated and extended.
+        """
+        with sqlite3.connect(self.fn) as con:
+            pd.concat([_rows(range(3)), _rows([1])]).to_sql(SQL_TABLE, con, index=False)
+
+        new = _rows([2, 3]).assign(trackid=[2, 3])
+        self.assertEqual(sqlite_db.upsert(self.fn, new), 1)
+
+        df = sqlite_db.read(self.fn)
+        self.assertEqual(list(df['title']), ['T0', 'T1', 'T2', 'T3'])
+        self.assertEqual(df['trackid'].iloc[3], 3)
+
+    def test_read_write_db(self):
+        """
+        Test that Write2Db appends to, and ReadDb reads, a '.sql' file.
+        """
+        rows = _rows(range(3)).to_dict('records')
+        self.assertTrue(Write2Db(rows[:2], self.fn).run())
+        self.assertTrue(Write2Db(rows, self.fn).run())
+
+        df = ReadDb(self.fn).read_db()
+        self.assertEqual(list(df['title']), ['T0', 'T1', 'T2'])
+
+    def test_rewrite_open_reader(self):
+        """
+        Test a rewrite while a reader holds a connection and a snapshot.
+        """
+        rows = _rows(range(4)).to_dict('records')
+        self.assertTrue(Write2Db(rows[:2], self.fn).run())
+        reader = sqlite_db.connect(self.fn)
+        try:
+            count = f'SELECT COUNT(*) FROM {SQL_TABLE}'
+            reader.execute('BEGIN')
+            self.assertEqual(reader.execute(count).fetchone()[0], 2)
+
+            self.assertTrue(Write2Db(rows, self.fn, append=False).run())
+
+            self.assertEqual(reader.execute(count).fetchone()[0], 2)
+            reader.execute('COMMIT')
+            self.assertEqual(reader.execute(count).fetchone()[0], 4)
+            self.assertEqual(reader.execute('PRAGMA integrity_check').fetchone()[0], 'ok')
+        finally:
+            reader.close()
+        self.assertEqual(list(ReadDb(self.fn).read_db()['title']),
+                         ['T0', 'T1', 'T2', 'T3'])
+        # no temporary file, the WAL is removed by the last connection
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['db.sql', 'db.sql.lock'])
+
+    def test_rewrite_rollback(self):
+        """
+        Test that the rows of an aborted rewrite are dropped.
+        """
+        sqlite_db.upsert(self.fn, _rows(range(3)))
+        with self.assertRaises(RuntimeError):
+            with ChunkWriter(self.fn) as out:
+                out.write(_rows(range(5, 9)))
+                raise RuntimeError('stop')
+        with ChunkWriter(self.fn) as out:
+            out.write(_rows(range(5, 7)))
+            out.abort()
+        self.assertEqual(list(sqlite_db.read(self.fn)['title']), ['T0', 'T1', 'T2'])
+
+        with ChunkWriter(self.fn) as out:
+            out.write(_rows([7, 7, 8]))
+        self.assertEqual(list(sqlite_db.read(self.fn)['title']), ['T7', 'T8'])
+
+    def test_append_lock(self):
+        """
+        Test that an append waits until a rewrite releases the db lock.
+        """
+        sqlite_db.upsert(self.fn, _rows(range(2)))
+        writer = threading.Thread(target=Write2Db(_rows([5]).to_dict('records'),
+                                                  self.fn).append_rows, args=('.sql',))
+        with DbLock(self.fn).exclusive():
+            writer.start()
+            writer.join(0.3)
+            self.assertTrue(writer.is_alive())
+            self.assertEqual(len(sqlite_db.read(self.fn)), 2)
+        writer.join()
+        self.assertEqual(len(sqlite_db.read(self.fn)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
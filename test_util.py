@@ -20,6 +20,15 @@ Test Cases:
     with a non-existing file. Similar to 'test_read_db_nonexisting',
     this test case verifies that the function 
     returns an empty string when given the path to a non-existing file.
+6. test_sniff_file_type_magic: Tests the in-process sniffer on the magic
+    numbers of the binary formats in READ_FRMT.
+7. test_sniff_file_type_text: Tests the JSON, HTML and CSV heuristics.
+8. test_detect_file_type_no_subprocess: Tests that recognised files are
+    typed without running the 'file' command.
+9. test_detection_cache: Tests that repeated detections are served from the
+    cache and that changing the file invalidates its entry.
+10. test_detect_format: Tests mapping detected types to format extensions,
+    and the extension telling JSON from JSON Lines.
 
 Test Fixture:
 - setUp: Creates a temporary CSV file for testing before each test case is executed.
@@ -40,9 +49,11 @@ refer to the module's docstring and implementation.
 """
 
 import unittest
+from unittest.mock import patch
 import os
 import pandas as pd
-from util import detect_file_type
+import util
+from util import detect_file_type, detect_format, sniff_file_type
 
 
 class TestParseRow(unittest.TestCase):
@@ -96,6 +107,102 @@ class TestParseRow(unittest.TestCase):
         # Assert that an empty string is returned
         self.assertEqual(detected_type, '')
 
+    def _write(self, data):
+        mode = 'wb' if isinstance(data, bytes) else 'w'
+        with open(self.test_csv_path, mode) as f:
+            f.write(data)
+        return sniff_file_type(self.test_csv_path)
+
+    def test_sniff_file_type_magic(self):
+        """
+        Test the sniff_file_type function with binary magic numbers.
+        """
+        cases = {
+            b'PAR1\x15\x04': 'application/vnd.apache.parquet',
+            b'ARROW1\x00\x00': 'application/vnd.apache.arrow.file',
+            b'SQLite format 3\x00\x10\x00': 'application/vnd.sqlite3',
+            b'\x89HDF\r\n\x1a\n\x00': 'application/x-hdf5',
+            b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1\x00': 'application/vnd.ms-excel',
+            b'PK\x03\x04\x14\x00[Content_Types].xml':
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            b'<stata_dta><header>': 'application/x-stata-dta',
+            b'\x00\x01\x02': 'application/octet-stream',
+            b'': 'inode/x-empty',
+        }
+        for data, expected in cases.items():
+            with self.subTest(expected=expected):
+                self.assertEqual(self._write(data), expected)
+
+    def test_sniff_file_type_text(self):
+        """
+        Test the sniff_file_type function with text formats.
+        """
+        cases = {
+            'A,B\n1,4\n2,5\n': 'text/csv',
+            'A\tB\n1\t4\n': 'text/csv',
+            '{"A": {"0": 1}}': 'application/json',
+            '{"A": 1}\n{"A": 2}\n': 'application/x-ndjson',
+            '<table border="1">\n</table>': 'text/html',
+            '<?xml version="1.0"?>\n<root></root>': 'text/xml',
+            'Test data\n': 'text/plain',
+        }
+        for data, expected in cases.items():
+            with self.subTest(expected=expected):
+                self.assertEqual(self._write(data), expected)
+
+    @patch('util.subprocess.run')
+    def test_detect_file_type_no_subprocess(self, mock_run):
+        """
+        Test that detect_file_type does not fork for recognised files.
+        """
+        self._write('A,B\n1,4\n')
+
+        self.assertEqual(detect_file_type(self.test_csv_path), 'text/csv')
+        mock_run.assert_not_called()
+
+    @patch('util.sniff_file_type', wraps=sniff_file_type)
+    def test_detection_cache(self, mock_sniff):
+        """
+        Test that the detection cache counts hits and is invalidated by writes.
+        """
+        util.DETECTION_CACHE.clear()
+
+        self.assertEqual(detect_file_type(self.test_csv_path), 'text/plain')
+        self.assertEqual(detect_file_type(self.test_csv_path), 'text/plain')
+        self.assertEqual(mock_sniff.call_count, 1)
+        self.assertEqual(util.detection_cache_info()[:2], (1, 1))
+
+        with open(self.test_csv_path, 'a', encoding='utf-8') as f:
+            f.write('A,B\n1,2\n')
+        detect_file_type(self.test_csv_path)
+        self.assertEqual(mock_sniff.call_count, 2)
+        self.assertEqual(util.detection_cache_info().misses, 2)
+
+    def test_detect_format(self):
+        """
+        Test the detect_format function with detected and fallback formats.
+        """
+        frmts = {'.csv': 'read_csv', '.json': 'read_json', '.feather': 'read_feather'}
+        feather = 'test.json'
+        with open(feather, 'wb') as f:
+            f.write(b'ARROW1\x00\x00')
+        try:
+            self.assertEqual(detect_format(feather, frmts), '.feather')
+        finally:
+            os.remove(feather)
+        self._write('A,B\n1,4\n')
+        self.assertEqual(detect_format(self.test_csv_path, frmts), '.csv')
+        self.assertEqual(detect_format('non_existing.json', frmts), '.json')
+        # a one-line JSON Lines file sniffs as JSON
+        jsonl = 'test.jsonl'
+        with open(jsonl, 'w', encoding='utf-8') as f:
+            f.write('{"A": 1}\n')
+        try:
+            self.assertEqual(detect_format(jsonl, {**frmts, '.jsonl': 'read_json'}),
+                             '.jsonl')
+        finally:
+            os.remove(jsonl)
+
 
 if __name__ == '__main__':
     unittest.main()
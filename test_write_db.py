@@ -6,6 +6,7 @@ The 'write_db' module provides functions for writing pandas DataFrame to various
 Functions:
 - write_db(df, fn, **kwargs): Writes a pandas DataFrame to a file.
 - write(df, db_file, frmt, **kwargs): Helper function to write a DataFrame to a file.
+- write_db_async(df, fn, **kwargs): Starts writing a DataFrame and returns a future.
 
 Usage Example:
     import write_db
@@ -21,8 +22,10 @@ Usage Example:
 """
 import unittest
 import os
+import tempfile
+from concurrent.futures import Future
 import pandas as pd
-from write_db import write_db, write
+from write_db import write_db, write, write_db_async
 
 class TestWriteDB(unittest.TestCase):
     """
@@ -47,6 +50,7 @@ class TestWriteDB(unittest.TestCase):
         
         # Clean up temporary test file
         os.remove(test_file)
+        os.remove(test_file + '.lock')
 
     def test_write_db_invalid_df(self):
         """
@@ -101,6 +105,37 @@ class TestWriteDB(unittest.TestCase):
         
         # Clean up temporary test file
         os.remove(test_file)
+        os.remove(test_file + '.lock')
+
+    def test_write_atomic(self):
+        """
+        Test that a failed write leaves the existing file untouched.
+        """
+        test_df = pd.DataFrame({'A': [1, 2, 3], 'B': [4, 5, 6]})
+        with tempfile.TemporaryDirectory() as tmp:
+            test_file = os.path.join(tmp, 'test.csv')
+            self.assertTrue(write(test_df, test_file, '.csv', index=False))
+
+            with self.assertRaises(TypeError):
+                write(test_df, test_file, '.csv', no_such_arg=True)
+
+            self.assertTrue(pd.read_csv(test_file).equals(test_df))
+            self.assertEqual(sorted(os.listdir(tmp)), ['test.csv', 'test.csv.lock'])
+
+    def test_write_db_async(self):
+        """
+        Test that write_db_async returns a future resolved once the file
+        is in place.
+        """
+        test_df = pd.DataFrame({'A': [1, 2, 3], 'B': [4, 5, 6]})
+        with tempfile.TemporaryDirectory() as tmp:
+            test_file = os.path.join(tmp, 'test.csv')
+            future = write_db_async(test_df, test_file)
+
+            self.assertIsInstance(future, Future)
+            self.assertTrue(future.result(timeout=10))
+            self.assertEqual(len(pd.read_csv(test_file)), 3)
+        self.assertIsNone(write_db_async(pd.DataFrame(), 'empty.csv'))
 
 
 if __name__ == '__main__':
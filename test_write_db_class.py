@@ -0,0 +1,205 @@
+"""
+Test module for the 'write_db_class' module.
+
+The 'write_db_class' module provides the Write2Db class, which adds new
+    rows to a database file and drops duplicates on their track id, or on
+    util.SUBSET for rows without one.
+
+Test Cases:
+- test_append_formats: Tests that append-capable formats take new rows
+    without the database being read back through ReadDb.
+- test_append_uses_index: Tests that the dedup index, not the database,
+    is consulted once it is up to date, without copying its keys.
+- test_append_incompatible_csv: Tests that rows whose columns differ from
+    the CSV header are rejected.
+- test_track_id_key: Tests that rows are deduplicated on their track id,
+    also in databases written before the track id column existed.
+- test_jsonl_db: Tests that JSON Lines databases are appended to line by
+    line and read back whole, in chunks, row by row and from the end.
+- test_rewrite_drops_index: Tests that a rewrite of the same size does
+    not leave the dedup index of the old rows behind.
+
+Usage:
+To run the test suite, execute this module.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pandas as pd
+
+from dedup_index import open_index
+from read_db import ReadDb
+from write_db_class import ChunkWriter, Write2Db
+
+ROW = {'timestamp': '13 May 2024 at 17:35',
+       'title': 'I Don’t Really Wanna Go to Work',
+       'artist': 'Jang Wooram',
+       'isexplicit': 'No',
+       'lyricssnippet': '',
+       'name': 'Jang Wooram - I Don’t Really Wanna Go to Work'}
+
+
+def _read(fn):
+    _, frmt = os.path.splitext(fn)
+    if frmt == '.csv':
+        return pd.read_csv(fn)
+    if frmt == '.jsonl':
+        return pd.read_json(fn, lines=True)
+    if frmt == '.json':
+        return pd.read_json(fn)
+    if frmt == '.sql':
+        with sqlite3.connect(fn) as con:
+            return pd.read_sql('SELECT * FROM shazam', con)
+    return pd.read_hdf(fn)
+
+
+class TestWrite2Db(unittest.TestCase):
+    """
+    Test suite for the Write2Db class.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    @patch('write_db_class.ReadDb')
+    def test_append_formats(self, mock_read_db):
+        """
+        Test appending to CSV, JSON Lines and HDF5 files.
+        """
+        other = dict(ROW, title='Other Song')
+        for ext in ('.csv', '.jsonl', '.h5'):
+            with self.subTest(ext=ext):
+                fn = os.path.join(self.tmp, f'db{ext}')
+
+                self.assertTrue(Write2Db([ROW], fn).run())
+                self.assertTrue(Write2Db([other, ROW], fn).run())
+                self.assertTrue(Write2Db([other], fn).run())
+
+                df = _read(fn)
+                self.assertEqual(len(df), 2)
+                self.assertEqual(list(df['title']), [ROW['title'], 'Other Song'])
+        mock_read_db.assert_not_called()
+
+    def test_append_uses_index(self):
+        """
+        Test that the db's key columns are only read to build the index.
+        """
+        fn = os.path.join(self.tmp, 'db.csv')
+        self.assertTrue(Write2Db([ROW], fn).run())
+        self.assertTrue(os.path.exists(fn + '.idx'))
+
+        class Keys():
+            # the lookups and updates of a set, but no way to copy it
+            def __init__(self, keys):
+                self.keys = keys
+
+            def __contains__(self, h):
+                return h in self.keys
+
+            def update(self, hashes):
+                self.keys.update(hashes)
+
+        index = open_index(fn)
+        index.keys = Keys(index.keys)
+        other = dict(ROW, artist='B')
+        with patch.object(Write2Db, 'stored_keys') as mock_stored_keys, \
+                patch.object(Write2Db, 'rewrite') as mock_rewrite:
+            self.assertTrue(Write2Db([ROW, other, other], fn).run())
+            mock_stored_keys.assert_not_called()
+            mock_rewrite.assert_not_called()
+        self.assertEqual(len(_read(fn)), 2)
+
+    def test_append_incompatible_csv(self):
+        """
+        Test that rows with different columns are not appended to a CSV.
+        """
+        fn = os.path.join(self.tmp, 'db.csv')
+        self.assertTrue(Write2Db([ROW], fn).run())
+
+        self.assertFalse(Write2Db([{'artist': 'A', 'title': 'T', 'x': 1}], fn).run())
+        self.assertEqual(len(_read(fn)), 1)
+
+    def test_track_id_key(self):
+        """
+        Test that the same track id is a duplicate whatever its text columns.
+        """
+        url = 'https://www.shazam.com/track/468503633/work?co=GB'
+        old = dict(ROW, shazamurl=url)
+        renamed = dict(old, title='Work', trackid=468503633)
+        new = dict(old, title='Other', shazamurl=url.replace('468503633', '7'),
+                   trackid=7)
+        for ext in ('.csv', '.sql', '.json'):
+            with self.subTest(ext=ext):
+                fn = os.path.join(self.tmp, f'db{ext}')
+                # a db written before rows had a track id
+                self.assertTrue(Write2Db([old], fn).run())
+
+                self.assertTrue(Write2Db([renamed, new], fn).run())
+
+                df = _read(fn)
+                self.assertEqual(sorted(df['title']), sorted([ROW['title'], 'Other']))
+
+    def test_jsonl_db(self):
+        """
+        Test writing and reading a JSON Lines database.
+        """
+        fn = os.path.join(self.tmp, 'db.jsonl')
+        titles = [f'Song {i}' for i in range(5)]
+        for title in titles:
+            self.assertTrue(Write2Db([dict(ROW, title=title)], fn).run())
+        with open(fn, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+        db = ReadDb(fn)
+        df = db.read_db()
+        self.assertEqual(list(df['title']), titles)
+        # timestamps are kept as written
+        self.assertEqual(df['timestamp'][0], ROW['timestamp'])
+        chunks = list(db.read_db(chunksize=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        self.assertEqual([row['title'] for row in db.iter_rows()], titles)
+        self.assertEqual(list(db.tail(2, block=16)['title']), titles[-2:])
+        self.assertEqual(list(db.tail(10)['title']), titles)
+
+        # a row cut short by a crashed writer is skipped, not appended to
+        with open(fn, 'a', encoding='utf-8') as f:
+            f.write('{"title": "Cut')
+        self.assertEqual(len(list(db.iter_rows())), 5)
+        self.assertTrue(Write2Db([dict(ROW, title='Song 5')], fn).run())
+        self.assertEqual([row['title'] for row in db.iter_rows()][-1], 'Song 5')
+        self.assertEqual(list(db.tail(1)['title']), ['Song 5'])
+
+    def test_rewrite_drops_index(self):
+        """
+        Test appending a row that a rewrite of the same size removed.
+        """
+        fn = os.path.join(self.tmp, 'db.csv')
+        self.assertTrue(Write2Db([dict(ROW, title='AAAA'), dict(ROW, title='CCCC')], fn).run())
+        self.assertTrue(os.path.exists(fn + '.idx'))
+        size = os.path.getsize(fn)
+
+        with ChunkWriter(fn) as out:
+            out.write(_read(fn).replace({'title': {'AAAA': 'BBBB'}}))
+        self.assertEqual(os.path.getsize(fn), size)
+        self.assertFalse(os.path.exists(fn + '.idx'))
+
+        self.assertTrue(Write2Db([dict(ROW, title='AAAA')], fn).run())
+        self.assertEqual(list(_read(fn)['title']), ['BBBB', 'CCCC', 'AAAA'])
+
+        # a full rewrite through Write2Db drops it as well
+        Write2Db([dict(ROW, title='DDDD')], fn, append=False).run()
+        self.assertFalse(os.path.exists(fn + '.idx'))
+        self.assertTrue(Write2Db([dict(ROW, title='DDDD')], fn).run())
+        self.assertEqual(len(_read(fn)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
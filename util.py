@@ -1,12 +1,32 @@
+import csv
+import json
+import operator
 import os
+import re
+import shutil
 import subprocess
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+
+import pandas as pd
 
 SUBSET = ["artist", "title", "name"]
+# the numeric Shazam track id, the primary dedup key, taken from shazamurl;
+# SUBSET is only compared for rows without one
+TRACK_ID = 'trackid'
+TRACK_URL = 'shazamurl'
+TRACK_ID_RE = re.compile(r'/track/(\d+)')
+# the columns a dedup key can be computed from
+KEY_COLUMNS = [TRACK_ID, TRACK_URL, *SUBSET]
 WRITE_FRMT = {
     '.csv': 'to_csv',
     '.xls': 'to_excel',
     '.xlsx': 'to_excel',
     '.json': 'to_json',
+    '.jsonl': 'to_json',
     '.html': 'to_html',
     '.sql': 'to_sql',
     '.parquet': 'to_parquet',
@@ -16,21 +36,410 @@ WRITE_FRMT = {
     '.dta': 'to_stata',
     '.sas7bdat': 'to_sas',
 }
+# formats that can take new rows without rewriting the file,
+# mapped to the Write2Db method appending to them
+APPEND_FRMT = {
+    '.csv': '_append_csv',
+    '.jsonl': '_append_jsonl',
+    '.h5': '_append_hdf',
+    '.hdf': '_append_hdf',
+    '.sql': '_append_sql',
+    # partitioned datasets only, see parquet_dataset
+    '.parquet': '_append_parquet',
+}
+HDF_KEY = 'shazam'
+SQL_TABLE = 'shazam'
+# extra keyword arguments of the WRITE_FRMT methods
+WRITE_ARGS = {
+    # uncompressed record batches can be memory-mapped, see arrow_db
+    '.feather': {'compression': 'uncompressed'},
+    '.jsonl': {'orient': 'records', 'lines': True, 'force_ascii': False},
+    '.h5': {'key': HDF_KEY, 'format': 'table'},
+    '.hdf': {'key': HDF_KEY, 'format': 'table'},
+}
+# extra keyword arguments of the READ_FRMT methods; JSON Lines rows keep
+# their timestamps as written, like the CSV ones
+READ_ARGS = {
+    '.jsonl': {'lines': True, 'convert_dates': False},
+}
+# string column widths reserved when an HDF table is created
+HDF_MIN_ITEMSIZE = {'lyricssnippet': 4096, 'lyricsnippetsynced': 4096}
+HDF_DEFAULT_ITEMSIZE = 512
+# mime types whose name does not contain the format extension
+MIME_FRMT = {
+    'text/csv': '.csv',
+    'application/vnd.ms-excel': '.xls',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+    'application/json': '.json',
+    'application/x-ndjson': '.jsonl',
+    'text/html': '.html',
+    'application/vnd.sqlite3': '.sql',
+    'application/vnd.apache.parquet': '.parquet',
+    'application/vnd.apache.arrow.file': '.feather',
+    'application/x-hdf5': '.h5',
+    'application/x-stata-dta': '.dta',
+    'application/x-sas-data': '.sas7bdat',
+}
+
+# the JSON layouts, told apart by the file extension
+JSON_FRMT = ('.json', '.jsonl')
+
+SNIFF_BYTES = 8192
+# (offset, magic bytes, mime type) of the binary formats in READ_FRMT
+MAGIC = [
+    (0, b'PAR1', 'application/vnd.apache.parquet'),
+    (0, b'ARROW1', 'application/vnd.apache.arrow.file'),
+    (0, b'FEA1', 'application/vnd.apache.arrow.file'),
+    (0, b'SQLite format 3\x00', 'application/vnd.sqlite3'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/vnd.ms-excel'),
+    (0, b'<stata_dta>', 'application/x-stata-dta'),
+    (0, b'\x00' * 12 + b'\xc2\xea\x81\x60\xb3\x14\x11\xcf\xbd\x92\x08\x00'
+        b'\x09\xc7\x31\x8c\x18\x1f\x10\x11', 'application/x-sas-data'),
+    # HDF5 files may start with a user block of 512 * 2**n bytes
+    (0, b'\x89HDF\r\n\x1a\n', 'application/x-hdf5'),
+    (512, b'\x89HDF\r\n\x1a\n', 'application/x-hdf5'),
+    (1024, b'\x89HDF\r\n\x1a\n', 'application/x-hdf5'),
+    (2048, b'\x89HDF\r\n\x1a\n', 'application/x-hdf5'),
+    (4096, b'\x89HDF\r\n\x1a\n', 'application/x-hdf5'),
+]
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_DELIMITERS = ',\t;|'
+# operators of the (column, op, value) filters of ReadDb.read_db, named as
+# in pandas.read_parquet
+FILTER_OPS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda values, value: values.isin(value),
+    'not in': lambda values, value: ~values.isin(value),
+}
+
+
+def track_id(url):
+    """
+    Extract the numeric Shazam track id of a shazamurl.
+
+    :param url: The URL, e.g. 'https://www.shazam.com/track/468503633/...'
+    :return: The id as an int, None if the URL has none
+    """
+    match = TRACK_ID_RE.search(url) if isinstance(url, str) else None
+    return int(match.group(1)) if match else None
+
+
+def track_ids(df):
+    """
+    Return the track id of every row of a DataFrame as an Int64 Series.
+
+    The TRACK_ID column is used where it is set, and the id is otherwise
+    extracted from the TRACK_URL column, so databases written before the
+    column existed get ids too. Rows with neither are <NA>.
+    """
+    if TRACK_ID in df.columns:
+        ids = pd.to_numeric(df[TRACK_ID], errors='coerce').astype('Int64')
+    else:
+        ids = pd.Series(pd.NA, index=df.index, dtype='Int64')
+    if TRACK_URL in df.columns and ids.isna().any():
+        found = df[TRACK_URL].astype('string').str.extract(TRACK_ID_RE, expand=False)
+        ids = ids.fillna(pd.to_numeric(found, errors='coerce').astype('Int64'))
+    return ids
+
+
+def check_filters(filters):
+    """
+    Validate a list of (column, op, value) filters, see FILTER_OPS.
+
+    :return: The filters as a list of tuples, [] for None
+    """
+    checked = []
+    for item in filters or []:
+        if len(item) != 3 or item[1] not in FILTER_OPS:
+            raise ValueError(f'invalid filter {item!r}: use (column, op, value) '
+                             f'with op one of {", ".join(FILTER_OPS)}')
+        checked.append(tuple(item))
+    return checked
+
+
+def needed_columns(columns, filters):
+    """
+    Return the columns to read to project on `columns` after `filters`,
+    None for every column.
+    """
+    if columns is None:
+        return None
+    extra = [col for col, _, _ in check_filters(filters) if col not in columns]
+    return list(columns) + extra
+
+
+def filter_frame(df, columns=None, filters=None):
+    """
+    Keep the rows of `df` matching every filter, then the `columns`.
+
+    Used where a backend cannot filter or project while reading; applying
+    it to rows already filtered by the backend is harmless.
+
+    :param columns: The columns to keep, in file order, None for all of them
+    :param filters: A list of (column, op, value) filters, see FILTER_OPS
+    """
+    filters = check_filters(filters)
+    if filters:
+        mask = pd.Series(True, index=df.index)
+        for col, op, value in filters:
+            if col not in df.columns:
+                raise ValueError(f'cannot filter on the unknown column {col!r}')
+            match = FILTER_OPS[op](df[col], value)
+            mask &= match.fillna(False).astype(bool)
+        df = df[mask]
+    if columns is not None:
+        df = df[[col for col in df.columns if col in columns]]
+    return df.reset_index(drop=True) if filters else df
+
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # e.g. directories cannot be fsynced on every platform
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_write(fn):
+    """
+    Write a file through a temporary file renamed into place.
+
+    The caller writes to the yielded path, a new file in the directory of
+    `fn` with the same extension (so pandas infers the same format). Once
+    the block exits, the file is fsynced, renamed over `fn` and the
+    directory is fsynced, so readers see either the old or the new file,
+    never a partial one. If the block raises, the temporary file is
+    removed and `fn` is left untouched.
+
+    :param fn: The file to replace
+    """
+    directory, base = os.path.split(os.path.abspath(fn))
+    name, ext = os.path.splitext(base)
+    tmp = os.path.join(directory, f'.{name}.{uuid.uuid4().hex}.tmp{ext}')
+    try:
+        yield tmp
+        _fsync_path(tmp)
+        if os.path.exists(fn):
+            shutil.copymode(fn, tmp)
+        os.replace(tmp, fn)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _fsync_path(directory)
+
+
+def _sniff_binary(head):
+    """
+    Match the first bytes of a file against the known magic numbers.
+
+    :param head: The first bytes of the file
+    :return: The mime type, or None if no magic number matches
+    """
+    for offset, magic, mime in MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            return mime
+    if head.startswith(b'PK\x03\x04'):
+        if b'xl/' in head or b'[Content_Types].xml' in head:
+            return XLSX_MIME
+        return 'application/zip'
+    # legacy Stata (versions 104-115): version, byte order, filetype 1
+    if len(head) > 3 and 104 <= head[0] <= 115 and head[1] in (1, 2) \
+            and head[2] == 1 and head[3] == 0:
+        return 'application/x-stata-dta'
+    return None
+
+
+def _sniff_text(text):
+    """
+    Tell JSON, HTML, XML, CSV and plain text apart from a text sample.
+
+    :param text: The decoded first bytes of the file, complete lines only
+    :return: The mime type
+    """
+    stripped = text.lstrip()
+    if stripped.startswith(('{', '[')):
+        lines = stripped.splitlines()
+        if len(lines) > 1 and lines[1].lstrip().startswith('{'):
+            try:
+                json.loads(lines[0])
+                return 'application/x-ndjson'
+            except ValueError:
+                pass
+        return 'application/json'
+    if stripped.startswith('<'):
+        lower = stripped[:1024].lower()
+        if '<html' in lower or '<!doctype html' in lower or '<table' in lower:
+            return 'text/html'
+        return 'text/xml'
+    lines = [line for line in text.splitlines()[:20] if line.strip()]
+    for delimiter in CSV_DELIMITERS:
+        widths = {len(fields) for fields in csv.reader(lines, delimiter=delimiter)}
+        if len(widths) == 1 and widths.pop() > 1:
+            return 'text/csv'
+    return 'text/plain'
 
 
-def detect_file_type(fn):
+def sniff_file_type(fn, nbytes=SNIFF_BYTES):
+    """
+    The sniff_file_type function detects the mime type of a file in process
+		by reading its first `nbytes` bytes, without running any command.
+	Binary formats are recognised by their magic numbers, text formats by
+		looking at the first lines.
+	---------------------------------------------------------------
+    :param fn: Pass the name and path of a file to the function
+    :param nbytes: The number of bytes to read from the start of the file
+    :return: The mime type if the file exists, '' otherwise.
+		'application/octet-stream' for unrecognised binary data
+    """
+    if os.path.isdir(fn):
+        return 'inode/directory'
+    try:
+        with open(fn, 'rb') as f:
+            head = f.read(nbytes)
+    except OSError:
+        return ''
+    if not head:
+        return 'inode/x-empty'
+    mime = _sniff_binary(head)
+    if mime:
+        return mime
+    if b'\x00' in head:
+        return 'application/octet-stream'
+    if len(head) == nbytes:
+        # drop the last, possibly truncated, line
+        head = head[:head.rfind(b'\n') + 1] or head
+    try:
+        text = head.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = head.decode('latin-1')
+    return _sniff_text(text)
+
+
+DetectionCacheInfo = namedtuple(
+    'DetectionCacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class DetectionCache():
+    """
+    A bounded LRU cache of detected file types.
+
+    Entries are stored per path together with the file's
+    (size, mtime, inode) signature; a lookup whose signature no longer
+    matches is a miss, so any write or replacement of the file
+    invalidates its entry.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(fn):
+        """
+        Return the (size, mtime, inode) signature of `fn`, None if missing.
+        """
+        try:
+            st = os.stat(fn)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    def get(self, key, fn, detect):
+        """
+        Return the cached type of `fn`, calling `detect()` on a miss.
+        """
+        sig = self.signature(fn)
+        with self._lock:
+            entry = self._entries.get(key)
+            if sig is not None and entry is not None and entry[0] == sig:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        file_type = detect()
+        if sig is None:
+            return file_type
+        with self._lock:
+            self._entries[key] = (sig, file_type)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return file_type
+
+    def info(self):
+        """
+        Return the hit and miss counters and the size of the cache.
+        """
+        with self._lock:
+            return DetectionCacheInfo(self.hits, self.misses,
+                                      self.maxsize, len(self._entries))
+
+    def clear(self):
+        """
+        Drop every entry and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+DETECTION_CACHE = DetectionCache()
+
+
+def detection_cache_info():
+    """
+    Return the DetectionCacheInfo(hits, misses, maxsize, currsize)
+        of the shared detection cache.
+    """
+    return DETECTION_CACHE.info()
+
+
+def detect_file_type(fn, fallback=True):
     """
     The detect_file_type function takes a file path as input and returns the
-		file type. The function uses the [file][file man] command 
-	 	to determine the file type.
+		file type. The type is sniffed in process (see sniff_file_type);
+	 	the [file][file man] command is only run when the sniffer does not
+		recognise the data and `fallback` is True.
     The output of this command is parsed to extract only the file type.
 	---------------------------------------------------------------
     :param fn: Pass the name and path of a file to the function
+    :param fallback: Run the `file` command for unrecognised data, if installed
     :return: The file type if file exists, '' otherwise
+	Results are cached in DETECTION_CACHE until the file changes.
 	[file man](https://man7.org/linux/man-pages/man1/file.1.html)
     """
     if not os.path.exists(fn):
         return ''
+    return DETECTION_CACHE.get((os.path.abspath(fn), fallback), fn,
+                               lambda: _detect_file_type(fn, fallback))
+
+
+def _detect_file_type(fn, fallback):
+    """
+    Detect the type of `fn` without the cache, see detect_file_type.
+    """
+    file_type = sniff_file_type(fn)
+    if file_type != 'application/octet-stream' or not fallback \
+            or shutil.which('file') is None:
+        return file_type
     result = subprocess.run(
         ['file',
          '--mime-type',
@@ -39,4 +448,38 @@ def detect_file_type(fn):
     # Extract the file type from the output
     file_type = result.stdout.strip().split(': ')[-1]
 
-    return file_type
\ No newline at end of file
+    return file_type
+
+
+@lru_cache(maxsize=None)
+def _format_regex(frmts):
+    """
+    Compile the regex matching any of the extensions in `frmts`.
+    """
+    rgx = '|'.join(map(lambda c: c.strip('.'), frmts))
+    return re.compile(rf'({rgx})')
+
+
+def detect_format(fn, frmts):
+    """
+    The detect_format function returns the format key of `frmts`
+		(e.g. READ_FRMT) matching the detected type of a file.
+	The mime type is looked up in MIME_FRMT first, then searched for
+		one of the extensions, and the file extension is used last.
+	---------------------------------------------------------------
+    :param fn: Pass the name and path of a file to the function
+    :param frmts: A mapping (or iterable) of supported extensions
+    :return: The extension of the detected format, e.g. '.csv'
+    """
+    _, ext = os.path.splitext(fn)
+    ft = detect_file_type(fn)
+    frmt = MIME_FRMT.get(ft)
+    if frmt in JSON_FRMT and ext in JSON_FRMT and ext in frmts:
+        # a one-line JSON Lines file sniffs as JSON, trust the extension
+        return ext
+    if frmt in frmts:
+        return frmt
+    ft = _format_regex(tuple(frmts)).findall(ft)
+    if len(ft) > 0:
+        return f'.{ft[0]}'
+    return ext
@@ -1,11 +1,12 @@
 import os
-import re
 import threading
-import time
 
 import pandas as pd
 
-from read_db import ReadDB
+import executor
+import sqlite_db
+from db_lock import DbLock
+from dedup_index import drop_duplicate_keys, invalidate
 import util
 SUBSET = ["artist", "title", "name"]
 WRITE_FRMT = {
@@ -13,6 +14,7 @@ WRITE_FRMT = {
     '.xls': 'to_excel',
     '.xlsx': 'to_excel',
     '.json': 'to_json',
+    '.jsonl': 'to_json',
     '.html': 'to_html',
     '.sql': 'to_sql',
     '.parquet': 'to_parquet',
@@ -29,6 +31,7 @@ READ_FRMT = {
     '.xls': 'read_excel',
     '.xlsx': 'read_excel',
     '.json': 'read_json',
+    '.jsonl': 'read_json',
     '.html': 'read_html',
     '.sql': 'read_sql',
     '.parquet': 'read_parquet',
@@ -55,16 +58,7 @@ def read_db(db_file, **kwargs):
     if not os.path.exists(db_file):
         return None
     #   print(db_file)
-    _, ext = os.path.splitext(db_file)
-
-    rgx = '|'.join(map(lambda c: c.strip('.'), READ_FRMT.keys()))
-    rgx = rf'({rgx})'
-    ft = util.detect_file_type(db_file)
-    ft = re.findall(rgx, ft)
-    if len(ft) > 0:
-        frmt = f'.{ft[0]}'
-    else:
-        frmt = ext
+    frmt = util.detect_format(db_file, READ_FRMT)
     return read(db_file, frmt, **kwargs)
 
 
@@ -77,11 +71,18 @@ def read(db_file, frmt, **kwargs):
     :param **kwargs: Pass a variable number of arguments to the function
     :return: A dataframe
     """
+    if frmt == '.sql':
+        return sqlite_db.read(db_file)
     args = kwargs if 'args' in kwargs else {'encoding': 'utf-8'}
+    args = {**args, **util.READ_ARGS.get(frmt, {})}
     method = READ_FRMT.get(frmt)
     if method:
         read_method = getattr(pd, method)
-        df = read_method(db_file, **args)
+        if frmt not in util.APPEND_FRMT:
+            # only ever replaced by rename, see util.atomic_write
+            return read_method(db_file, **args)
+        with DbLock(db_file).shared():
+            df = read_method(db_file, **args)
         return df
 # print(read_db('file.json'))
 
@@ -96,12 +97,39 @@ def write(df, fn, frmt, **kwargs):
     :param db_file: Specify the file path of the database
     :param frmt: Determine the format of the file that is being written to
     :param **kwargs: Pass a variable number of keyword arguments to a function
-    :return: The dataframe that is written to the file
+    :return: True once the file is written and renamed into place
     """
     method = WRITE_FRMT.get(frmt)
+    if frmt == '.sql':
+        # rewritten in place, a rename would corrupt the WAL of readers
+        with DbLock(fn).exclusive():
+            status = sqlite_db.write(df, fn)
+            invalidate(fn)
+            return status
     if method:
         write_method = getattr(df, method)
-        write_method(fn, **kwargs)
+        kwargs = {**kwargs, **util.WRITE_ARGS.get(frmt, {})}
+        if method == 'to_json':
+            # to_json always writes UTF-8 and takes no encoding
+            kwargs.pop('encoding', None)
+        with DbLock(fn).exclusive():
+            with util.atomic_write(fn) as tmp:
+                write_method(tmp, **kwargs)
+            # the dedup index only follows appends, see dedup_index
+            invalidate(fn)
+        return True
+    return False
+
+def _write_frmt(fn):
+    """
+    Return the format `fn` is written in, CSV for unsupported extensions.
+    """
+    name, frmt = os.path.splitext(fn)
+    if frmt not in WRITE_FRMT:
+        frmt = '.csv'
+        print('Unsupported file extension.')
+        print(f'Writing {name}.csv in default format CSV')
+    return frmt
 
 def write_db(df, fn, **kwargs):
 
@@ -113,33 +141,36 @@ def write_db(df, fn, **kwargs):
     :param **kwargs: Pass a dictionary of arguments to the write function
     :return: True if the file is written successfully,
     """
+    future = write_db_async(df, fn, **kwargs)
+    if future is None:
+        return False
+    print(f'{threading.current_thread().name}: Writting Data!.....')
+    try:
+        if future.result():
+            print(f'{threading.current_thread().name}: done!')
+            return True
+    except Exception as e: # pylint: disable=broad-except
+        print(f'error : {e}')
+    return False
+
+def write_db_async(df, fn, **kwargs):
+    """
+    The write_db_async function starts writing a DataFrame in the background.
+
+    :param df: Pass the dataframe to be written
+    :param fn: Specify the file name
+    :param **kwargs: Pass a dictionary of arguments to the write function
+    :return: A concurrent.futures.Future resolving to the result of write
+        once the file is renamed into place, or None if `df` is empty or
+        not a DataFrame
+    """
     args = kwargs if 'args' in kwargs else {'encoding': 'utf-8'}
     if not isinstance(df, pd.DataFrame):
-        return False
+        return None
     if len(df) == 0:
-        return False
-    name, frmt = os.path.splitext(fn)
-    rgx = '|'.join(map(lambda c: c.strip('.'), WRITE_FRMT.keys()))
-    rgx = rf'({rgx})'
-    if frmt not in WRITE_FRMT:
-        frmt = '.csv'
-        print('Unsupported file extension.')
-        print(f'Writing {name}.csv in default format CSV')
-        
-    # Create a new thread for fetch_row function
-    thr_fetch_row = threading.Thread(target=write, args=(df,fn,frmt,), kwargs=args)
-
-    # Start the thread for fetch_row function
-    thr_fetch_row.start()
-    while True:
-        try:
-            print(f'{threading.current_thread().name}: Writting Data!.....')
-            if os.path.exists(fn):
-                print('{threading.current_thread().name}: done!')
-                return True
-            time.sleep(1)
-        except Exception: # pylint: disable=broad-except
-            return False
+        return None
+    frmt = _write_frmt(fn)
+    return executor.submit_io(write, df, fn, frmt, **args)
 
 def append_db(lst_of_dct, fn):
     print('Preparing to write your data ....')
@@ -150,80 +181,12 @@ def append_db(lst_of_dct, fn):
     if not os.path.exists(fn):
         write_db(df, fn)
         return True
-    odf = read_db(fn, encoding="utf-8")
-    df = pd.concat([odf, df]).reset_index(
-            drop=True).drop_duplicates(subset=SUBSET)
-    write_db(df, fn)
+    # read and write back under one lock, so no other writer's rows are lost
+    with DbLock(fn).exclusive():
+        odf = read_db(fn, encoding="utf-8")
+        df = drop_duplicate_keys(pd.concat([odf, df]).reset_index(drop=True))
+        write(df, fn, _write_frmt(fn), encoding='utf-8')
     return True
 
-# Create a new thread and pass write to it
-thd_write = threading.Thread(target=my_function)
-
-# Start the thread
-thd_write.start()
-
-# Main thread continues execution
-for i in range(3):
-    print("Executing in main thread:", threading.current_thread().name)
-    time.sleep(1)
-
-# Wait for the thread to finish
-my_thread.join()
-
-print("Main thread and child thread execution completed.")
-
-
-
-import threading
-import time
-import signal
-import sys
-
-# Lock for file access
-file_lock = threading.Lock()
-
-def read_file():
-    try:
-        with open("data.txt", "r") as file:
-            file_lock.acquire()
-            data = file.read()
-            file_lock.release()
-            print("Read data:", data)
-    except Exception as e:
-        print("Error reading file:", e)
-
-def write_file():
-    try:
-        with open("data.txt", "a") as file:
-            file_lock.acquire()
-            file.write("New data\n")
-            file_lock.release()
-            print("Data written to file")
-    except Exception as e:
-        print("Error writing to file:", e)
-
-def signal_handler(sig, frame):
-    print("Interrupt received. Exiting gracefully.")
-    sys.exit(0)
-
-if __name__ == "__main__":
-    # Register signal handler for SIGINT (Ctrl+C)
-    signal.signal(signal.SIGINT, signal_handler)
-
-    # Start reading and writing threads
-    read_thread = threading.Thread(target=read_file)
-    write_thread = threading.Thread(target=write_file)
-
-    read_thread.start()
-    write_thread.start()
-
-    # Wait for threads to complete
-    read_thread.join()
-    write_thread.join()
-
-    print("Program execution completed.")
-
-
-
 # test_df = pd.DataFrame({'A': [1, 2, 3], 'B': [4, 5, 6]})
 # print(write_db(test_df, 'data.csv',encoding='utf-8'))
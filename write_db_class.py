@@ -1,16 +1,224 @@
 from collections.abc import Iterable
-from multiprocessing.pool import ThreadPool
+from contextlib import ExitStack
 import os
 import sys
 import threading
 import time
-import signal
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from read_db import ReadDb
+import executor
+import parquet_dataset
+import sqlite_db
+from db_lock import DbLock
+from dedup_index import drop_duplicate_keys, frame_hashes, invalidate, open_index
+from read_db import CHUNK_ROWS, ReadDb
 from abc import ABC, abstractmethod
 
-from util import WRITE_FRMT, SUBSET
+from util import (APPEND_FRMT, HDF_DEFAULT_ITEMSIZE, HDF_KEY,
+                  HDF_MIN_ITEMSIZE, KEY_COLUMNS, SUBSET, TRACK_ID,
+                  WRITE_ARGS, WRITE_FRMT, atomic_write, track_ids)
+
+# formats ChunkWriter writes chunk by chunk, mapped to its method; the
+# chunks of other formats are kept in memory until the writer is closed
+CHUNK_WRITE_FRMT = {
+    '.csv': '_write_csv',
+    '.jsonl': '_write_jsonl',
+    '.parquet': '_write_parquet',
+    '.sql': '_write_sql',
+}
+
+
+def _hdf_frame(df):
+    """
+    PyTables has no nullable integers, store the track id as float64.
+    """
+    if TRACK_ID in df.columns:
+        df = df.assign(**{TRACK_ID: df[TRACK_ID].astype('float64')})
+    return df
+
+
+def write_frame(df, fn, frmt, **kwargs):
+    """
+    Write `df` to the new file `fn` with the WRITE_FRMT method of `frmt`.
+
+    SQLite databases may exist already, their rows are replaced in place.
+    """
+    if frmt == '.sql':
+        # to_sql needs a connection, see sqlite_db
+        return sqlite_db.write(df, fn)
+    method = WRITE_FRMT[frmt]
+    if method == 'to_hdf':
+        df = _hdf_frame(df)
+    kwargs = {'index': False, **kwargs, **WRITE_ARGS.get(frmt, {})}
+    if method == 'to_feather':
+        # feather files never store the index
+        kwargs.pop('index')
+    getattr(df, method)(fn, **kwargs)
+    return True
+
+
+def iter_stored_keys(fn, frmt, chunksize=CHUNK_ROWS):
+    """
+    Yield the KEY_COLUMNS of the rows stored in `fn`, chunk by chunk.
+    """
+    if not os.path.exists(fn):
+        return
+    if frmt == '.csv':
+        # read as text, as the keys of new rows are computed from text
+        with pd.read_csv(fn, usecols=lambda c: c in KEY_COLUMNS, dtype=str,
+                         keep_default_na=False, chunksize=chunksize) as reader:
+            yield from reader
+        return
+    if frmt == '.jsonl':
+        # row by row, skipping a row cut short by a crashed writer
+        rows = []
+        for row in ReadDb(fn).iter_rows():
+            rows.append({c: row.get(c) for c in KEY_COLUMNS})
+            if len(rows) == chunksize:
+                yield pd.DataFrame(rows, columns=KEY_COLUMNS)
+                rows = []
+        if rows:
+            yield pd.DataFrame(rows, columns=KEY_COLUMNS)
+        return
+    # the backends read the key columns only, see ReadDb.iter_chunks
+    yield from ReadDb(fn).iter_chunks(chunksize, columns=KEY_COLUMNS)
+
+
+class ChunkWriter():
+    """
+    Write a db file chunk by chunk, replacing it when the writer closes.
+
+    The chunks go to a temporary file (see util.atomic_write) under the
+    exclusive db lock, so readers see the old file until the new one is
+    complete; if the block raises, the old file is kept. SQLite databases
+    are rewritten in place in one transaction instead (see
+    sqlite_db.rewrite). Formats of CHUNK_WRITE_FRMT hold one chunk in
+    memory at a time.
+
+    Usage Example:
+        with ChunkWriter('export.parquet') as out:
+            for chunk in ReadDb('wshazam.csv').iter_chunks():
+                out.write(chunk)
+    """
+
+    def __init__(self, fn, frmt=None):
+        """
+        @param fn: the file to write
+        @param frmt: its format, taken from the extension by default
+        """
+        self.fn = fn
+        self.frmt = frmt or os.path.splitext(fn)[1]
+        if self.frmt not in WRITE_FRMT:
+            raise ValueError(f'{fn}: unsupported format {self.frmt!r}')
+        self.rows = 0
+        self.columns = None
+        self.tmp = None
+        self._stack = None
+        self._frames = []
+        self._parquet = None
+        self._insert = None
+        self._aborted = False
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        self._stack.enter_context(DbLock(self.fn).exclusive())
+        # the keys of the old rows, dropped once the file is written
+        self._stack.callback(invalidate, self.fn)
+        if self.frmt == '.sql':
+            # never renamed over, see sqlite_db
+            self._insert = self._stack.enter_context(sqlite_db.rewrite(self.fn))
+        else:
+            self.tmp = self._stack.enter_context(atomic_write(self.fn))
+        return self
+
+    def write(self, df):
+        """
+        Write the rows of `df`, in the columns of the first chunk.
+        """
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif list(df.columns) != self.columns:
+            df = df.reindex(columns=self.columns)
+        if len(df) == 0:
+            return
+        method = CHUNK_WRITE_FRMT.get(self.frmt)
+        if method:
+            getattr(self, method)(df)
+        else:
+            self._frames.append(df)
+        self.rows += len(df)
+
+    def _write_csv(self, df):
+        df.to_csv(self.tmp, mode='a', header=self.rows == 0, index=False,
+                  encoding='utf-8')
+
+    def _write_jsonl(self, df):
+        with open(self.tmp, 'a', encoding='utf-8') as f:
+            f.write(df.to_json(**WRITE_ARGS['.jsonl']).rstrip('\n') + '\n')
+
+    def _write_parquet(self, df):
+        # columns without a value in a chunk are written as nulls of the
+        # type of the first chunk, or as text if they were empty there too
+        empty = [col for col in df.columns if df[col].isna().all()]
+        df = df.assign(**{col: pd.Series(None, index=df.index, dtype=object)
+                          for col in empty})
+        if self._parquet is None:
+            schema = pa.Table.from_pandas(df, preserve_index=False).schema
+            for i, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(i, field.with_type(pa.string()))
+            self._parquet = pq.ParquetWriter(self.tmp, schema)
+        table = pa.Table.from_pandas(df, preserve_index=False,
+                                     schema=self._parquet.schema)
+        self._parquet.write_table(table)
+
+    def _write_sql(self, df):
+        self._insert(df)
+
+    def _close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+        if self.frmt == '.sql':
+            if self.rows == 0:
+                # a table without rows
+                self._insert(pd.DataFrame(columns=self.columns or []))
+        elif self._frames or not os.path.exists(self.tmp):
+            # buffered chunks, or a file without rows
+            df = pd.concat(self._frames, ignore_index=True) if self._frames \
+                else pd.DataFrame(columns=self.columns or [])
+            write_frame(df, self.tmp, self.frmt)
+
+    def abort(self):
+        """
+        Keep the old file; the rows written so far are dropped on close.
+        """
+        self._aborted = True
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self._aborted:
+            exc = RuntimeError(f'{self.fn}: write aborted')
+            exc_type = type(exc)
+        try:
+            if exc_type is None:
+                self._close()
+            elif self._parquet is not None:
+                self._parquet.close()
+        except BaseException:
+            if not self._stack.__exit__(*sys.exc_info()):
+                raise
+            return False
+        if self._aborted:
+            # atomic_write removes the temporary file and re-raises exc,
+            # sqlite_db.rewrite rolls back
+            try:
+                self._stack.__exit__(exc_type, exc, None)
+            except RuntimeError as e:
+                if e is not exc:
+                    raise
+            return False
+        return self._stack.__exit__(exc_type, exc, tb)
 
 
 class Constant(ABC):
@@ -36,16 +244,19 @@ class Write2Db(Constant):
                 valid_akwargs[key] = value
         return valid_akwargs
 
-    def __init__(self, data, fn, **akwargs):
+    def __init__(self, data, fn, append=True, **akwargs):
         """
         @param data: same as the data param accepted by
         pd.DataFrame
         @param fn: the file containing the original db
+        @param append: add the new rows to the end of the file, without
+        reading it back, when its format supports it (see APPEND_FRMT)
         """
-        self.pool = ThreadPool(processes=1)
         self.fn = fn
+        self.append = append
         self.fail = False
-        self.file_lock = threading.Lock()
+        # shared with other processes, see db_lock
+        self.file_lock = DbLock(fn)
         self.akwargs = self._filter_df_args(akwargs)
 
         if len(data) == 0:
@@ -56,31 +267,191 @@ class Write2Db(Constant):
             self.fail = True
         try:
             self.df = pd.DataFrame(data, **self.akwargs)
+            if TRACK_ID in self.df.columns:
+                self.df[TRACK_ID] = track_ids(self.df)
         except Exception as e:  # pylint: disable=broad-except
             print(f'error : {e}')
             self.fail = True
-        signal.signal(signal.SIGINT, self._signal_handler)
+
+    _hdf_frame = staticmethod(_hdf_frame)
 
     @staticmethod
-    def _signal_handler(self, sig, frame):
-        print("Interrupt received. Exiting gracefully.")
-        sys.exit(0)
+    def _fit_columns(df, columns):
+        """
+        Drop the TRACK_ID column of `df` if the db was created without it;
+        the id is recovered from the shazamurl column when keys are read.
+        """
+        if TRACK_ID in df.columns and TRACK_ID not in columns:
+            df = df.drop(columns=TRACK_ID)
+        return df
 
     def write(self, frmt):
         self.akwargs['index'] = False
         print(f'{threading.current_thread().name}: writing ... ')
-        method = WRITE_FRMT.get(frmt)
-        if method:
-            write_method = getattr(self.df, method)
-            self.file_lock.acquire()
-            # print(self.df)
-            write_method(self.fn, **self.akwargs)
-            self.file_lock.release()
-            return True
+        if frmt in WRITE_FRMT:
+            with self.file_lock.exclusive():
+                try:
+                    return self._write(frmt)
+                finally:
+                    # the dedup index only follows appends, see dedup_index
+                    invalidate(self.fn)
+
+    def _write(self, frmt):
+        if frmt == '.parquet' and parquet_dataset.is_dataset(self.fn):
+            return parquet_dataset.replace(self.df, self.fn)
+        if frmt == '.sql':
+            # rewritten in place, see sqlite_db.rewrite
+            return write_frame(self.df, self.fn, frmt)
+        # readers see the old or the new file, never a partial one
+        with atomic_write(self.fn) as tmp:
+            return write_frame(self.df, tmp, frmt, **self.akwargs)
+
+    def stored_keys(self, frmt):
+        """
+        Yield only the columns the dedup keys are computed from
+        (KEY_COLUMNS), chunk by chunk.
+        """
+        return iter_stored_keys(self.fn, frmt)
+
+    def _new_rows(self, frmt):
+        """
+        Return the rows of self.df whose dedup key is not stored yet, and
+        their key hashes.
+
+        The keys are looked up in the db's sidecar DedupIndex, which is
+        only rebuilt from the KEY_COLUMNS when it is missing or stale.
+        """
+        index = open_index(self.fn)
+        if index.stale():
+            index.rebuild(h for chunk in self.stored_keys(frmt)
+                          for h in frame_hashes(chunk))
+        hashes = frame_hashes(self.df)
+        # the index is looked up in place, only the keys of this batch are
+        # collected, to drop its own duplicates
+        batch = set()
+        is_new = []
+        for h in hashes:
+            is_new.append(h not in index and h not in batch)
+            batch.add(h)
+        return self.df[is_new], [h for h, new in zip(hashes, is_new) if new]
+
+    def _append_csv(self, df):
+        exists = os.path.exists(self.fn) and os.path.getsize(self.fn) > 0
+        if exists:
+            header = pd.read_csv(self.fn, nrows=0).columns
+            df = self._fit_columns(df, header)
+            if set(header) != set(df.columns):
+                return False
+            df = df[list(header)]
+        df.to_csv(self.fn, mode='a', header=not exists, index=False,
+                  encoding='utf-8')
+        return True
+
+    def _append_jsonl(self, df):
+        lines = df.to_json(**WRITE_ARGS['.jsonl'])
+        with open(self.fn, 'a+b') as f:
+            if f.tell() > 0:
+                # end a row cut short by a crashed writer on its own line
+                f.seek(f.tell() - 1)
+                if f.read(1) != b'\n':
+                    lines = '\n' + lines
+            f.write((lines if lines.endswith('\n') else lines + '\n').encode('utf-8'))
+        return True
+
+    def _append_hdf(self, df):
+        if os.path.exists(self.fn):
+            with pd.HDFStore(self.fn, mode='r') as store:
+                if f'/{HDF_KEY}' in store.keys():
+                    df = self._fit_columns(df, store.select(HDF_KEY, stop=0).columns)
+        df = self._hdf_frame(df)
+        itemsize = {col: HDF_MIN_ITEMSIZE.get(col, HDF_DEFAULT_ITEMSIZE)
+                    for col in df.columns if df[col].dtype == object
+                    or pd.api.types.is_string_dtype(df[col])}
+        df.to_hdf(self.fn, key=HDF_KEY, format='table', append=True,
+                  data_columns=[c for c in SUBSET if c in df.columns], min_itemsize=itemsize,
+                  index=False)
+        return True
+
+    def _append_parquet(self, df):
+        stored = parquet_dataset.columns(self.fn)
+        if stored is not None:
+            df = self._fit_columns(df, stored)
+            if set(stored) != set(df.columns):
+                return False
+            df = df[stored]
+        parquet_dataset.append(self.fn, df)
+        return True
+
+    def _append_sql(self, df):
+        added = sqlite_db.upsert(self.fn, df)
+        print(f'{threading.current_thread().name}: {added} new rows')
+        return True
+
+    def append_rows(self, frmt):
+        """
+        Append the rows that are not in the db yet to the end of the file.
+
+        Duplicates are found with the db's DedupIndex, which is updated
+        once the rows are written; the file is never read back or
+        rewritten in full. The lookup and the append happen under the
+        exclusive db lock, so two writers cannot both add the same row.
+
+        SQLite databases drop duplicates on their own UNIQUE index (see
+        sqlite_db), the lock keeps their appends out of a rewrite. Parquet
+        rows are appended as new part files of a partitioned dataset; a
+        single Parquet file raises ValueError and is rewritten by the caller.
+        """
+        if frmt == '.sql':
+            with self.file_lock.exclusive():
+                return self._append_sql(self.df)
+        if frmt == '.parquet' and not parquet_dataset.is_dataset(self.fn):
+            raise ValueError('not a partitioned dataset, see parquet_dataset.convert')
+        with self.file_lock.exclusive():
+            df, hashes = self._new_rows(frmt)
+            if len(df) == 0:
+                print(f'{threading.current_thread().name}: nothing new to write')
+                return True
+            print(f'{threading.current_thread().name}: appending {len(df)} rows ... ')
+            append_method = getattr(self, APPEND_FRMT[frmt])
+            status = append_method(df)
+            if status:
+                open_index(self.fn).add(hashes)
+        if not status:
+            print(f'file: {self.fn} has an incompatibale structure with you data')
+        return status
 
     def run(self):
+        _, frmt = os.path.splitext(self.fn)
+        if self.append and frmt in APPEND_FRMT and not self.fail:
+            try:
+                return executor.submit_io(self.append_rows, frmt).result()
+            except (ValueError, TypeError) as e:
+                # e.g. an HDF file written in fixed format, rewrite it
+                print(f'Cannot append to {self.fn}: {e}')
 
+        return executor.submit_io(self.rewrite).result()
+
+    def rewrite(self):
+        """
+        Merge the rows with the db and write it back in full.
+
+        The db is read and written under one exclusive db lock, so no
+        other writer's rows are lost in between.
+        """
+        with self.file_lock.exclusive():
+            return self._rewrite()
+
+    def _rewrite(self):
+        name, frmt = os.path.splitext(self.fn)
+        if frmt in CHUNK_WRITE_FRMT and os.path.exists(self.fn) and not self.fail \
+                and not parquet_dataset.is_dataset(self.fn):
+            return self._stream_rewrite(frmt)
         orig_df = ReadDb(self.fn, **self.akwargs).read_db()
+        if isinstance(orig_df, pd.DataFrame) and not self.fail:
+            # a db written before rows had a track id, or rows without one
+            for df in (orig_df, self.df):
+                if TRACK_ID not in df.columns:
+                    df[TRACK_ID] = track_ids(df)
 
         if not isinstance(orig_df, pd.DataFrame):
             print(f'No existing file: {self.fn}')
@@ -92,23 +463,52 @@ class Write2Db(Constant):
             print(f'Choose a different name')
             return False
         else:
-            self.df = pd.concat([orig_df, self.df]).reset_index(
-                drop=True).drop_duplicates(subset=SUBSET)
+            self.df = drop_duplicate_keys(
+                pd.concat([orig_df, self.df]).reset_index(drop=True))
         if self.fail:
             return False
 
-        name, frmt = os.path.splitext(self.fn)
-        rgx = '|'.join(map(lambda c: c.strip(
-            '.'), WRITE_FRMT))
-        rgx = rf'({rgx})'
         if frmt not in WRITE_FRMT:
             frmt = '.csv'
             print('Unsupported file extension.')
             print(f'Writing {name}.csv in default format CSV')
 
-        async_result = self.pool.apply_async(self.write, (frmt,))
-        status = async_result.get()
-        return status
+        return self.write(frmt)
+
+    def _stream_rewrite(self, frmt):
+        """
+        Rewrite the db chunk by chunk, followed by the new rows.
+
+        Only one chunk and the dedup keys are held in memory; the first
+        row of every key is kept, as in drop_duplicate_keys. SQLite
+        databases read their old rows while the new ones are inserted in
+        the same file, see ChunkWriter.
+        """
+        if TRACK_ID not in self.df.columns:
+            self.df[TRACK_ID] = track_ids(self.df)
+        seen = set()
+
+        def unseen(df):
+            # a db written before rows had a track id, or rows without one
+            df = df.assign(**{TRACK_ID: track_ids(df)})
+            is_new = []
+            for h in frame_hashes(df):
+                is_new.append(h not in seen)
+                seen.add(h)
+            return df[is_new]
+
+        print(f'{threading.current_thread().name}: writing ... ')
+        with ChunkWriter(self.fn, frmt) as out:
+            for chunk in ReadDb(self.fn).iter_chunks():
+                if set(chunk.columns) | {TRACK_ID} != set(self.df.columns):
+                    print(f'file: {self.fn} has an incompatibale structure with you data')
+                    print(f'Choose a different name')
+                    # leaves the db untouched, see ChunkWriter
+                    out.abort()
+                    return False
+                out.write(unseen(chunk))
+            out.write(unseen(self.df))
+        return True
 
 
 if __name__ == "__main__":